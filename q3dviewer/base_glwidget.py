@@ -9,6 +9,7 @@ import numpy as np
 from q3dviewer.Qt import QtCore, QtGui
 from q3dviewer.utils.maths import frustum, euler_to_matrix, makeT
 from q3dviewer.Qt.QtWidgets import QOpenGLWidget
+from q3dviewer.utils.upload_worker import UploadWorker
 
 
 class BaseGLWidget(QOpenGLWidget):
@@ -29,6 +30,10 @@ class BaseGLWidget(QOpenGLWidget):
         self.need_recalc_view = True
         self.view_matrix = self.get_view_matrix()
         self.projection_matrix = self.get_projection_matrix()
+        self._upload_worker = None
+        self._pick_fbo = None
+        self._pick_buffers = None
+        self._pick_size = 0
 
     def keyPressEvent(self, ev: QtGui.QKeyEvent):
         if ev.key() == QtCore.Qt.Key_Up or  \
@@ -97,6 +102,115 @@ class BaseGLWidget(QOpenGLWidget):
         self.view_matrix = self.get_view_matrix()
         self.update_model_view()
 
+    def upload_worker(self):
+        """
+        Return the worker uploading large buffers in background.
+        It is created on the first call, so call it while the context of
+        the widget is current (i.e. from item.paint()).
+        Return None if the shared context is not available.
+        """
+        if self._upload_worker is None:
+            try:
+                self._upload_worker = UploadWorker(self.context())
+            except RuntimeError as e:
+                print(f"Upload in background is disabled: {e}")
+                self._upload_worker = False
+        return self._upload_worker or None
+
+    def pick(self, x, y, radius=5):
+        """
+        Find the points drawn around the widget position (x, y), in the
+        same coordinates as mouse events. The items draw the indices of
+        their points into a small integer framebuffer around (x, y), with
+        the projection narrowed to it, and only that window is read back.
+        Return a list of hits sorted by the distance to (x, y) on screen,
+        then by depth. Each hit is the dict given by item.pick_info(index)
+        with item, index, pixel (distance to (x, y)) and depth added.
+        """
+        ratio = self.devicePixelRatioF()
+        width, height = self.current_width(), self.current_height()
+        r = int(np.ceil(radius * ratio))
+        size = 2 * r + 1
+        # pixel under the cursor in window coordinates (origin bottom left)
+        wx = int(x * ratio) + 0.5
+        wy = height - int(y * ratio) - 0.5
+        pick_matrix = np.array([[width / size, 0, 0, (width - 2 * wx) / size],
+                                [0, height / size, 0, (height - 2 * wy) / size],
+                                [0, 0, 1, 0],
+                                [0, 0, 0, 1]])
+        projection_matrix = pick_matrix @ self.projection_matrix
+
+        self.makeCurrent()
+        self.update_pick_framebuffer(size)
+        glBindFramebuffer(GL_FRAMEBUFFER, self._pick_fbo)
+        glViewport(0, 0, size, size)
+        glClearBufferuiv(GL_COLOR, 0, np.zeros(4, dtype=np.uint32))
+        glClear(GL_DEPTH_BUFFER_BIT)
+        glEnable(GL_DEPTH_TEST)
+        glDisable(GL_BLEND)
+        for i, item in enumerate(self.items):
+            if item.visible() and item.is_initialized():
+                item.paint_pick(i + 1, projection_matrix, size)
+        glReadBuffer(GL_COLOR_ATTACHMENT0)
+        ids = glReadPixels(0, 0, size, size, GL_RG_INTEGER, GL_UNSIGNED_INT)
+        ids = np.frombuffer(ids, dtype=np.uint32).reshape(size, size, 2)
+        depth = glReadPixels(0, 0, size, size, GL_DEPTH_COMPONENT, GL_FLOAT)
+        depth = np.frombuffer(depth, dtype=np.float32).reshape(size, size)
+        glDisable(GL_DEPTH_TEST)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.defaultFramebufferObject())
+        glViewport(0, 0, width, height)
+        self.doneCurrent()
+
+        rows, cols = np.nonzero(ids[:, :, 0])
+        pixel = np.hypot(rows - r, cols - r)
+        inside = pixel <= r
+        rows, cols, pixel = rows[inside], cols[inside], pixel[inside]
+        order = np.lexsort((depth[rows, cols], pixel))
+        hits = []
+        found = set()
+        for k in order:
+            item_id, index = ids[rows[k], cols[k]]
+            if (item_id, index) in found:
+                continue
+            found.add((item_id, index))
+            item = self.items[item_id - 1]
+            hit = item.pick_info(int(index))
+            if hit is None:
+                continue
+            hit.update({'item': item, 'index': int(index),
+                        'pixel': float(pixel[k]) / ratio,
+                        'depth': float(depth[rows[k], cols[k]])})
+            hits.append(hit)
+        return hits
+
+    def pick_point(self, x, y, radius=5):
+        """
+        Return the hit closest to (x, y), None if no point is there.
+        """
+        hits = self.pick(x, y, radius)
+        return hits[0] if hits else None
+
+    def update_pick_framebuffer(self, size):
+        if self._pick_fbo is not None and self._pick_size == size:
+            return
+        if self._pick_fbo is None:
+            self._pick_fbo = glGenFramebuffers(1)
+            self._pick_buffers = glGenRenderbuffers(2)
+        color, depth = self._pick_buffers
+        glBindRenderbuffer(GL_RENDERBUFFER, color)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RG32UI, size, size)
+        glBindRenderbuffer(GL_RENDERBUFFER, depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24,
+                              size, size)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, self._pick_fbo)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0,
+                                  GL_RENDERBUFFER, color)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT,
+                                  GL_RENDERBUFFER, depth)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.defaultFramebufferObject())
+        self._pick_size = size
+
     def set_view_matrix(self, view_matrix):
         self.view_matrix = view_matrix
         self.need_recalc_view = False
@@ -64,6 +64,19 @@ class BaseItem(QObject):
         """
         pass
 
+    def paint_pick(self, pick_id, projection_matrix, width):
+        """
+        Render the index of each element as uvec2(pick_id, index) for picking.
+        Items that support picking override it together with pick_info.
+        """
+        pass
+
+    def pick_info(self, index):
+        """
+        Return a dict describing the picked element index.
+        """
+        return None
+
     def disable_setting(self):
         self._disable_setting = True
 
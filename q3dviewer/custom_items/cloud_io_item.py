@@ -6,16 +6,117 @@ Distributed under MIT license. See LICENSE for more information.
 from q3dviewer.custom_items.cloud_item import CloudItem
 from pathlib import Path
 import os
-from q3dviewer.Qt.QtWidgets import QPushButton, QLabel, QLineEdit, QMessageBox
-from q3dviewer.utils.cloud_io import save_pcd, save_ply, save_e57, save_las, load_pcd, load_ply, load_e57, load_las
+import threading
+from q3dviewer.Qt.QtWidgets import QPushButton, QLabel, QLineEdit, QMessageBox, QProgressBar
+from q3dviewer.Qt.QtCore import QThread, Signal
+from q3dviewer.utils.cloud_io import save_pcd, save_ply, save_e57, save_las, load_cloud
+from q3dviewer.utils.cloud_cache import CloudCache
+
+
+SAVE_FUNCS = {'.pcd': save_pcd, '.ply': save_ply,
+              '.e57': save_e57, '.las': save_las}
+
+
+class SaveCancelled(Exception):
+    pass
+
+
+class CloudSnapshot:
+    """
+    The points of a CloudItem to save, read chunk by chunk by the writer
+    (see CloudItem.read_points), so nothing is copied up front and the
+    item keeps taking data. The points appended after the snapshot are
+    not saved; the points overwritten in place (ring buffer, voxels) are
+    saved as they are when their chunk is read.
+    """
+    def __init__(self, item):
+        self.item = item
+        with item.mutex:
+            self.top = item.buff_top
+            self.layout = item.buff.dtype
+        self.dtype = item.read_points(0, 0).dtype
+        self.shape = (self.top,)
+
+    def iter_chunks(self, chunk_points):
+        step = max(chunk_points, 1)
+        for start in range(0, self.top, step):
+            end = min(start + step, self.top)
+            chunk = self.item.read_points(start, end)
+            if self.item.buff.dtype != self.layout or \
+                    chunk.dtype != self.dtype or \
+                    chunk.shape[0] != end - start:
+                raise ValueError("The cloud is replaced while saving.")
+            yield chunk
+
+
+class CloudSaverThread(QThread):
+    """
+    Write a cloud (or a CloudSnapshot) with func(cloud, path, progress=) in
+    the background. The file is written to a temporary file first, so a
+    cancelled or failed save leaves the old file untouched.
+    """
+    progress = Signal(int)  # percent of the points written
+    saved = Signal(str)  # the result message
+
+    def __init__(self, cloud, path, func):
+        super().__init__()
+        self.cloud = cloud
+        self.path = path
+        self.func = func
+        self.cancelled = False
+        self.percent = -1
+
+    def cancel(self):
+        self.cancelled = True
+
+    def report(self, written, total):
+        if self.cancelled:
+            raise SaveCancelled()
+        percent = int(written * 100 / max(total, 1))
+        if percent != self.percent:
+            self.percent = percent
+            self.progress.emit(percent)
+
+    def run(self):
+        root, ext = os.path.splitext(self.path)
+        tmp = f"{root}.{os.getpid()}.tmp{ext}"
+        try:
+            self.func(self.cloud, tmp, progress=self.report)
+            os.replace(tmp, self.path)
+            msg = "Save cloud to  %s" % self.path
+        except Exception as e:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            if isinstance(e, SaveCancelled):
+                msg = "Save to %s is cancelled" % self.path
+            else:
+                print(e)
+                msg = "Cannot save to %s" % self.path
+        self.saved.emit(msg)
+
 
 class CloudIOItem(CloudItem):
     """
     add save/load function to CloudItem
+    cache: a CloudCache (or True for the default one) to keep the loaded
+      clouds on disk, so a file is parsed only the first time it is opened.
+      The entry of a new file is written in a background thread.
+    fields: the attribute fields loaded with the points if the file has
+      them (e.g. ['classification', 'gps_time']), none by default, as each
+      field adds 4 bytes to every point.
+    The clouds are saved in a background thread chunk by chunk, the item
+    keeps drawing and taking data meanwhile.
     """
-    def __init__(self, **kwargs):
+    def __init__(self, cache=None, fields=None, **kwargs):
         super().__init__(**kwargs)
         self.save_path = str(Path(os.path.expanduser("~"), "data.pcd"))
+        self.cache = CloudCache() if cache is True else cache
+        self.fields = list(fields) if fields else None
+        self.cache_thread = None
+        self.saver = None
+        self.save_button = None
+        self.save_bar = None
+        self.save_msg = None
 
     def add_setting(self, layout):
         super().add_setting(layout)
@@ -26,72 +127,91 @@ class CloudIOItem(CloudItem):
         box4.setText(self.save_path)
         box4.textChanged.connect(self.set_path)
         layout.addWidget(box4)
-        save_button = QPushButton("Save Cloud")
-        save_button.clicked.connect(self.save)
-        layout.addWidget(save_button)
+        self.save_button = QPushButton("Save Cloud")
+        self.save_button.clicked.connect(self.save)
+        layout.addWidget(self.save_button)
+        self.save_bar = QProgressBar()
+        self.save_bar.setRange(0, 100)
+        self.save_bar.setVisible(self.saver is not None)
+        layout.addWidget(self.save_bar)
         self.save_msg = QMessageBox()
         self.save_msg.setIcon(QMessageBox.Information)
         self.save_msg.setWindowTitle("save")
         self.save_msg.setStandardButtons(QMessageBox.Ok)
 
     def save(self):
-        cloud = self.buff[:self.valid_buff_top]
-        func = None
-        if self.save_path.endswith(".pcd"):
-            from q3dviewer.utils.cloud_io import save_pcd
-            func = save_pcd
-        elif self.save_path.endswith(".ply"):
-            from q3dviewer.utils.cloud_io import save_ply
-            func = save_ply
-        elif self.save_path.endswith(".e57"):
-            from q3dviewer.utils.cloud_io import save_e57
-            func = save_e57
-        elif self.save_path.endswith(".las"):
-            from q3dviewer.utils.cloud_io import save_las
-            func = save_las
-        elif self.save_path.endswith(".tif") or self.save_path.endswith(".tiff"):
+        """
+        Start saving the cloud to save_path, or cancel the running save.
+        """
+        if self.saver is not None:
+            self.saver.cancel()
+            return
+        ext = os.path.splitext(self.save_path)[1].lower()
+        if ext in ('.tif', '.tiff'):
             print("Do not support save as tif type!")
-        else:
+            return
+        if ext not in SAVE_FUNCS:
             print("Unsupported cloud file type!")
-        try:
-            func(cloud, self.save_path)
-            self.save_msg.setText("Save cloud to  %s" % self.save_path)
-        except Exception as e:
-            print(e)
-            self.save_msg.setText("Cannot save to %s" % self.save_path)
+            return
+        self.saver = CloudSaverThread(CloudSnapshot(self), self.save_path,
+                                      SAVE_FUNCS[ext])
+        self.saver.progress.connect(self.on_save_progress)
+        self.saver.saved.connect(self.on_saved)
+        if self.save_button is not None:
+            self.save_button.setText("Cancel Save")
+            self.save_bar.setValue(0)
+            self.save_bar.setVisible(True)
+        self.saver.start()
+
+    def on_save_progress(self, percent):
+        if self.save_bar is not None:
+            self.save_bar.setValue(percent)
+
+    def on_saved(self, msg):
+        self.saver.wait()
+        self.saver = None
+        print(msg)
+        if self.save_button is not None:
+            self.save_button.setText("Save Cloud")
+            self.save_bar.setVisible(False)
+        if self.save_msg is not None:
+            self.save_msg.setText(msg)
             self.save_msg.exec()
-        self.save_msg.exec()
 
     def load(self, file, append=False):
         # print("Try to load %s ..." % file)
-        if file.endswith(".pcd"):
-            from q3dviewer.utils.cloud_io import load_pcd
-            cloud = load_pcd(file)
-        elif file.endswith(".ply"):
-            from q3dviewer.utils.cloud_io import load_ply
-            cloud = load_ply(file)
-        elif file.endswith(".e57"):
-            from q3dviewer.utils.cloud_io import load_e57
-            cloud = load_e57(file)
-        elif file.endswith(".las"):
-            from q3dviewer.utils.cloud_io import load_las
-            cloud = load_las(file)
-        else:
-            print("Not supported file type.")
+        try:
+            cached = self.cache.lookup(file, self.fields) \
+                if self.cache is not None else None
+            if cached is not None:
+                cloud = cached[0]
+            else:
+                cloud = load_cloud(file, fields=self.fields)
+        except ValueError as e:
+            print(e)
             return
         self.set_data(data=cloud, append=append)
-
-        has_intensity = cloud['irgb'][0] & 0xff000000 > 0
-        has_rgb = cloud['irgb'][0] & 0x00ffffff > 0
-
-        if has_rgb:
-            self.set_color_mode('RGB')
-        elif has_intensity:
-            self.set_color_mode('I')
-        else:
-            self.set_color_mode('FLAT')
-
+        self.set_color_mode(self.auto_color_mode(cloud))
+        if self.cache is not None and cached is None:
+            # write the cache entry in the background, not before the
+            # first frame
+            self.cache_thread = threading.Thread(
+                target=self.cache.store, args=(file, cloud, self.fields))
+            self.cache_thread.start()
         return cloud
 
+    @staticmethod
+    def auto_color_mode(cloud):
+        """
+        The color mode for the cloud, decided by its first point.
+        """
+        if cloud.shape[0] == 0:
+            return 'FLAT'
+        if cloud['irgb'][0] & 0x00ffffff > 0:
+            return 'RGB'
+        if cloud['irgb'][0] & 0xff000000 > 0:
+            return 'I'
+        return 'FLAT'
+
     def set_path(self, path):
         self.save_path = path
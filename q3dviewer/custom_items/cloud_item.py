@@ -10,49 +10,213 @@ from OpenGL.GL import *
 from OpenGL.GL import shaders
 
 import threading
+import time
 import os
 from q3dviewer.Qt.QtWidgets import QLabel, QLineEdit, QDoubleSpinBox, QComboBox, QCheckBox
 from q3dviewer.utils.range_slider import RangeSlider
-from q3dviewer.utils import set_uniform
+from q3dviewer.utils import set_uniform, resize_buffer
 from q3dviewer.utils import text_to_rgba
+from q3dviewer.utils.octree import build_octree, select_nodes
+from q3dviewer.utils.voxel_hash import VoxelHash
+from q3dviewer.utils.colormap import COLORMAPS, get_lut, lut_scale, \
+    create_lut_texture
+from q3dviewer.utils.quantize import compact_type, quantize_points, \
+    dequantize_points, chunk_blocks
 from q3dviewer.Qt import Q3D_DEBUG
 
 
+def _field_names(dtype):
+    """
+    The scalar attribute fields of a cloud dtype, besides xyz and irgb.
+    """
+    return [name for name in dtype.names or ()
+            if name not in ('xyz', 'irgb') and not name.startswith('_')
+            and dtype[name].shape == ()]
+
+
+def _average_points(data, inv, weight):
+    """
+    Weighted average of the points with the same group index inv,
+    the intensity and rgb channels are averaged separately.
+    """
+    num = int(inv.max()) + 1 if inv.shape[0] > 0 else 0
+    weight = weight.astype(np.float64)
+    total = np.bincount(inv, weight, num)
+    out = np.empty(num, data.dtype)
+    xyz = data['xyz'].astype(np.float64)
+    for i in range(3):
+        out['xyz'][:, i] = np.bincount(inv, xyz[:, i] * weight, num) / total
+    channels = np.ascontiguousarray(data['irgb']).view(np.uint8).reshape(-1, 4)
+    mean = np.empty((num, 4), dtype=np.uint8)
+    for i in range(4):
+        mean[:, i] = np.round(
+            np.bincount(inv, channels[:, i] * weight, num) / total)
+    out['irgb'] = mean.view('<u4').reshape(-1)
+    for name in _field_names(data.dtype):
+        out[name] = np.bincount(inv, data[name] * weight, num) / total
+    return out
+
+
 # draw points with color (x, y, z, color)
 class CloudItem(BaseItem):
     def __init__(self, size, alpha, 
                  color_mode='I', 
                  color='white', 
                  point_type='PIXEL', 
-                 depth_test=False):
+                 depth_test=False,
+                 octree=False,
+                 point_budget=5000000,
+                 voxel_size=None,
+                 voxel_mode='first',
+                 ring_size=None,
+                 quantize_error=None,
+                 colormap='rainbow',
+                 color_field=None,
+                 decay_window=None,
+                 decay_fade=True):
+        """
+        octree: reorder the cloud into a LOD octree, only the nodes
+          inside the view are drawn, refined by their size on screen
+          until point_budget points are drawn. Appended points are drawn
+          unsorted until the octree is rebuilt (see set_octree_data), so
+          it suits clouds loaded in a few pieces, not streamed scans.
+        voxel_size: keep at most one point per voxel, points falling into
+          known voxels are not uploaded again. voxel_mode decides what
+          happens to them:
+          'first': keep the stored point, drop the new one
+          'replace': overwrite the stored point with the new one
+          'average': average the position and color of the voxel
+        ring_size: keep only the latest ring_size points in a fixed size
+          buffer, appended points overwrite the oldest ones.
+        quantize_error: store the positions as int16 offsets in spatial
+          chunks (10 bytes per point instead of 16), the decoded positions
+          are within quantize_error of the input on each axis (up to
+          float32 rounding).
+        colormap: colormap of the intensity mode, one of
+          utils.colormap.COLORMAPS (i.e. 'rainbow', 'turbo', 'viridis').
+        color_field: the attribute field colored in the 'FIELD' color mode.
+          Besides xyz and irgb, the scalar fields of the data given to
+          set_data (i.e. 'height', 'ring', 'timestamp') are stored as
+          float32 with every point, so the colored field can be switched
+          without uploading the cloud again.
+        decay_window: hide the points which arrived more than decay_window
+          seconds before the current time (see set_data stamp and
+          set_current_time), or fade them out when decay_fade is True.
+          The age is computed on the gpu, so only a uniform is updated
+          per frame.
+          With voxel_size, use voxel_mode 'replace' so that the voxels
+          seen again get the new stamp.
+        """
         super().__init__()
         self.STRIDE = 16  # stride of cloud array
-        self.valid_buff_top = 0
-        self.add_buff_loc = 0
+        self.valid_buff_top = 0  # number of points in the vbo
+        self.buff_top = 0  # number of points in the cpu buffer
         self.alpha = alpha
         self.size = size
         self.point_type = point_type
         self.mutex = threading.Lock()
         self.data_type = [('xyz', '<f4', (3,)), ('irgb', '<u4')]
+        self.dtype = np.dtype(self.data_type)
+        # allocations and copies made by set_data, for debugging
+        self.counters = {'alloc': 0, 'alloc_bytes': 0,
+                         'copy': 0, 'copy_bytes': 0}
         self.color = color
         try:
             self.flat_rgb = text_to_rgba(color, flat=True)
         except ValueError:
             print(f"Invalid color: {color}, please use matplotlib color format")
             exit(1)
-        self.mode_table = {'FLAT': 0,  'I': 1,  'RGB': 2, 'GRAY': 3}
+        self.mode_table = {'FLAT': 0,  'I': 1,  'RGB': 2, 'GRAY': 3,
+                           'FIELD': 4}
         self.point_type_table = {'PIXEL': 0, 'SQUARE': 1, 'SPHERE': 2}
         self.color_mode = self.mode_table[color_mode]
         self.CAPACITY = 10000000  # 10MB * 3 (x,y,z, color) * 4
         self.vmin = 0
         self.vmax = 255
+        get_lut(colormap)  # raise ValueError if the colormap is unknown
+        self.colormap = colormap
+        self.colormap_texture = None
+        self.need_update_colormap = True
+        # attribute fields stored with the points
+        self.field_names = []
+        self.field_ranges = {}  # name: (min, max) of the stored values
+        self.color_field = color_field
+        self.layout_changed = False
+        # time decay settings, stamps are stored as seconds from time_origin
+        self.decay_window = decay_window if decay_window else 0.
+        self.decay_fade = decay_fade
+        self.time_origin = None
+        self.current_time = None  # None: the latest stamp
         self.buff = np.empty((0), self.data_type)
-        self.wait_add_data = None
+        self.dirty_ranges = []  # [start, end) of buff not uploaded yet
+        self.vbo_capacity = 0
+        self.upload_job = None
+        # upload in background if the buffer is larger than it (bytes)
+        self.async_upload_size = 1 << 24
+        # max bytes and seconds spent on uploading in one frame
+        self.upload_budget = 1 << 26
+        self.upload_time_budget = 0.008
+        self.UPLOAD_CHUNK = 1 << 22  # bytes per glBufferSubData call
+        self.buff_replaced = False
+        self.wait_sources = []  # memmap data not copied to buff yet
         self.need_update_setting = True
         self.max_cloud_size = 300000000
+        self.max_vbo_bytes = None  # the gl limit, see update_max_cloud_size
         # Enable depth test when full opaque
         self.depth_test = depth_test
         self.path = os.path.dirname(__file__)
+        # LOD octree settings
+        self.octree = octree
+        self.point_budget = point_budget
+        self.octree_node_capacity = 20000
+        self.octree_max_depth = 12
+        self.min_node_size = 1.  # stop refining nodes smaller than it (pixel)
+        self.nodes = None
+        self.wait_nodes = None
+        self.octree_top = 0  # points indexed by the octree
+        # rebuild the octree when the appended points exceed this ratio
+        # of the indexed points
+        self.octree_rebuild_ratio = 0.5
+        self.draw_ranges = None
+        self.draw_ranges_key = None
+        # voxel deduplication settings
+        if voxel_mode not in {'first', 'replace', 'average'}:
+            raise ValueError(f"Invalid voxel mode: {voxel_mode}")
+        if voxel_size is not None and octree:
+            raise ValueError("voxel_size can't be used with octree mode.")
+        self.voxel_mode = voxel_mode
+        self.voxel_hash = None if voxel_size is None else VoxelHash(voxel_size)
+        self.voxel_count = np.zeros(0, dtype=np.uint32)
+        self.PAGE_SIZE = 4096  # points per sub upload of modified voxels
+        # ring buffer settings
+        if ring_size is not None and (octree or voxel_size is not None):
+            raise ValueError(
+                "ring_size can't be used with octree or voxel_size.")
+        self.ring_size = ring_size
+        self.ring_head = 0
+        self.ring_draw_head = 0
+        # compact storage settings
+        if quantize_error is not None and (
+                octree or voxel_size is not None or ring_size is not None):
+            raise ValueError("quantize_error can't be used with octree, "
+                             "voxel_size or ring_size.")
+        if quantize_error is not None and quantize_error <= 0:
+            raise ValueError("quantize_error must be positive.")
+        self.quantize_error = quantize_error
+        self.BLOCK_SIZE = 256  # points per entry of the chunk index
+        self.chunks = np.empty((0, 4), np.float32)  # origin xyz, step
+        self.chunk_starts = np.empty(0, np.uint32)  # first point of chunks
+        self.chunk_top = 0
+        self.chunk_dirty = None  # first chunk not uploaded yet
+        self.chunk_capacity = 0  # number of chunks in the chunk tbos
+        self.block_capacity = 0  # number of entries in the chunk index tbo
+        # tbos and textures of the chunk table, starts and index
+        self.chunk_tbos = None
+        self.chunk_textures = None
+        if quantize_error is not None:
+            self.STRIDE = 10
+            self.buff = np.empty((0), compact_type)
+        self.gpu_dtype = self.buff.dtype  # layout of the points in the vbo
 
     def add_setting(self, layout):
         label_ptype = QLabel("Point Type:")
@@ -90,6 +254,7 @@ class CloudItem(BaseItem):
         self.combo_color.addItem("intensity")
         self.combo_color.addItem("RGB")
         self.combo_color.addItem("gray")
+        self.combo_color.addItem("field")
         self.combo_color.setCurrentIndex(self.color_mode)
         self.combo_color.currentIndexChanged.connect(self._on_color_mode)
         layout.addWidget(self.combo_color)
@@ -103,11 +268,32 @@ class CloudItem(BaseItem):
         self.edit_rgb.textChanged.connect(self._on_color)
         layout.addWidget(self.edit_rgb)
 
+        self.combo_field = QComboBox()
+        self.combo_field.currentTextChanged.connect(self._on_field)
+        layout.addWidget(self.combo_field)
+
+        self.combo_colormap = QComboBox()
+        for name in COLORMAPS:
+            self.combo_colormap.addItem(name)
+        self.combo_colormap.setCurrentText(self.colormap)
+        self.combo_colormap.currentTextChanged.connect(self.set_colormap)
+        layout.addWidget(self.combo_colormap)
+
         self.slider_v = RangeSlider()
         self.slider_v.setRange(0, 255)
         self.slider_v.rangeChanged.connect(self._on_range)
         layout.addWidget(self.slider_v)
 
+        box_decay = QDoubleSpinBox()
+        box_decay.setPrefix("Decay Window (s): ")
+        box_decay.setToolTip("Hide the points older than it, 0 to keep all")
+        box_decay.setDecimals(1)
+        box_decay.setRange(0, 100000)
+        box_decay.setValue(self.decay_window)
+        box_decay.valueChanged.connect(
+            lambda v: self.set_decay(v, self.decay_fade))
+        layout.addWidget(box_decay)
+
         self.checkbox_depth_test = QCheckBox(
             "Show front points first (Depth Test)")
         self.checkbox_depth_test.setChecked(self.depth_test)
@@ -115,6 +301,17 @@ class CloudItem(BaseItem):
         self._on_color_mode(self.color_mode)
         layout.addWidget(self.checkbox_depth_test)
 
+        if self.octree:
+            box_budget = QDoubleSpinBox()
+            box_budget.setPrefix("Point Budget (M): ")
+            box_budget.setSingleStep(0.5)
+            box_budget.setDecimals(1)
+            box_budget.setRange(0.1, 1000)
+            box_budget.setValue(self.point_budget / 1e6)
+            box_budget.valueChanged.connect(
+                lambda v: self.set_point_budget(int(v * 1e6)))
+            layout.addWidget(box_budget)
+
     def _on_range(self, lower, upper):
         self.vmin = lower
         self.vmax = upper
@@ -124,17 +321,48 @@ class CloudItem(BaseItem):
         self.color_mode = index
         self.edit_rgb.hide()
         self.slider_v.hide()
+        self.combo_colormap.hide()
+        self.combo_field.hide()
         if (index == self.mode_table['FLAT']):  # flat color
             self.edit_rgb.show()
         elif (index == self.mode_table['I']):  # flat color
             self.slider_v.show()
+            self.combo_colormap.show()
         elif (index == self.mode_table['GRAY']):  # flat color
             self.slider_v.show()
+        elif (index == self.mode_table['FIELD']):
+            self.update_field_combo()
+            self.combo_field.show()
+            self.combo_colormap.show()
+            self.slider_v.show()
 
         self.need_update_setting = True
 
+    def update_field_combo(self):
+        # the fields are known only after the data is set
+        self.combo_field.blockSignals(True)
+        self.combo_field.clear()
+        for name in self.field_names:
+            self.combo_field.addItem(name)
+        if self.color_field in self.field_names:
+            self.combo_field.setCurrentText(self.color_field)
+        elif self.field_names:
+            self.color_field = self.field_names[0]
+        self.combo_field.blockSignals(False)
+
+    def _on_field(self, name):
+        if name:
+            self.color_field = name
+
+    def set_color_field(self, name):
+        """
+        Color the points by the attribute field name.
+        """
+        self.color_field = name
+        self.set_color_mode('FIELD')
+
     def set_color_mode(self, color_mode):
-        if color_mode in {'FLAT', 'RGB', 'I', 'GRAY'}:
+        if color_mode in {'FLAT', 'RGB', 'I', 'GRAY', 'FIELD'}:
             try:
                 self.combo_color.setCurrentIndex(self.mode_table[color_mode])
             except:
@@ -143,6 +371,13 @@ class CloudItem(BaseItem):
         else:
             print(f"Invalid color mode: {color_mode}")
 
+    def set_colormap(self, name):
+        if name not in COLORMAPS:
+            print(f"Invalid colormap: {name}")
+            return
+        self.colormap = name
+        self.need_update_colormap = True
+
     def _on_point_type_selection(self, index):
         self.point_type = list(self.point_type_table.keys())[index]
         if self.point_type == 'PIXEL':
@@ -184,40 +419,523 @@ class CloudItem(BaseItem):
     def set_depthtest(self, state):
         self.depth_test = state
 
+    def set_decay(self, window, fade=True):
+        """
+        Hide (or fade out when fade is True) the points older than
+        window seconds, 0 to keep all points.
+        """
+        self.decay_window = window
+        self.decay_fade = fade
+
+    def set_current_time(self, t):
+        """
+        The time (seconds, same clock as the stamps of set_data) the ages
+        of the points are computed from, None to follow the latest stamp.
+        """
+        self.current_time = t
+
+    def set_upload_budget(self, budget, time_budget=None):
+        """
+        Set the max bytes (and seconds) spent on uploading in one frame.
+        """
+        self.upload_budget = budget
+        if time_budget is not None:
+            self.upload_time_budget = time_budget
+
+    def set_point_budget(self, point_budget):
+        self.point_budget = point_budget
+        self.draw_ranges_key = None
+
     def clear(self):
         data = np.empty((0), self.data_type)
         self.set_data(data)
 
-    def set_data(self, data, append=False):
+    def set_data(self, data, append=False, stamp=None):
+        """
+        The data is written into the cpu buffer by the caller thread,
+        the modified range is uploaded to the gpu by the render thread.
+        stamp: arrival time of the points (seconds, a scalar or one per
+          point), stored in the 'stamp' field for the time decay.
+        """
         if not isinstance(data, np.ndarray):
             raise ValueError("Input data must be a numpy array.")
+        data = self.to_cloud(data)
+        if stamp is not None:
+            data = self.add_stamp(data, stamp)
+
+        if self.octree:
+            self.set_octree_data(data, append)
+            return
+
+        if self.voxel_hash is not None:
+            self.set_voxel_data(data, append)
+            return
 
+        if self.quantize_error is not None:
+            self.set_compact_data(data, append)
+            return
+
+        with self.mutex:
+            if self.ring_size is not None:
+                self.write_ring(data, append)
+            else:
+                self.write_points(data, append)
+
+    def to_cloud(self, data):
+        """
+        Convert the input to data_type. Packed inputs (data_type, or a
+        contiguous float32 Nx4 array with color bits in the 4th column)
+        are used as they are, without any copy.
+        """
+        if data.dtype == self.dtype:
+            return data
+        names = data.dtype.names or ()
+        if 'xyz' in names and 'irgb' in names:
+            dtype = self.cloud_dtype(_field_names(data.dtype))
+            if data.dtype == dtype:
+                return data
+            return self.match_fields(data, _field_names(data.dtype))
+        if data.dtype == np.float32 and data.ndim == 2 and \
+                data.shape[1] == 4 and data.flags.c_contiguous:
+            return data.view(self.dtype).reshape(-1)
         if data.dtype in {np.dtype('float32'), np.dtype('float64')}:
             if data.size == 0:
                 data = np.empty((0), self.data_type)
             elif data.ndim == 2 and data.shape[1] >= 3:
                 xyz = data[:, :3]
                 if data.shape[1] >= 4:
-                    color = data[:, 3].view(np.uint32)
+                    color = data[:, 3].astype(np.float32).view(np.uint32)
                 else:
                     color = np.zeros(data.shape[0], dtype=np.uint32)
                 data = np.rec.fromarrays(
                     [xyz, color[:data.shape[0]]], dtype=self.data_type)
+                self.count_copy(data.nbytes, alloc=True)
+        return data
 
-        with self.mutex:
-            if append:
-                if self.wait_add_data is None:
-                    self.wait_add_data = data
-                else:
-                    self.wait_add_data = np.concatenate(
-                        [self.wait_add_data, data])
-                self.add_buff_loc = self.valid_buff_top
+    def cloud_dtype(self, fields):
+        return np.dtype(self.data_type + [(name, '<f4') for name in fields])
+
+    def match_fields(self, data, fields):
+        """
+        Convert data to the cloud dtype with the given fields,
+        the missing fields are nan and the others are dropped.
+        """
+        out = np.empty(data.shape[0], self.cloud_dtype(fields))
+        out['xyz'] = data['xyz']
+        out['irgb'] = data['irgb']
+        for name in fields:
+            if name in data.dtype.names:
+                out[name] = data[name]
             else:
-                self.wait_add_data = data
-                self.add_buff_loc = 0
+                out[name] = np.nan
+        self.count_copy(out.nbytes, alloc=True)
+        return out
+
+    def add_stamp(self, data, stamp):
+        """
+        Return a copy of data with the 'stamp' field, float32 seconds
+        from time_origin (the first stamp) to keep the precision.
+        """
+        stamp = np.asarray(stamp, dtype=np.float64)
+        if self.time_origin is None:
+            if stamp.size == 0:
+                return data
+            self.time_origin = float(stamp.min())
+        fields = _field_names(data.dtype)
+        if 'stamp' not in fields:
+            fields.append('stamp')
+        data = self.match_fields(data, fields)
+        data['stamp'] = stamp - self.time_origin
+        return data
+
+    def update_max_cloud_size(self):
+        """
+        The max number of points in the vbo, the records grow with the
+        attribute fields, so it changes with the layout.
+        """
+        if self.max_vbo_bytes is not None:
+            self.max_cloud_size = int(self.max_vbo_bytes) // self.STRIDE
+
+    def set_layout(self, dtype):
+        """
+        Use records of dtype for the cpu buffer (and the vbo), the stored
+        points are dropped, the caller must hold the mutex.
+        """
+        self.buff = np.empty((0), dtype)
+        self.buff_top = 0
+        self.STRIDE = dtype.itemsize
+        self.update_max_cloud_size()
+        self.field_names = _field_names(dtype)
+        self.field_ranges = {}
+        self.wait_sources = []
+        self.dirty_ranges = []
+        self.layout_changed = True
+
+    def update_field_ranges(self, data):
+        for name in _field_names(data.dtype):
+            values = data[name]
+            values = values[np.isfinite(values)]
+            if values.shape[0] == 0:
+                continue
+            lo, hi = float(values.min()), float(values.max())
+            if name in self.field_ranges:
+                old_lo, old_hi = self.field_ranges[name]
+                lo, hi = min(lo, old_lo), max(hi, old_hi)
+            self.field_ranges[name] = (lo, hi)
+
+    def count_copy(self, nbytes, alloc=False):
+        self.counters['copy'] += 1
+        self.counters['copy_bytes'] += nbytes
+        if alloc:
+            self.counters['alloc'] += 1
+            self.counters['alloc_bytes'] += nbytes
+
+    def get_counters(self):
+        """
+        Return the number of allocations and copies made by set_data,
+        for debugging.
+        """
+        return dict(self.counters)
+
+    def write_points(self, data, append=False):
+        """
+        Write data after the valid points (append) or from the beginning
+        of the cpu buffer, the caller must hold the mutex.
+        Return True if the points are decimated to fit max_cloud_size.
+        """
+        if data.dtype != self.buff.dtype:
+            if append and self.buff_top > 0:
+                data = self.match_fields(data, self.field_names)
+            else:
+                self.set_layout(data.dtype)
+        loc = self.buff_top if append else 0
+        top = loc + data.shape[0]
+        decimated = False
+        if not append:
+            self.wait_sources = []
+            self.field_ranges = {}
+        if top > self.max_cloud_size:
+            # if exceed the maximum cloud size, randomly select half of the points
+            print("[Cloud Item] Exceed maximum cloud size %d, reduce the data size" % self.max_cloud_size)
+            self.flush_sources()
+            data = np.concatenate([self.buff[:loc], data])
+            while data.shape[0] > self.max_cloud_size:
+                data = data[::2]
+            loc, top = 0, data.shape[0]
+            append = False
+            decimated = True
+        self.reserve(top, keep=append)
+        if self.field_names:
+            self.update_field_ranges(data)
+        if isinstance(data, np.memmap):
+            # read the file chunk by chunk while uploading
+            self.wait_sources.append([loc, top, data, loc])
+        else:
+            self.buff[loc:top] = data
+            self.count_copy(data.nbytes)
+        self.buff_top = top
+        if not append:
+            self.dirty_ranges = []
+            self.buff_replaced = True
+        self.dirty_ranges.append((loc, top))
+        return decimated
+
+    def copy_sources(self, start, end):
+        """
+        Copy the memmap data of [start, end) into the cpu buffer,
+        the caller must hold the mutex.
+        """
+        for src in self.wait_sources:
+            loc, top, data, copied = src
+            a, b = max(start, copied), min(end, top)
+            if a < b:
+                self.buff[a:b] = data[a - loc:b - loc]
+                src[3] = max(copied, b)
+        self.wait_sources = [s for s in self.wait_sources if s[3] < s[1]]
+
+    def flush_sources(self):
+        """
+        Copy all memmap data into the cpu buffer, the caller must
+        hold the mutex.
+        """
+        for loc, top, data, copied in self.wait_sources:
+            self.buff[copied:top] = data[copied - loc:]
+        self.wait_sources = []
+
+    def reserve(self, size, keep=True):
+        """
+        Grow the cpu buffer to hold size points, the gpu buffer is
+        reallocated by the render thread, the caller must hold the mutex.
+        The capacity is doubled when the valid points are kept, so a cloud
+        built by appending is copied O(log n) times; otherwise it is
+        rounded up to CAPACITY and the old points are dropped.
+        """
+        if size <= self.buff.shape[0]:
+            return
+        if keep:
+            buff_capacity = max(self.buff.shape[0], self.CAPACITY)
+            while (size > buff_capacity):
+                buff_capacity *= 2
+        else:
+            buff_capacity = -(-size // self.CAPACITY) * self.CAPACITY
+        buff_capacity = min(buff_capacity, self.max_cloud_size)
+        if Q3D_DEBUG is not None:
+            print("[Cloud Item] Update capacity to %d" % buff_capacity)
+        new_buff = np.empty((buff_capacity), self.buff.dtype)
+        if keep:
+            new_buff[:self.buff_top] = self.buff[:self.buff_top]
+            self.count_copy(self.buff[:self.buff_top].nbytes)
+        self.counters['alloc'] += 1
+        self.counters['alloc_bytes'] += new_buff.nbytes
+        self.buff = new_buff
+        if Q3D_DEBUG is not None:
+            print("[Cloud Item] Counters: %s" % self.counters)
+
+    def write_ring(self, data, append=False):
+        """
+        Write the new points over the oldest ones, the caller must
+        hold the mutex.
+        """
+        if data.dtype != self.buff.dtype and append and self.buff_top > 0:
+            data = self.match_fields(data, self.field_names)
+        if self.buff.shape[0] != self.ring_size or \
+                data.dtype != self.buff.dtype:
+            self.set_layout(data.dtype)
+            self.buff = np.empty(self.ring_size, data.dtype)
+            append = False
+        if not append:
+            self.ring_head = 0
+            self.buff_top = 0
+            self.dirty_ranges = []
+        # older points would be overwritten anyway
+        data = data[-self.ring_size:]
+        if not append:
+            self.field_ranges = {}
+        if self.field_names:
+            self.update_field_ranges(data)
+        # at most two writes: from the head to the end, then from the start
+        while data.shape[0] > 0:
+            num = min(data.shape[0], self.ring_size - self.ring_head)
+            self.buff[self.ring_head:self.ring_head + num] = data[:num]
+            self.count_copy(data[:num].nbytes)
+            self.dirty_ranges.append((self.ring_head, self.ring_head + num))
+            self.ring_head = (self.ring_head + num) % self.ring_size
+            self.buff_top = min(self.buff_top + num, self.ring_size)
+            data = data[num:]
+
+    def set_octree_data(self, data, append=False):
+        """
+        The whole cloud is reordered by the octree. Appended data is
+        written after the indexed points and drawn unsorted, the octree
+        of the merged cloud is only rebuilt when the unsorted points
+        exceed octree_rebuild_ratio of the indexed ones: appending n
+        pieces sorts O(log n) times instead of n times.
+        """
+        if append:
+            with self.mutex:
+                unsorted = self.buff_top - self.octree_top + data.shape[0]
+                if self.octree_top > 0 and unsorted <= \
+                        self.octree_top * self.octree_rebuild_ratio and \
+                        self.buff_top + data.shape[0] <= self.max_cloud_size:
+                    self.write_points(data, append=True)
+                    return
+                if self.buff_top > 0 and data.dtype != self.buff.dtype:
+                    data = self.match_fields(data, self.field_names)
+                data = np.concatenate([self.buff[:self.buff_top], data])
+        # the node ranges can't survive the decimation in
+        # write_points, so reduce the data before building.
+        while data.shape[0] > self.max_cloud_size:
+            data = data[::2]
+        order, nodes = build_octree(data['xyz'],
+                                    node_capacity=self.octree_node_capacity,
+                                    max_depth=self.octree_max_depth)
+        data = data[order]
+        if Q3D_DEBUG is not None:
+            print("[Cloud Item] Build octree with %d nodes" % nodes.shape[0])
+        with self.mutex:
+            self.write_points(data)
+            self.wait_nodes = nodes
+            self.octree_top = data.shape[0]
+
+    def set_voxel_data(self, data, append=False):
+        """
+        Add only the points which fall into new voxels.
+        """
+        keys = self.voxel_hash.keys(data['xyz'])
+        if self.voxel_mode == 'replace':
+            # the last point of each voxel wins
+            keys, idx = np.unique(keys[::-1], return_index=True)
+            data = data[::-1][idx]
+            count = np.ones(keys.shape[0], dtype=np.uint32)
+        elif self.voxel_mode == 'average':
+            keys, inv, count = np.unique(
+                keys, return_inverse=True, return_counts=True)
+            data = _average_points(data, inv.reshape(-1),
+                                   np.ones(inv.size))
+            count = count.astype(np.uint32)
+        else:
+            keys, idx = np.unique(keys, return_index=True)
+            data = data[idx]
+            count = np.ones(keys.shape[0], dtype=np.uint32)
+
+        with self.mutex:
+            if not append:
+                self.voxel_hash.clear()
+            elif self.buff_top > 0 and data.dtype != self.buff.dtype:
+                data = self.match_fields(data, self.field_names)
+            top = self.buff_top if append else 0
+
+            slots = self.voxel_hash.lookup(keys)
+            new = slots < 0
+            new_slots = top + np.arange(np.count_nonzero(new))
+            self.voxel_hash.insert(keys[new], new_slots)
+            if self.voxel_count.shape[0] < top + new_slots.shape[0]:
+                self.voxel_count = np.concatenate(
+                    [self.voxel_count[:top],
+                     np.zeros(max(new_slots.shape[0], top), np.uint32)])
+            self.voxel_count[new_slots] = count[new]
+
+            if self.voxel_mode != 'first' and not np.all(new):
+                self.update_voxels(slots[~new], data[~new], count[~new])
+
+            if self.write_points(data[new], append):
+                self.rebuild_voxel_hash()
+
+    def set_compact_data(self, data, append=False):
+        """
+        Quantize the points and write them with their chunk origins.
+        """
+        if append:
+            with self.mutex:
+                if self.buff_top > 0:
+                    fields = self.field_names
+                    if _field_names(data.dtype) != fields:
+                        data = self.match_fields(data, fields)
+        packed, table, starts = quantize_points(data, self.quantize_error)
+        self.count_copy(packed.nbytes, alloc=True)
+        with self.mutex:
+            loc = self.buff_top if append else 0
+            if loc + packed.shape[0] > self.max_cloud_size:
+                print("[Cloud Item] Exceed maximum cloud size %d, reduce the data size" % self.max_cloud_size)
+                if append:
+                    data = np.concatenate([self.get_points(lock=False), data])
+                loc, append = 0, False
+                while data.shape[0] > self.max_cloud_size:
+                    data = data[::2]
+                packed, table, starts = quantize_points(
+                    data, self.quantize_error)
+            self.write_points(packed, append)
+            self.write_chunks(table, starts + np.uint32(loc), append)
 
+    def write_chunks(self, table, starts, append=False):
+        """
+        Write the chunks of the points written by write_points after the
+        stored chunks (append) or from the beginning, the caller must hold
+        the mutex. The chunk arrays grow like the cpu buffer.
+        """
+        loc = self.chunk_top if append else 0
+        top = loc + table.shape[0]
+        if top > self.chunks.shape[0]:
+            capacity = max(self.chunks.shape[0], 1024)
+            while top > capacity:
+                capacity *= 2
+            chunks = np.empty((capacity, 4), np.float32)
+            chunk_starts = np.empty(capacity, np.uint32)
+            chunks[:loc] = self.chunks[:loc]
+            chunk_starts[:loc] = self.chunk_starts[:loc]
+            self.chunks = chunks
+            self.chunk_starts = chunk_starts
+        self.chunks[loc:top] = table
+        self.chunk_starts[loc:top] = starts
+        self.chunk_top = top
+        if self.chunk_dirty is None or loc < self.chunk_dirty:
+            self.chunk_dirty = loc
+
+    def get_points(self, lock=True):
+        """
+        Return the points of the cpu buffer as data_type, the compact
+        storage is decoded into a new array.
+        """
+        if lock:
+            with self.mutex:
+                return self.get_points(lock=False)
+        self.flush_sources()
+        if self.quantize_error is not None:
+            top = self.chunk_top
+            return dequantize_points(self.buff[:self.buff_top],
+                                     self.chunks[:top],
+                                     self.chunk_starts[:top])
+        return self.buff[:self.buff_top]
+
+    def read_points(self, start, end):
+        """
+        Copy the points [start, end) of the cpu buffer as data_type, the
+        compact storage is decoded. The mutex is held only for this range,
+        so a long read does not block the other threads.
+        """
+        with self.mutex:
+            end = min(end, self.buff_top)
+            start = min(start, end)
+            self.copy_sources(start, end)
+            if self.quantize_error is not None:
+                top = self.chunk_top
+                return dequantize_points(self.buff[start:end],
+                                         self.chunks[:top],
+                                         self.chunk_starts[:top], start)
+            return self.buff[start:end].copy()
+
+    def update_voxels(self, slots, data, count):
+        """
+        Overwrite or average the stored points of known voxels,
+        the caller must hold the mutex.
+        """
+        if self.voxel_mode == 'average':
+            old_count = self.voxel_count[slots]
+            inv = np.concatenate([np.arange(slots.shape[0])] * 2)
+            weight = np.concatenate([old_count, count])
+            data = _average_points(
+                np.concatenate([self.buff[slots], data]), inv, weight)
+            self.voxel_count[slots] = old_count + count
+        self.buff[slots] = data
+        if self.field_names:
+            self.update_field_ranges(data)
+        for page in np.unique(slots // self.PAGE_SIZE):
+            start = int(page) * self.PAGE_SIZE
+            self.dirty_ranges.append(
+                (start, min(start + self.PAGE_SIZE, self.buff_top)))
+
+    def rebuild_voxel_hash(self):
+        """
+        Index the points of the cpu buffer again,
+        i.e. after they were decimated.
+        """
+        cloud = self.buff[:self.buff_top]
+        keys, idx = np.unique(self.voxel_hash.keys(cloud['xyz']),
+                              return_index=True)
+        self.voxel_hash.clear()
+        self.voxel_hash.insert(keys, idx)
+        self.voxel_count = np.ones(self.buff_top, dtype=np.uint32)
+
+    def update_draw_ranges(self):
+        """
+        Select the octree nodes to draw, only when the view is changed.
+        """
+        view_matrix = self.glwidget().view_matrix
+        project_matrix = self.glwidget().projection_matrix
+        width = self.glwidget().current_width()
+        key = (view_matrix.tobytes(), project_matrix.tobytes(), width)
+        if self.draw_ranges_key == key:
+            return
+        self.draw_ranges = select_nodes(self.nodes, view_matrix,
+                                        project_matrix, width,
+                                        self.point_budget,
+                                        self.min_node_size)
+        self.draw_ranges_key = key
 
     def update_setting(self):
+        if self.need_update_colormap:
+            create_lut_texture(self.colormap, self.colormap_texture)
+            self.need_update_colormap = False
         if (self.need_update_setting is False):
             return
         glUseProgram(self.program)
@@ -225,6 +943,9 @@ class CloudItem(BaseItem):
         set_uniform(self.program, int(self.color_mode), 'color_mode')
         set_uniform(self.program, float(self.vmax), 'vmax')
         set_uniform(self.program, float(self.vmin), 'vmin')
+        set_uniform(self.program, float(lut_scale(self.vmin, self.vmax)),
+                    'vscale')
+        set_uniform(self.program, 1, 'colormap')  # texture unit 1
         set_uniform(self.program, float(self.alpha), 'alpha')
         set_uniform(self.program, float(self.size), 'point_size')
         set_uniform(self.program, int(self.point_type_table[self.point_type]), 'point_type')
@@ -232,63 +953,322 @@ class CloudItem(BaseItem):
         self.need_update_setting = False
 
     def update_render_buffer(self):
-        # Ensure there is data waiting to be added to the buffer
-        if (self.wait_add_data is None):
+        """
+        Sync the gpu buffer with the cpu buffer. The modified points are
+        uploaded within the upload budget of each frame, so a large cloud
+        is shown progressively. When the buffer grows, the points already
+        in the vbo are copied on the gpu; a large buffer is grown by the
+        upload worker, the old vbo is drawn until the new one is ready.
+        """
+        if self.upload_job is not None:
+            if not self.upload_job.ready():
+                return
+            self.swap_vbo()
+
+        # Ensure there is data waiting to be uploaded
+        if not self.dirty_ranges and self.wait_nodes is None \
+                and self.vbo_capacity >= self.buff.shape[0] \
+                and not self.layout_changed:
             return
         # Acquire lock to update the buffer safely
-        self.mutex.acquire()
-
-        new_buff_top = self.add_buff_loc + self.wait_add_data.shape[0]
-        if new_buff_top > self.buff.shape[0]:
-            # if need to update buff capacity, create new cpu buff and new vbo
-            buff_capacity = self.buff.shape[0]
-            while (new_buff_top > buff_capacity):
-                buff_capacity += self.CAPACITY
-            if Q3D_DEBUG is not None:
-                print("[Cloud Item] Update capacity to %d" % buff_capacity)
-            new_buff = np.empty((buff_capacity), self.data_type)
-            new_buff[:self.add_buff_loc] = self.buff[:self.add_buff_loc]
-            new_buff[self.add_buff_loc:new_buff_top] = self.wait_add_data
-            self.buff = new_buff
+        with self.mutex:
+            if self.layout_changed:
+                # the size of the records is changed, allocate the vbo again
+                self.gpu_dtype = self.buff.dtype
+                self.vbo_capacity = 0
+                self.valid_buff_top = 0
+                self.layout_changed = False
+            if self.quantize_error is not None:
+                self.upload_chunks()
+            if self.vbo_capacity < self.buff.shape[0]:
+                if self.buff_replaced:
+                    # the old points are not needed anymore, only allocate
+                    # the vbo and upload the new points progressively.
+                    glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+                    glBufferData(GL_ARRAY_BUFFER, self.buff.nbytes,
+                                 None, GL_DYNAMIC_DRAW)
+                    glBindBuffer(GL_ARRAY_BUFFER, 0)
+                    self.vbo_capacity = self.buff.shape[0]
+                    self.valid_buff_top = 0
+                else:
+                    # the points already in the vbo are copied on the gpu,
+                    # only the new ones are uploaded from the cpu buffer.
+                    copy_bytes = min(self.vbo_capacity,
+                                     self.buff_top) * self.STRIDE
+                    worker = None
+                    if self.buff_top * self.STRIDE >= self.async_upload_size:
+                        worker = self.glwidget().upload_worker()
+                    if worker is not None:
+                        self.flush_sources()
+                        # the worker context must see the previous uploads
+                        glFlush()
+                        start = self.valid_buff_top
+                        self.upload_job = worker.upload(
+                            self.buff, self.buff_top, start=start,
+                            src_vbo=self.vbo, copy_bytes=copy_bytes)
+                        # modified points below start are still uploaded
+                        # after the swap.
+                        self.dirty_ranges = [
+                            (s, min(e, start))
+                            for s, e in self.dirty_ranges if s < start]
+                        return
+                    new_vbo = resize_buffer(self.vbo, self.buff.nbytes,
+                                            copy_bytes)
+                    glDeleteBuffers(1, [self.vbo])
+                    self.vbo = new_vbo
+                    self.vbo_capacity = self.buff.shape[0]
+            if self.buff_replaced and self.wait_nodes is not None:
+                # draw the uploaded part without the octree,
+                # the coarse levels come first in the buffer.
+                self.nodes = None
+            self.buff_replaced = False
+            if self.ring_size is not None:
+                self.upload_dirty_ranges()
+            else:
+                self.upload_dirty_ranges(self.upload_budget,
+                                         self.upload_time_budget)
+            if self.dirty_ranges:
+                self.valid_buff_top = min(self.buff_top,
+                                          self.dirty_ranges[0][0])
+            else:
+                self.valid_buff_top = self.buff_top
+            self.ring_draw_head = self.ring_head
+            if self.wait_nodes is not None and not self.dirty_ranges:
+                self.nodes = self.wait_nodes
+                self.wait_nodes = None
+                self.draw_ranges_key = None
 
-            # if exceed the maximum cloud size, randomly select half of the points
-            exceed_flag = False
-            while new_buff.shape[0] > self.max_cloud_size:
-                exceed_flag = True
-                new_buff_half = new_buff[:new_buff_top:2]
-                new_buff_top = new_buff_half.shape[0]
-                new_buff = new_buff_half
-            if exceed_flag:
-                print("[Cloud Item] Exceed maximum cloud size %d, reduce the data size" % self.max_cloud_size)
-                self.buff = self.buff[:self.max_cloud_size]
-                self.buff[:new_buff_top] = new_buff
+    def swap_vbo(self):
+        """
+        Replace the vbo with the one uploaded by the worker.
+        """
+        glDeleteBuffers(1, [self.vbo])
+        self.vbo = self.upload_job.vbo
+        self.vbo_capacity = self.upload_job.capacity
+        self.valid_buff_top = min(self.upload_job.top, self.buff_top)
+        self.upload_job = None
 
+    def upload_dirty_ranges(self, budget=None, time_budget=None):
+        """
+        Upload the modified ranges of the cpu buffer in chunks, until
+        budget bytes are uploaded or time_budget seconds are spent.
+        The rest is kept for the next frame, the caller must hold the mutex.
+        """
+        if not self.dirty_ranges:
+            return
+        ranges = sorted(self.dirty_ranges)
+        merged = [list(ranges[0])]
+        for start, end in ranges[1:]:
+            if start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
 
-            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-            glBufferData(GL_ARRAY_BUFFER, self.buff.nbytes,
-                         self.buff, GL_DYNAMIC_DRAW)
-            glBindBuffer(GL_ARRAY_BUFFER, 0)
-        else:
-            self.buff[self.add_buff_loc:new_buff_top] = self.wait_add_data
-            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-            glBufferSubData(GL_ARRAY_BUFFER, self.add_buff_loc * self.STRIDE,
-                            self.wait_add_data.shape[0] * self.STRIDE,
-                            self.wait_add_data)
-        self.valid_buff_top = new_buff_top
-        self.wait_add_data = None
-        self.mutex.release()
+        chunk = max(self.UPLOAD_CHUNK // self.STRIDE, 1)
+        start_time = time.perf_counter()
+        uploaded = 0
+        remaining = []
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        for start, end in merged:
+            end = min(end, self.buff_top)
+            while start < end:
+                # always upload at least one chunk for progress
+                if budget is not None and uploaded > 0 and \
+                        (uploaded >= budget or
+                         time.perf_counter() - start_time >= time_budget):
+                    break
+                num = end - start if budget is None else min(end - start, chunk)
+                self.copy_sources(start, start + num)
+                glBufferSubData(GL_ARRAY_BUFFER, start * self.STRIDE,
+                                num * self.STRIDE,
+                                self.buff[start:start + num])
+                start += num
+                uploaded += num * self.STRIDE
+            if start < end:
+                remaining.append((start, end))
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.dirty_ranges = remaining
+        if Q3D_DEBUG is not None and remaining:
+            print("[Cloud Item] Uploaded %d bytes, %d ranges left" %
+                  (uploaded, len(remaining)))
+
+    def upload_chunks(self):
+        """
+        Upload the chunks written since the last upload and the chunk
+        index of their points, the whole chunk table is small compared
+        with the points so it is uploaded at once.
+        """
+        blocks = self.buff.shape[0] // self.BLOCK_SIZE + 2
+        first = self.chunk_dirty
+        tbo_table, tbo_starts, tbo_blocks = self.chunk_tbos
+        if self.chunk_capacity != self.chunks.shape[0] or \
+                self.block_capacity != blocks:
+            for tbo, nbytes in ((tbo_table, self.chunks.nbytes),
+                                (tbo_starts, self.chunk_starts.nbytes),
+                                (tbo_blocks, blocks * 4)):
+                glBindBuffer(GL_TEXTURE_BUFFER, tbo)
+                glBufferData(GL_TEXTURE_BUFFER, max(nbytes, 4), None,
+                             GL_DYNAMIC_DRAW)
+            self.chunk_capacity = self.chunks.shape[0]
+            self.block_capacity = blocks
+            first = 0
+        top = self.chunk_top
+        if first is not None and first < top:
+            glBindBuffer(GL_TEXTURE_BUFFER, tbo_table)
+            glBufferSubData(GL_TEXTURE_BUFFER, first * 16, (top - first) * 16,
+                            self.chunks[first:top])
+            glBindBuffer(GL_TEXTURE_BUFFER, tbo_starts)
+            glBufferSubData(GL_TEXTURE_BUFFER, first * 4, (top - first) * 4,
+                            self.chunk_starts[first:top])
+            block = int(self.chunk_starts[first]) // self.BLOCK_SIZE
+            index = chunk_blocks(self.chunk_starts[:top], self.buff_top,
+                                 self.BLOCK_SIZE, block)
+            glBindBuffer(GL_TEXTURE_BUFFER, tbo_blocks)
+            glBufferSubData(GL_TEXTURE_BUFFER, block * 4, index.nbytes, index)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+        self.chunk_dirty = None
 
     def initialize_gl(self):
         vertex_shader = open(self.path + '/../shaders/cloud_vert.glsl', 'r').read()
         fragment_shader = open(self.path + '/../shaders/cloud_frag.glsl', 'r').read()
+        if self.quantize_error is not None:
+            vertex_shader = vertex_shader.replace(
+                '#version 330 core', '#version 330 core\n#define COMPACT', 1)
         self.program = shaders.compileProgram(
             shaders.compileShader(vertex_shader, GL_VERTEX_SHADER),
             shaders.compileShader(fragment_shader, GL_FRAGMENT_SHADER),
         )
-        self.max_cloud_size = glGetIntegerv(
-            GL_MAX_SHADER_STORAGE_BLOCK_SIZE) // self.STRIDE
+        pick_shader = open(self.path + '/../shaders/pick_frag.glsl', 'r').read()
+        self.pick_program = shaders.compileProgram(
+            shaders.compileShader(vertex_shader, GL_VERTEX_SHADER),
+            shaders.compileShader(pick_shader, GL_FRAGMENT_SHADER),
+        )
+        self.max_vbo_bytes = glGetIntegerv(GL_MAX_SHADER_STORAGE_BLOCK_SIZE)
+        self.update_max_cloud_size()
         # Bind attribute locations
         self.vbo = glGenBuffers(1)
+        self.colormap_texture = create_lut_texture(self.colormap)
+        self.need_update_colormap = False
+        if self.quantize_error is not None:
+            self.chunk_tbos = glGenBuffers(3)
+            self.chunk_textures = glGenTextures(3)
+            for tbo, texture, fmt in zip(self.chunk_tbos, self.chunk_textures,
+                                         (GL_RGBA32F, GL_R32UI, GL_R32UI)):
+                glBindBuffer(GL_TEXTURE_BUFFER, tbo)
+                glBufferData(GL_TEXTURE_BUFFER, 4, None, GL_DYNAMIC_DRAW)
+                glBindTexture(GL_TEXTURE_BUFFER, texture)
+                glTexBuffer(GL_TEXTURE_BUFFER, fmt, tbo)
+            glBindBuffer(GL_TEXTURE_BUFFER, 0)
+            glBindTexture(GL_TEXTURE_BUFFER, 0)
+
+    def bind_buffer(self, program):
+        stride = self.gpu_dtype.itemsize
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        if self.quantize_error is not None:
+            glVertexAttribPointer(0, 3, GL_SHORT, GL_FALSE,
+                                  stride, ctypes.c_void_p(0))
+            glVertexAttribIPointer(1, 2, GL_UNSIGNED_SHORT,
+                                   stride, ctypes.c_void_p(6))
+            # units 0, 2 and 3, the colormap is on unit 1
+            for unit, texture, name in zip(
+                    (0, 2, 3), self.chunk_textures,
+                    ('chunk_table', 'chunk_starts', 'chunk_blocks')):
+                glActiveTexture(GL_TEXTURE0 + unit)
+                glBindTexture(GL_TEXTURE_BUFFER, texture)
+                set_uniform(program, unit, name)
+            glActiveTexture(GL_TEXTURE0)
+            set_uniform(program, self.BLOCK_SIZE, 'block_size')
+        else:
+            glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE,
+                                  stride, ctypes.c_void_p(0))
+            glVertexAttribPointer(
+                1, 1, GL_FLOAT, GL_UNSIGNED_INT, stride, ctypes.c_void_p(12))
+        glEnableVertexAttribArray(0)
+        glEnableVertexAttribArray(1)
+
+    def bind_field(self):
+        """
+        Feed the color field to the shader, only the offset of the
+        attribute is changed when another field is chosen.
+        """
+        fields = self.gpu_dtype.fields
+        if self.color_mode != self.mode_table['FIELD'] or \
+                self.color_field not in fields:
+            glDisableVertexAttribArray(2)
+            glVertexAttrib1f(2, np.nan)
+            return
+        offset = fields[self.color_field][1]
+        glVertexAttribPointer(2, 1, GL_FLOAT, GL_FALSE,
+                              self.gpu_dtype.itemsize, ctypes.c_void_p(offset))
+        glEnableVertexAttribArray(2)
+        lo, hi = self.field_ranges.get(self.color_field, (0., 1.))
+        # the range slider (0-255) selects a part of the field range
+        fmin = lo + (hi - lo) * self.vmin / 255.
+        fmax = lo + (hi - lo) * self.vmax / 255.
+        set_uniform(self.program, float(fmin), 'fmin')
+        set_uniform(self.program, float(lut_scale(fmin, fmax)), 'fscale')
+
+    def bind_stamp(self, program, fade=True):
+        """
+        Feed the stamps and the current time to the shader for the decay.
+        fade is False for the pick program, which has no color output, so
+        the decay_fade uniform is optimized out of it.
+        """
+        fields = self.gpu_dtype.fields
+        if not self.decay_window or 'stamp' not in fields:
+            glDisableVertexAttribArray(3)
+            set_uniform(program, 0., 'decay_window')
+            return
+        glVertexAttribPointer(3, 1, GL_FLOAT, GL_FALSE,
+                              self.gpu_dtype.itemsize,
+                              ctypes.c_void_p(fields['stamp'][1]))
+        glEnableVertexAttribArray(3)
+        if self.current_time is not None:
+            now = self.current_time - self.time_origin
+        else:
+            now = self.field_ranges.get('stamp', (0., 0.))[1]
+        set_uniform(program, float(now), 'current_time')
+        set_uniform(program, float(self.decay_window), 'decay_window')
+        if fade:
+            set_uniform(program, int(self.decay_fade), 'decay_fade')
+
+    def unbind_buffer(self):
+        glDisableVertexAttribArray(0)
+        glDisableVertexAttribArray(1)
+        glDisableVertexAttribArray(2)
+        glDisableVertexAttribArray(3)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        if self.quantize_error is not None:
+            for unit in (3, 2, 0):
+                glActiveTexture(GL_TEXTURE0 + unit)
+                glBindTexture(GL_TEXTURE_BUFFER, 0)
+
+    def draw_points(self, draw_ranges=None):
+        """
+        Draw the valid points, or the octree ranges (firsts, counts).
+        """
+        if draw_ranges is not None:
+            firsts, counts = draw_ranges
+            if 0 < self.octree_top < self.valid_buff_top:
+                # the points appended after the octree was built
+                firsts = np.append(firsts, self.octree_top).astype(np.int32)
+                counts = np.append(counts, min(
+                    self.valid_buff_top - self.octree_top,
+                    self.point_budget)).astype(np.int32)
+            if firsts.shape[0] > 0:
+                glMultiDrawArrays(GL_POINTS, firsts, counts, firsts.shape[0])
+        elif self.ring_size is not None and \
+                self.valid_buff_top == self.ring_size:
+            # the oldest points start from the head of the ring
+            glDrawArrays(GL_POINTS, self.ring_draw_head,
+                         self.ring_size - self.ring_draw_head)
+            glDrawArrays(GL_POINTS, 0, self.ring_draw_head)
+        elif self.octree:
+            # the octree is not ready, the coarse levels come first
+            glDrawArrays(GL_POINTS, 0,
+                         min(self.valid_buff_top, self.point_budget))
+        else:
+            glDrawArrays(GL_POINTS, 0, self.valid_buff_top)
 
     def paint(self):
         self.update_render_buffer()
@@ -303,13 +1283,12 @@ class CloudItem(BaseItem):
 
         glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
         glUseProgram(self.program)
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE,
-                              self.STRIDE, ctypes.c_void_p(0))
-        glVertexAttribPointer(
-            1, 1, GL_FLOAT, GL_UNSIGNED_INT, self.STRIDE, ctypes.c_void_p(12))
-        glEnableVertexAttribArray(0)
-        glEnableVertexAttribArray(1)
+        self.bind_buffer(self.program)
+        self.bind_field()
+        self.bind_stamp(self.program)
+        glActiveTexture(GL_TEXTURE1)
+        glBindTexture(GL_TEXTURE_1D, self.colormap_texture)
+        glActiveTexture(GL_TEXTURE0)
 
         view_matrix = self.glwidget().view_matrix
         set_uniform(self.program, view_matrix, 'view_matrix')
@@ -319,15 +1298,82 @@ class CloudItem(BaseItem):
         focal = project_matrix[0, 0] * width / 2
         set_uniform(self.program, float(focal), 'focal')
 
-        glDrawArrays(GL_POINTS, 0, self.valid_buff_top)
+        draw_ranges = None
+        if self.nodes is not None:
+            self.update_draw_ranges()
+            draw_ranges = self.draw_ranges
+        self.draw_points(draw_ranges)
 
         # unbind VBO
-        glDisableVertexAttribArray(0)
-        glDisableVertexAttribArray(1)
-        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.unbind_buffer()
+        glActiveTexture(GL_TEXTURE1)
+        glBindTexture(GL_TEXTURE_1D, 0)
+        glActiveTexture(GL_TEXTURE0)
         glUseProgram(0)
         glDisable(GL_POINT_SPRITE)
         glDisable(GL_PROGRAM_POINT_SIZE)
         glDisable(GL_BLEND)
         if self.depth_test:
             glDisable(GL_DEPTH_TEST)  # Disable depth testing if it was enabled
+
+    def paint_pick(self, pick_id, projection_matrix, width):
+        """
+        Draw the index of every point into the pick framebuffer,
+        see BaseGLWidget.pick().
+        """
+        if self.valid_buff_top == 0:
+            return
+        glEnable(GL_PROGRAM_POINT_SIZE)
+        glEnable(GL_POINT_SPRITE)
+        glUseProgram(self.pick_program)
+        self.bind_buffer(self.pick_program)
+        self.bind_stamp(self.pick_program, fade=False)
+        view_matrix = self.glwidget().view_matrix
+        set_uniform(self.pick_program, view_matrix, 'view_matrix')
+        set_uniform(self.pick_program, projection_matrix, 'projection_matrix')
+        focal = projection_matrix[0, 0] * width / 2
+        set_uniform(self.pick_program, float(focal), 'focal')
+        set_uniform(self.pick_program, float(self.size), 'point_size')
+        set_uniform(self.pick_program,
+                    int(self.point_type_table[self.point_type]), 'point_type')
+        set_uniform(self.pick_program, int(pick_id), 'pick_id')
+        draw_ranges = None
+        if self.nodes is not None:
+            draw_ranges = self.pick_ranges(view_matrix, projection_matrix,
+                                           width)
+        self.draw_points(draw_ranges)
+        self.unbind_buffer()
+        glUseProgram(0)
+        glDisable(GL_POINT_SPRITE)
+        glDisable(GL_PROGRAM_POINT_SIZE)
+
+    def pick_ranges(self, view_matrix, projection_matrix, width):
+        """
+        The octree ranges drawn for picking, only the nodes around the
+        cursor are selected.
+        """
+        return select_nodes(self.nodes, view_matrix, projection_matrix,
+                            width, self.point_budget, self.min_node_size)
+
+    def pick_info(self, index):
+        """
+        Return the position and the color of the point index,
+        None if it is not a valid point.
+        """
+        with self.mutex:
+            if index >= self.buff_top:
+                return None
+            self.copy_sources(index, index + 1)
+            point = self.buff[index:index + 1]
+            if self.quantize_error is not None:
+                top = self.chunk_top
+                point = dequantize_points(point, self.chunks[:top],
+                                          self.chunk_starts[:top], index)
+            irgb = int(point['irgb'][0])
+            fields = {name: float(point[name][0])
+                      for name in self.field_names}
+        info = {'xyz': point['xyz'][0].astype(np.float64),
+                'irgb': irgb,
+                'intensity': irgb >> 24}
+        info.update(fields)
+        return info
@@ -8,6 +8,7 @@ from q3dviewer.base_item import BaseItem
 from OpenGL.GL import *
 import numpy as np
 import os
+import threading
 from q3dviewer.Qt.QtWidgets import QComboBox, QLabel
 from OpenGL.GL import shaders
 from q3dviewer.utils import set_uniform
@@ -17,22 +18,69 @@ def div_round_up(x, y):
     return int((x + y - 1) / y)
 
 
+RADIX_BLOCK = 256 * 16  # pairs per workgroup of radix_hist/radix_scatter
+
+
 class GaussianItem(BaseItem):
-    def __init__(self, **kwds):
+    def __init__(self, sort_method=None, **kwds):
+        """
+        sort_method: how the gaussians are sorted by depth,
+          'torch': argsort with torch on cuda (the default if available)
+          'cpu': numpy sort in a background thread (the default otherwise),
+            the gaussians are drawn in the last sorted order meanwhile,
+            so moving the camera never waits for a sort
+          'radix': radix sort by compute shaders, opt-in (never the default)
+          'bitonic': bitonic sort by compute shaders, for comparison
+        """
         super().__init__()
         self.need_updateGS = False
         self.sh_dim = 0
         self.gs_data = np.empty([0])
+        self.gs_corners = np.zeros((8, 3), np.float32)
         self.prev_Rz = np.array([np.inf, np.inf, np.inf])
         self.path = os.path.dirname(__file__)
+        self.cuda_pw = None
+        # the radix and cpu sort keys are the depths quantized to key_bits
+        # (8, 16 or 24, the float32 precision of the depths) over the depth
+        # range of the scene: 24 bits are buckets of 0.06 mm in a 1 km
+        # scene, the gaussians in the same bucket are not sorted by depth
+        self.key_bits = 24
+        # state of the cpu sorter thread, guarded by sort_cond
+        self.sort_cond = threading.Condition()
+        self.sort_thread = None
+        self.sort_stop = None  # event to stop the sorter thread
+        self.sort_request = None  # the view (Rz) to sort for
+        self.sort_pw = np.empty((0, 3), np.float32)
+        self.cpu_order = np.empty(0, np.uint32)  # the last sorted order
+        self.sorted_index = None  # sorted order not uploaded yet
+        self.sort_generation = 0  # changed by set_data
+        self.sort_methods = {'cpu': self.cpu_sort,
+                             'radix': self.radix_sort,
+                             'bitonic': self.openg_sort}
         try:
             import torch
             if not torch.cuda.is_available():
                 raise ImportError
-            self.cuda_pw = None
-            self.sort = self.torch_sort
+            self.sort_methods['torch'] = self.torch_sort
         except ImportError:
-            self.sort = self.openg_sort
+            pass
+        if sort_method is None:
+            sort_method = 'torch' if 'torch' in self.sort_methods \
+                else 'cpu'
+        self.set_sort_method(sort_method)
+
+    def set_glwidget(self, v):
+        if v is None:
+            # removed from the viewer
+            self.stop_sorter()
+        super().set_glwidget(v)
+
+    def clear(self):
+        """
+        Remove the gaussians and stop the sorter thread.
+        """
+        self.stop_sorter()
+        self.set_data(gs_data=np.empty((0, 3 + 4 + 3 + 1), np.float32))
 
     def add_setting(self, layout):
         label_render_mode = QLabel("Render Mode:")
@@ -43,6 +91,24 @@ class GaussianItem(BaseItem):
         combo.addItem("render inverse guassian")
         combo.currentIndexChanged.connect(self.onComboboxSelection)
         layout.addWidget(combo)
+        label_sort = QLabel("Sort Method:")
+        layout.addWidget(label_sort)
+        combo_sort = QComboBox()
+        for name in self.sort_methods:
+            combo_sort.addItem(name)
+        combo_sort.setCurrentText(self.sort_method)
+        combo_sort.currentTextChanged.connect(self.set_sort_method)
+        layout.addWidget(combo_sort)
+
+    def set_sort_method(self, method):
+        if method not in self.sort_methods:
+            raise ValueError(f"Unknown sort method: {method}, "
+                             f"use one of {list(self.sort_methods)}")
+        self.sort_method = method
+        self.sort = self.sort_methods[method]
+        # the index buffer is shaped for the method and sorted again
+        self.prev_Rz = np.array([np.inf, np.inf, np.inf])
+        self.need_updateGS = self.gs_data.shape[0] > 0
 
     def onComboboxSelection(self, index):
         glUseProgram(self.program)
@@ -61,6 +127,13 @@ class GaussianItem(BaseItem):
         self.sort_program = shaders.compileProgram(
             shaders.compileShader(sort_shader, GL_COMPUTE_SHADER))
 
+        self.radix_programs = {}
+        for step in ['keys', 'hist', 'scan', 'scatter']:
+            radix_shader = open(
+                self.path + f'/../shaders/radix_{step}.glsl', 'r').read()
+            self.radix_programs[step] = shaders.compileProgram(
+                shaders.compileShader(radix_shader, GL_COMPUTE_SHADER))
+
         self.prep_program = shaders.compileProgram(
             shaders.compileShader(prep_shader, GL_COMPUTE_SHADER))
 
@@ -99,6 +172,9 @@ class GaussianItem(BaseItem):
         self.ssbo_gi = glGenBuffers(1)
         self.ssbo_dp = glGenBuffers(1)
         self.ssbo_pp = glGenBuffers(1)
+        # (key, index) pairs of the radix sort (ping-pong) and block counts
+        self.ssbo_pairs = glGenBuffers(2)
+        self.ssbo_hist = glGenBuffers(1)
 
         width = self.glwidget().current_width()
         height = self.glwidget().current_height()
@@ -134,10 +210,12 @@ class GaussianItem(BaseItem):
             glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 0, self.ssbo_gs)
             glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
 
-            # set depth for sorting
+            # set depth for sorting, the padding of the bitonic sort
+            # is sorted to the end
             glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.ssbo_dp)
-            glBufferData(GL_SHADER_STORAGE_BUFFER,
-                         self.num_sort * 4, None, GL_STATIC_DRAW)
+            glBufferData(GL_SHADER_STORAGE_BUFFER, self.num_sort * 4,
+                         np.full(self.num_sort, np.inf, np.float32),
+                         GL_STATIC_DRAW)
             glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 2, self.ssbo_dp)
             glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
 
@@ -159,6 +237,18 @@ class GaussianItem(BaseItem):
             glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 3, self.ssbo_pp)
             glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
 
+            # set buffers for the radix sort, no padding
+            num = self.gs_data.shape[0]
+            for ssbo in self.ssbo_pairs:
+                glBindBuffer(GL_SHADER_STORAGE_BUFFER, ssbo)
+                glBufferData(GL_SHADER_STORAGE_BUFFER,
+                             num * 8, None, GL_DYNAMIC_COPY)
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.ssbo_hist)
+            glBufferData(GL_SHADER_STORAGE_BUFFER,
+                         256 * div_round_up(num, RADIX_BLOCK) * 4,
+                         None, GL_DYNAMIC_COPY)
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
+
             glUseProgram(self.prep_program)
             set_uniform(self.prep_program, self.sh_dim, 'sh_dim')
             set_uniform(self.prep_program,
@@ -179,6 +269,7 @@ class GaussianItem(BaseItem):
         # preprocess and sort gaussian by compute shader.
         self.preprocessGS()
         self.try_sort()
+        self.upload_sorted()
         glEnable(GL_BLEND)
         # draw by vert shader
         glUseProgram(self.program)
@@ -222,6 +313,60 @@ class GaussianItem(BaseItem):
         # glFinish()
         glUseProgram(0)
 
+    def radix_sort(self):
+        """
+        Sort the gaussians by depth with a least significant digit first
+        radix sort on the gpu: the keys are made by one dispatch, then
+        every 8 bits of the keys take 3 dispatches (count, scan, scatter).
+        """
+        num = self.gs_data.shape[0]
+        num_blocks = div_round_up(num, RADIX_BLOCK)
+        # the depth range of the scene from its bounding box
+        depth = self.gs_corners @ self.view_matrix[2, :3] + \
+            self.view_matrix[2, 3]
+        key_max = (1 << self.key_bits) - 1
+        depth_min = float(depth.min())
+        depth_scale = key_max / max(float(depth.max()) - depth_min, 1e-6)
+
+        program = self.radix_programs['keys']
+        glUseProgram(program)
+        set_uniform(program, num, 'num')
+        set_uniform(program, depth_min, 'depth_min')
+        set_uniform(program, depth_scale, 'depth_scale')
+        set_uniform(program, float(key_max), 'key_max')
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 5, self.ssbo_pairs[0])
+        glDispatchCompute(div_round_up(num, 256), 1, 1)
+        glMemoryBarrier(GL_SHADER_STORAGE_BARRIER_BIT)
+
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 6, self.ssbo_hist)
+        for i, shift in enumerate(range(0, self.key_bits, 8)):
+            glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 4,
+                             self.ssbo_pairs[i % 2])
+            glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 5,
+                             self.ssbo_pairs[1 - i % 2])
+            program = self.radix_programs['hist']
+            glUseProgram(program)
+            set_uniform(program, num, 'num')
+            set_uniform(program, shift, 'shift')
+            set_uniform(program, num_blocks, 'num_blocks')
+            glDispatchCompute(num_blocks, 1, 1)
+            glMemoryBarrier(GL_SHADER_STORAGE_BARRIER_BIT)
+            program = self.radix_programs['scan']
+            glUseProgram(program)
+            set_uniform(program, 256 * num_blocks, 'total')
+            glDispatchCompute(1, 1, 1)
+            glMemoryBarrier(GL_SHADER_STORAGE_BARRIER_BIT)
+            program = self.radix_programs['scatter']
+            glUseProgram(program)
+            set_uniform(program, num, 'num')
+            set_uniform(program, shift, 'shift')
+            set_uniform(program, num_blocks, 'num_blocks')
+            set_uniform(program, int(shift + 8 >= self.key_bits),
+                        'last_pass')
+            glDispatchCompute(num_blocks, 1, 1)
+            glMemoryBarrier(GL_SHADER_STORAGE_BARRIER_BIT)
+        glUseProgram(0)
+
     def torch_sort(self):
         import torch
         if self.cuda_pw is None:
@@ -229,13 +374,87 @@ class GaussianItem(BaseItem):
         Rz = torch.tensor(self.view_matrix[2, :3].astype(np.float32)).cuda()
         depth = Rz @ self.cuda_pw.T
         index = torch.argsort(depth).type(torch.int32).cpu().numpy()
+        # the index buffer is allocated by updateGS, only its content changes
         glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.ssbo_gi)
-        glBufferData(GL_SHADER_STORAGE_BUFFER,
-                     index.nbytes, index, GL_STATIC_DRAW)
-        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 1, self.ssbo_gi)
+        glBufferSubData(GL_SHADER_STORAGE_BUFFER, 0, index.nbytes, index)
         glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
         return index
 
+    def cpu_sort(self):
+        """
+        Ask the sorter thread to sort for the current view, it does not
+        wait for the result (see upload_sorted).
+        """
+        with self.sort_cond:
+            self.sort_request = self.view_matrix[2, :3].astype(np.float32)
+            self.sort_cond.notify()
+            if self.sort_thread is None:
+                self.sort_stop = threading.Event()
+                self.sort_thread = threading.Thread(
+                    target=self.sort_loop, args=(self.sort_stop,),
+                    daemon=True)
+                self.sort_thread.start()
+
+    def stop_sorter(self):
+        """
+        Stop the sorter thread, which holds the item and its arrays,
+        the next cpu_sort starts a new one.
+        """
+        with self.sort_cond:
+            thread, self.sort_thread = self.sort_thread, None
+            if thread is None:
+                return
+            self.sort_stop.set()
+            self.sort_cond.notify()
+        thread.join()
+
+    def sort_loop(self, stop):
+        """
+        Sort the gaussians for the latest requested view, run in the sorter
+        thread until stop is set. The keys are the depths quantized to
+        key_bits, sorted by a stable (radix) argsort in the previous order:
+        the gaussians of equal keys keep their order, so they do not flicker.
+        """
+        while True:
+            with self.sort_cond:
+                while self.sort_request is None and not stop.is_set():
+                    self.sort_cond.wait()
+                if stop.is_set():
+                    return
+                Rz, self.sort_request = self.sort_request, None
+                pw = self.sort_pw
+                corners = self.gs_corners
+                order = self.cpu_order
+                generation = self.sort_generation
+            depth = pw @ Rz
+            bound = corners @ Rz
+            key_max = (1 << self.key_bits) - 1
+            scale = key_max / max(float(bound.max() - bound.min()), 1e-6)
+            depth -= bound.min()
+            depth *= scale
+            np.clip(depth, 0, key_max, out=depth)
+            keys = depth.astype(np.uint16 if self.key_bits <= 16
+                                else np.uint32)[order]
+            # nothing to do if the previous order is still sorted
+            if np.any(keys[1:] < keys[:-1]):
+                order = order[np.argsort(keys, kind='stable')]
+            with self.sort_cond:
+                if generation == self.sort_generation:
+                    self.cpu_order = order
+                    self.sorted_index = order
+
+    def upload_sorted(self):
+        """
+        Upload the order sorted by the sorter thread, if a new one is done.
+        """
+        with self.sort_cond:
+            index, self.sorted_index = self.sorted_index, None
+        if index is None:
+            return
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.ssbo_gi)
+        glBufferSubData(GL_SHADER_STORAGE_BUFFER, 0, index.nbytes, index)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
+
     def preprocessGS(self):
         glUseProgram(self.prep_program)
         set_uniform(self.prep_program, self.view_matrix, 'view_matrix')
@@ -249,6 +468,19 @@ class GaussianItem(BaseItem):
             gs_data = kwds.pop('gs_data')
             self.gs_data = np.ascontiguousarray(gs_data, dtype=np.float32)
             self.sh_dim = self.gs_data.shape[-1] - (3 + 4 + 3 + 1)
+            pw = self.gs_data[:, :3]
+            if pw.shape[0] > 0:
+                lo, hi = pw.min(axis=0), pw.max(axis=0)
+                # the 8 corners of the bounding box
+                self.gs_corners = np.array(
+                    [[(lo, hi)[i >> k & 1][k] for k in range(3)]
+                     for i in range(8)], np.float32)
             self.prev_Rz = np.array([np.inf, np.inf, np.inf])
             self.cuda_pw = None
-            self.need_updateGS = True
+            with self.sort_cond:
+                self.sort_pw = np.ascontiguousarray(pw)
+                self.cpu_order = np.arange(pw.shape[0], dtype=np.uint32)
+                self.sorted_index = None
+                self.sort_request = None
+                self.sort_generation += 1
+            self.need_updateGS = self.gs_data.shape[0] > 0
@@ -8,15 +8,18 @@ from OpenGL.GL import *
 import numpy as np
 import threading
 from q3dviewer.Qt.QtWidgets import QLabel, QLineEdit, QDoubleSpinBox
-from q3dviewer.utils import text_to_rgba
+from q3dviewer.utils import text_to_rgba, resize_buffer
 
 
 class LineItem(BaseItem):
-    def __init__(self, width=1, color='#00ff00', line_type='LINE_STRIP'):
+    def __init__(self, width=1, color='#00ff00', line_type='LINE_STRIP',
+                 ring_size=None):
         """
         line_type: 'LINE_STRIP' or 'LINES'
           LINE_STRIP: draw a connected line strip
           LINES: draw a series of unconnected lines
+        ring_size: keep only the latest ring_size points in a fixed size
+          buffer, appended points overwrite the oldest ones.
         """
         super(LineItem, self).__init__()
         self.width = width
@@ -32,6 +35,12 @@ class LineItem(BaseItem):
             raise ValueError("Invalid color format. Use mathplotlib color format.")
 
         self.line_type = GL_LINE_STRIP if line_type == 'LINE_STRIP' else GL_LINES
+        if ring_size is not None and self.line_type == GL_LINES \
+                and ring_size % 2 != 0:
+            raise ValueError("ring_size must be even for LINES.")
+        self.ring_size = ring_size
+        self.ring_head = 0
+        self.ring_reset = False
 
     def add_setting(self, layout):
         label_color = QLabel("Color:")
@@ -69,39 +78,83 @@ class LineItem(BaseItem):
         if (append is False):
             self.wait_add_data = data
             self.add_buff_loc = 0
+            self.ring_reset = True
         else:
             if (self.wait_add_data is None):
                 self.wait_add_data = data
             else:
                 self.wait_add_data = np.concatenate([self.wait_add_data, data])
             self.add_buff_loc = self.valid_buff_top
+        if self.ring_size is not None:
+            # older points would be overwritten anyway
+            self.wait_add_data = self.wait_add_data[-self.ring_size:]
         self.mutex.release()
 
     def update_render_buffer(self):
         if (self.wait_add_data is None):
             return
         self.mutex.acquire()
+        if self.ring_size is not None:
+            self.update_ring_buffer()
+            self.mutex.release()
+            return
 
         new_buff_top = self.add_buff_loc + self.wait_add_data.shape[0]
         if new_buff_top > self.buff.shape[0]:
-            buff_capacity = self.buff.shape[0]
+            # double the capacity, the points already in the vbo are
+            # copied on the gpu instead of uploading the whole buffer.
+            buff_capacity = max(self.buff.shape[0], self.capacity)
             while (new_buff_top > buff_capacity):
-                buff_capacity += self.capacity
-            self.buff = np.empty((buff_capacity, 3), np.float32)
-            self.buff[self.add_buff_loc:new_buff_top] = self.wait_add_data
+                buff_capacity *= 2
+            new_buff = np.empty((buff_capacity, 3), np.float32)
+            new_buff[:self.add_buff_loc] = self.buff[:self.add_buff_loc]
+            self.buff = new_buff
+            new_vbo = resize_buffer(self.vbo, self.buff.nbytes,
+                                    self.add_buff_loc * 12)
+            glDeleteBuffers(1, [self.vbo])
+            self.vbo = new_vbo
+        self.buff[self.add_buff_loc:new_buff_top] = self.wait_add_data
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferSubData(GL_ARRAY_BUFFER, self.add_buff_loc * 12,
+                        self.wait_add_data.shape[0] * 12,
+                        self.wait_add_data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.valid_buff_top = new_buff_top
+        self.wait_add_data = None
+        self.mutex.release()
+
+    def update_ring_buffer(self):
+        # one more slot than ring_size, the last slot is a copy of the
+        # first one, so that the strip can be drawn across the wrap.
+        if self.buff.shape[0] != self.ring_size + 1:
+            self.buff = np.empty((self.ring_size + 1, 3), np.float32)
             glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
             glBufferData(GL_ARRAY_BUFFER, self.buff.nbytes,
-                         self.buff, GL_DYNAMIC_DRAW)
+                         None, GL_DYNAMIC_DRAW)
             glBindBuffer(GL_ARRAY_BUFFER, 0)
-        else:
-            self.buff[self.add_buff_loc:new_buff_top] = self.wait_add_data
-            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-            glBufferSubData(GL_ARRAY_BUFFER, self.add_buff_loc * 12,
-                            self.wait_add_data.shape[0] * 12,
-                            self.wait_add_data)
-        self.valid_buff_top = new_buff_top
+            self.ring_reset = True
+        if self.ring_reset:
+            self.ring_head = 0
+            self.valid_buff_top = 0
+            self.ring_reset = False
+        data = self.wait_add_data
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        while data.shape[0] > 0:
+            num = min(data.shape[0], self.ring_size - self.ring_head)
+            head = self.ring_head
+            self.buff[head:head + num] = data[:num]
+            glBufferSubData(GL_ARRAY_BUFFER, head * 12, num * 12,
+                            self.buff[head:head + num])
+            if head == 0:
+                self.buff[self.ring_size] = self.buff[0]
+                glBufferSubData(GL_ARRAY_BUFFER, self.ring_size * 12, 12,
+                                self.buff[self.ring_size])
+            self.ring_head = (head + num) % self.ring_size
+            self.valid_buff_top = min(self.valid_buff_top + num,
+                                      self.ring_size)
+            data = data[num:]
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
         self.wait_add_data = None
-        self.mutex.release()
 
     def initialize_gl(self):
         self.vbo = glGenBuffers(1)
@@ -116,7 +169,19 @@ class LineItem(BaseItem):
         glLineWidth(self.width)
         glColor4f(*self.rgb)
 
-        glDrawArrays(self.line_type, 0, self.valid_buff_top)
+        if self.ring_size is not None and \
+                self.valid_buff_top == self.ring_size:
+            # draw from the oldest point, through the copy of the
+            # first slot, then from the first slot to the newest point.
+            if self.line_type == GL_LINE_STRIP and self.ring_head > 0:
+                glDrawArrays(self.line_type, self.ring_head,
+                             self.ring_size + 1 - self.ring_head)
+            else:
+                glDrawArrays(self.line_type, self.ring_head,
+                             self.ring_size - self.ring_head)
+            glDrawArrays(self.line_type, 0, self.ring_head)
+        else:
+            glDrawArrays(self.line_type, 0, self.valid_buff_top)
         glDisableClientState(GL_VERTEX_ARRAY)
 
         glBindBuffer(GL_ARRAY_BUFFER, 0)
@@ -0,0 +1,203 @@
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+import threading
+import numpy as np
+from q3dviewer.custom_items.cloud_item import CloudItem
+from q3dviewer.utils.octree import node_priority
+from q3dviewer.utils.tiles import open_tiles
+
+
+class TiledCloudItem(CloudItem):
+    """
+    Draw a tile directory built by cloud_tiler (see utils.tiles), for
+    clouds larger than the memory. Only the nodes of the LOD cut of the
+    current view are read from the disk, into the slots of a fixed size
+    buffer; the slots of the nodes out of the cut are reused by the
+    least recently drawn first.
+    cache_ratio: number of points the buffer holds, relative to
+      point_budget, so the nodes around the view stay in the buffer.
+    """
+    def __init__(self, size, alpha, point_budget=5000000, cache_ratio=1.5,
+                 **kwargs):
+        super().__init__(size, alpha, octree=True,
+                         point_budget=point_budget, **kwargs)
+        self.cache_ratio = cache_ratio
+        self.tile_path = None
+        self.tile_points = None  # the memory mapped points of the tiles
+        self.slot_size = 0  # points per slot, the node capacity
+        self.slot_node = np.empty(0, np.int64)  # node of every slot, or -1
+        self.slot_used = np.empty(0, np.int64)  # frame the slot was drawn
+        self.node_slot = np.empty(0, np.int64)  # slot of every node, or -1
+        self.node_points = np.empty(0, np.int64)  # points in buff, or 0
+        self.node_wanted = np.empty(0, bool)  # in the cut of the view
+        self.wanted = np.empty(0, np.int64)  # the cut, by priority
+        self.frame = 0
+        self.requests = []  # nodes to read, by priority
+        self.cond = threading.Condition(self.mutex)
+        self.loader = None
+        self.stop_loader = False
+
+    def load(self, path):
+        """
+        Open a tile directory, only the nodes are read here.
+        """
+        meta, nodes, points = open_tiles(path)
+        self.close()
+        self.slot_size = meta['node_capacity']
+        num_slots = max(int(self.point_budget * self.cache_ratio) //
+                        self.slot_size, 1)
+        with self.mutex:
+            self.set_layout(points.dtype)
+            self.buff = np.empty(num_slots * self.slot_size, points.dtype)
+            self.count_copy(self.buff.nbytes, alloc=True)
+            self.buff_top = self.buff.shape[0]
+            self.buff_replaced = True
+            self.field_ranges = {name: tuple(r) for name, r in
+                                 meta['field_ranges'].items()
+                                 if name in self.field_names}
+            self.tile_path = path
+            self.tile_points = points
+            self.slot_node = np.full(num_slots, -1, np.int64)
+            self.slot_used = np.zeros(num_slots, np.int64)
+            self.node_slot = np.full(nodes.shape[0], -1, np.int64)
+            self.node_points = np.zeros(nodes.shape[0], np.int64)
+            self.node_wanted = np.zeros(nodes.shape[0], bool)
+            self.wanted = np.empty(0, np.int64)
+            self.requests = []
+            self.stop_loader = False
+            self.nodes = nodes
+            self.draw_ranges_key = None
+        self.loader = threading.Thread(target=self.load_nodes, daemon=True)
+        self.loader.start()
+        return meta
+
+    def close(self):
+        """
+        Stop reading the nodes of the current tile directory.
+        """
+        if self.loader is None:
+            return
+        with self.cond:
+            self.stop_loader = True
+            self.cond.notify()
+        self.loader.join()
+        self.loader = None
+
+    def set_data(self, data, append=False, stamp=None):
+        print("[Tiled Cloud Item] Use load() to open a tile directory.")
+
+    def free_slot(self):
+        """
+        An empty slot, or the least recently drawn slot of a node out of
+        the cut, -1 if all slots are used by the cut.
+        The caller must hold the mutex.
+        """
+        empty = np.flatnonzero(self.slot_node < 0)
+        if empty.shape[0] > 0:
+            return int(empty[0])
+        busy = self.node_wanted[self.slot_node] | \
+            (self.node_points[self.slot_node] == 0)
+        used = np.where(busy, np.iinfo(np.int64).max, self.slot_used)
+        slot = int(np.argmin(used))
+        return -1 if busy[slot] else slot
+
+    def load_nodes(self):
+        """
+        Read the requested nodes from the disk into their slots of the
+        cpu buffer, the render thread uploads them. Run in the loader.
+        """
+        while True:
+            with self.cond:
+                while not self.requests and not self.stop_loader:
+                    self.cond.wait()
+                if self.stop_loader:
+                    return
+                node = self.requests.pop(0)
+                if self.node_slot[node] >= 0:
+                    continue
+                slot = self.free_slot()
+                if slot < 0:
+                    self.requests = []
+                    continue
+                old = self.slot_node[slot]
+                if old >= 0:
+                    self.node_slot[old] = -1
+                    self.node_points[old] = 0
+                self.slot_node[slot] = node
+                self.node_slot[node] = slot
+                start = int(self.nodes['start'][node])
+                # a leaf may hold more points than a slot, its first
+                # points are a random subsample of it.
+                num = min(int(self.nodes['count'][node]), self.slot_size)
+            # read without the lock, the render thread keeps drawing
+            data = np.array(self.tile_points[start:start + num])
+            with self.mutex:
+                if self.stop_loader or self.slot_node[slot] != node:
+                    continue
+                loc = slot * self.slot_size
+                self.buff[loc:loc + num] = data
+                self.count_copy(data.nbytes)
+                self.dirty_ranges.append((loc, loc + num))
+                self.node_points[node] = num
+
+    def update_draw_ranges(self):
+        """
+        Choose the cut of the view and request its missing nodes when the
+        view is changed, and draw the nodes of the cut which are uploaded.
+        The nodes without points in the buffer are skipped, their slots
+        hold no data yet.
+        """
+        if self.nodes.shape[0] == 0:
+            return
+        view_matrix = self.glwidget().view_matrix
+        project_matrix = self.glwidget().projection_matrix
+        width = self.glwidget().current_width()
+        key = (view_matrix.tobytes(), project_matrix.tobytes(), width,
+               self.point_budget)
+        if self.draw_ranges_key != key:
+            self.select_cut(view_matrix, project_matrix, width)
+            self.draw_ranges_key = key
+        self.frame += 1
+        with self.mutex:
+            slots = self.node_slot[self.wanted]
+            counts = self.node_points[self.wanted]
+            ready = (slots >= 0) & (counts > 0)
+            # the slots still waiting for the upload are not drawn
+            for start, end in self.dirty_ranges:
+                pending = (slots >= start // self.slot_size) & \
+                    (slots <= (end - 1) // self.slot_size)
+                ready &= ~pending
+            slots = slots[ready]
+            self.slot_used[slots] = self.frame
+            counts = counts[ready]
+        self.draw_ranges = ((slots * self.slot_size).astype(np.int32),
+                            counts.astype(np.int32))
+
+    def select_cut(self, view_matrix, project_matrix, width):
+        """
+        The nodes from the largest on screen down to the point budget
+        (at most the number of slots), the missing ones are requested.
+        """
+        priority = node_priority(self.nodes, view_matrix, project_matrix,
+                                 width, self.min_node_size)
+        order = np.lexsort((self.nodes['level'], -priority))
+        order = order[(priority[order] > -np.inf) &
+                      (self.nodes['count'][order] > 0)]
+        counts = np.minimum(self.nodes['count'][order], self.slot_size)
+        num = int(np.searchsorted(np.cumsum(counts), self.point_budget,
+                                  side='right'))
+        num = min(max(num, 1), self.slot_node.shape[0])
+        wanted = order[:num]
+        with self.cond:
+            self.node_wanted[:] = False
+            self.node_wanted[wanted] = True
+            self.wanted = wanted
+            self.requests = list(wanted[self.node_slot[wanted] < 0])
+            self.cond.notify()
+
+    def pick_ranges(self, view_matrix, projection_matrix, width):
+        # the nodes drawn on the screen
+        return self.draw_ranges
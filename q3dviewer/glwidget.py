@@ -3,11 +3,15 @@ Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
 Distributed under MIT license. See LICENSE for more information.
 """
 
+import numpy as np
 from q3dviewer.Qt import QtCore
 from q3dviewer.Qt.QtWidgets import QWidget, QComboBox, QVBoxLayout, QLabel, QLineEdit, QCheckBox, QGroupBox
 from q3dviewer.Qt.QtGui import QKeyEvent
 from q3dviewer.base_glwidget import BaseGLWidget
 from q3dviewer.utils import text_to_rgba
+from q3dviewer.utils.maths import point_distance, point_angle
+from q3dviewer.custom_items.line_item import LineItem
+from q3dviewer.custom_items.text_item import Text2DItem
 
 class SettingWindow(QWidget):
     def __init__(self):
@@ -54,6 +58,12 @@ class GLWidget(BaseGLWidget):
         self.followable_item_name = None
         self.setting_window = SettingWindow()
         self.enable_show_center = True
+        # measurement by picking points with left clicks
+        self.measure_mode = 'none'  # 'none', 'distance' or 'angle'
+        self.measure_points = []
+        self.measure_line = None
+        self.measure_text = None
+        self.press_pos = None
         super(GLWidget, self).__init__()
 
     def keyPressEvent(self, ev: QKeyEvent):
@@ -97,6 +107,15 @@ class GLWidget(BaseGLWidget):
         checkbox_show_center.stateChanged.connect(self.change_show_center)
         layout.addWidget(checkbox_show_center)
 
+        label_measure = QLabel("Measure (left click on points):")
+        layout.addWidget(label_measure)
+        combo_measure = QComboBox()
+        for mode in ['none', 'distance', 'angle']:
+            combo_measure.addItem(mode)
+        combo_measure.setCurrentText(self.measure_mode)
+        combo_measure.currentTextChanged.connect(self.set_measure_mode)
+        layout.addWidget(combo_measure)
+
     def initial_followable(self):
         self.followable_item_name = ['none']
         for name, item in self.named_items.items():
@@ -126,3 +145,63 @@ class GLWidget(BaseGLWidget):
 
     def change_show_center(self, state):
         self.enable_show_center = state
+
+    def mousePressEvent(self, ev):
+        self.press_pos = ev.localPos()
+        super().mousePressEvent(ev)
+
+    def mouseReleaseEvent(self, ev):
+        if self.measure_mode != 'none' and self.press_pos is not None and \
+                ev.button() == QtCore.Qt.MouseButton.LeftButton:
+            pos = ev.localPos()
+            diff = pos - self.press_pos
+            # a click, not a drag to move the camera
+            if abs(diff.x()) + abs(diff.y()) < 3:
+                self.add_measure_point(pos.x(), pos.y())
+        self.press_pos = None
+        super().mouseReleaseEvent(ev)
+
+    def set_measure_mode(self, mode):
+        """
+        mode: 'none', 'distance' (2 points) or 'angle' (3 points,
+        the angle at the second one).
+        """
+        if mode not in {'none', 'distance', 'angle'}:
+            print(f"Invalid measure mode: {mode}")
+            return
+        self.measure_mode = mode
+        self.measure_points = []
+        self.update_measure()
+
+    def add_measure_point(self, x, y):
+        hit = self.pick_point(x, y)
+        if hit is None:
+            print("No point is picked.")
+            return
+        print("Pick point %d: (%.3f, %.3f, %.3f) intensity: %d" % (
+            hit['index'], *hit['xyz'], hit['intensity']))
+        num = 2 if self.measure_mode == 'distance' else 3
+        if len(self.measure_points) >= num:
+            self.measure_points = []
+        self.measure_points.append(hit['xyz'])
+        self.update_measure()
+
+    def update_measure(self):
+        if self.measure_line is None:
+            self.measure_line = LineItem(width=2, color='yellow')
+            self.measure_text = Text2DItem(pos=(20, 80), color='yellow')
+            self.add_item(self.measure_line)
+            self.add_item(self.measure_text)
+        points = self.measure_points
+        text = ''
+        if self.measure_mode == 'distance' and len(points) == 2:
+            text = "Distance: %.3f m" % point_distance(*points)
+        elif self.measure_mode == 'angle' and len(points) == 3:
+            text = "Angle: %.2f deg" % point_angle(*points)
+        elif points:
+            text = "Point: (%.3f, %.3f, %.3f)" % tuple(points[-1])
+        if text:
+            print(text)
+        self.measure_text.set_data(text=text)
+        line = np.array(points, dtype=np.float32).reshape(-1, 3)
+        self.measure_line.set_data(line)
@@ -5,8 +5,20 @@ Distributed under MIT license. See LICENSE for more information.
 
 #version 330 core
 
+#ifdef COMPACT
+// int16 offsets from the chunk origin, 2 x uint16 color
+layout (location = 0) in vec3 offset;
+layout (location = 1) in uvec2 value_pair;
+uniform samplerBuffer chunk_table;  // origin x, y, z, step of each chunk
+uniform usamplerBuffer chunk_starts;  // index of the first point of each chunk
+uniform usamplerBuffer chunk_blocks;  // chunk of every block_size-th point
+uniform int block_size = 256;
+#else
 layout (location = 0) in vec3 position;
 layout (location = 1) in uint value;
+#endif
+layout (location = 2) in float field;  // the attribute field to color
+layout (location = 3) in float stamp;  // arrival time of the point (s)
 
 uniform mat4 view_matrix;
 uniform mat4 projection_matrix;
@@ -15,32 +27,61 @@ uniform int color_mode = 0;
 uniform int flat_rgb = 0;
 uniform float vmin = 0;
 uniform float vmax = 255;
+uniform float vscale = 1;  // colormap size / (vmax - vmin)
+uniform sampler1D colormap;
+uniform float fmin = 0;
+uniform float fscale = 1;  // colormap size / (field max - field min)
+uniform float current_time = 0;  // the same clock as stamp
+uniform float decay_window = 0;  // 0: no decay
+uniform int decay_fade = 1;  // fade out the points instead of hiding them
 uniform float focal = 1000;
 uniform int point_type = 0; // 0 pixel, 1 flat square, 2 sphere
 uniform float point_size = 0.01;  // World size for each point (meter)
 out vec4 color;
+flat out uint vertex_id;  // index of the point, used by picking
 
-vec3 getRainbowColor(uint value_raw) {
-    float range = vmax - vmin;
-    float value = 1.0 - (float(value_raw) - vmin) / range;
-    value = clamp(value, 0.0, 1.0);
-    float hue = value * 5.0 + 1.0;
-    int i = int(floor(hue));
-    float f = hue - float(i);
-    if (mod(i, 2) == 0) f = 1.0 - f;
-    float n = 1.0 - f;
-
-    vec3 color;
-    if (i <= 1) color = vec3(n, 0.0, 1.0);
-    else if (i == 2) color = vec3(0.0, n, 1.0);
-    else if (i == 3) color = vec3(0.0, 1.0, n);
-    else if (i == 4) color = vec3(n, 1.0, 0.0);
-    else color = vec3(1.0, n, 0.0);
-    return color;
+vec3 getColormapColor(float value, float lower, float scale) {
+    // the same index as utils/colormap.py lut_index
+    int i = int(floor((value - lower) * scale));
+    i = clamp(i, 0, textureSize(colormap, 0) - 1);
+    return texelFetch(colormap, i, 0).rgb;
 }
 
 void main()
 {
+#ifdef COMPACT
+    // the chunk of the point is between the chunks of the first points
+    // of its block and of the next block, see utils/quantize.py
+    int block = gl_VertexID / block_size;
+    int lo = int(texelFetch(chunk_blocks, block).r);
+    int hi = int(texelFetch(chunk_blocks, block + 1).r);
+    while (lo < hi)
+    {
+        int mid = (lo + hi + 1) / 2;
+        if (int(texelFetch(chunk_starts, mid).r) <= gl_VertexID)
+            lo = mid;
+        else
+            hi = mid - 1;
+    }
+    vec4 chunk = texelFetch(chunk_table, lo);
+    vec3 position = chunk.xyz + offset * chunk.w;
+    uint value = value_pair.x | (value_pair.y << 16);
+#endif
+    vertex_id = uint(gl_VertexID);
+    float fade = 1.0;
+    if (decay_window > 0.0 && !isnan(stamp))
+    {
+        float age = current_time - stamp;
+        if (age > decay_window)
+        {
+            // too old, put it outside of the clip volume
+            gl_Position = vec4(2.0, 2.0, 2.0, 1.0);
+            color = vec4(0.0);
+            return;
+        }
+        if (decay_fade == 1)
+            fade = clamp(1.0 - age / decay_window, 0.0, 1.0);
+    }
     vec4 pw = vec4(position, 1.0);
     vec4 pc = view_matrix * pw;
     gl_Position = projection_matrix * pc;
@@ -54,7 +95,7 @@ void main()
     if (color_mode == 1)
     {
         uint intensity = value >> 24;
-        c = getRainbowColor(intensity);
+        c = getColormapColor(float(intensity), vmin, vscale);
     }
     else if(color_mode == 2)
     {
@@ -71,11 +112,19 @@ void main()
         c.y = value;
         c.x = value;
     }
+    else if(color_mode == 4)
+    {
+        // the points without the field are gray
+        if (isnan(field))
+            c = vec3(0.5, 0.5, 0.5);
+        else
+            c = getColormapColor(field, fmin, fscale);
+    }
     else
     {
         c.z = float( uint(flat_rgb) & uint(0x000000FF))/255.;
         c.y = float((uint(flat_rgb) & uint(0x0000FF00)) >> 8)/255.;
         c.x = float((uint(flat_rgb) & uint(0x00FF0000)) >> 16)/255.;
     }
-    color = vec4(c, alpha);
+    color = vec4(c, alpha * fade);
 }
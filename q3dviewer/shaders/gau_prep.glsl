@@ -176,7 +176,7 @@ void main()
 {
 	int gs_id = int(gl_GlobalInvocationID.x);
 
-	if (gs_id > gs_num)
+	if (gs_id >= gs_num)
 		return;
 
 	int dim_gs = 3 + 4 + 3 + 1 + sh_dim;
@@ -0,0 +1,25 @@
+/*
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+*/
+
+#version 330 core
+
+uniform int point_type;
+uniform int pick_id;  // index of the item in the glwidget + 1, 0 is no hit
+
+flat in uint vertex_id;
+
+out uvec2 pick;
+
+void main()
+{
+    // same footprint as cloud_frag.glsl
+    if (point_type == 2)
+    {
+        vec2 coord = gl_PointCoord * 2.0 - vec2(1.0);
+        if (dot(coord, coord) > 1.0)
+            discard;
+    }
+    pick = uvec2(uint(pick_id), vertex_id);
+}
@@ -0,0 +1,45 @@
+/*
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+*/
+
+/*
+opengl compute shader.
+radix sort, step 1: count the 8 bit digits of the keys of every block.
+the counts are stored digit by digit: hist[digit * num_blocks + block].
+*/
+
+#version 430 core
+
+#define ITEMS 16  // a block is 256 * ITEMS pairs
+
+layout(local_size_x = 256, local_size_y = 1, local_size_z = 1) in;
+
+uniform int num;
+uniform int shift;
+uniform int num_blocks;
+
+layout(std430, binding = 4) buffer pair_in_buffer {
+    uvec2 pairs_in[];
+};
+
+layout(std430, binding = 6) buffer hist_buffer {
+    uint hist[];
+};
+
+shared uint counts[256];
+
+void main() {
+    uint tid = gl_LocalInvocationID.x;
+    uint block = gl_WorkGroupID.x;
+    counts[tid] = 0u;
+    barrier();
+    uint start = block * 256u * ITEMS;
+    for (uint k = 0u; k < ITEMS; k++) {
+        uint i = start + k * 256u + tid;
+        if (i < uint(num))
+            atomicAdd(counts[(pairs_in[i].x >> shift) & 0xFFu], 1u);
+    }
+    barrier();
+    hist[tid * uint(num_blocks) + block] = counts[tid];
+}
@@ -0,0 +1,35 @@
+/*
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+*/
+
+/*
+opengl compute shader.
+make the (key, index) pairs of the radix sort, the key is the depth
+quantized over [depth_min, depth_min + key_max / depth_scale].
+*/
+
+#version 430 core
+
+layout(local_size_x = 256, local_size_y = 1, local_size_z = 1) in;
+
+uniform int num;
+uniform float depth_min;
+uniform float depth_scale;
+uniform float key_max;
+
+layout(std430, binding = 2) buffer key_buffer {
+    float depth[];
+};
+
+layout(std430, binding = 5) buffer pair_out_buffer {
+    uvec2 pairs_out[];
+};
+
+void main() {
+    uint i = gl_GlobalInvocationID.x;
+    if (i >= uint(num))
+        return;
+    float key = clamp((depth[i] - depth_min) * depth_scale, 0.0, key_max);
+    pairs_out[i] = uvec2(uint(key), i);
+}
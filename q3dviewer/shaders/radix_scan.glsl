@@ -0,0 +1,52 @@
+/*
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+*/
+
+/*
+opengl compute shader.
+radix sort, step 2: exclusive prefix sum of the block counts in place,
+so hist[digit * num_blocks + block] becomes the first output position of
+the digit in the block. run as a single workgroup.
+*/
+
+#version 430 core
+
+#define GROUP 1024
+
+layout(local_size_x = GROUP, local_size_y = 1, local_size_z = 1) in;
+
+uniform int total;
+
+layout(std430, binding = 6) buffer hist_buffer {
+    uint hist[];
+};
+
+shared uint sums[GROUP];
+
+void main() {
+    uint tid = gl_LocalInvocationID.x;
+    uint size = uint(total);
+    // every thread scans a contiguous segment
+    uint per = (size + GROUP - 1u) / GROUP;
+    uint begin = min(tid * per, size);
+    uint end = min(begin + per, size);
+    uint sum = 0u;
+    for (uint i = begin; i < end; i++)
+        sum += hist[i];
+    sums[tid] = sum;
+    barrier();
+    // inclusive scan of the segment sums (Hillis-Steele)
+    for (uint d = 1u; d < GROUP; d <<= 1) {
+        uint v = tid >= d ? sums[tid - d] : 0u;
+        barrier();
+        sums[tid] += v;
+        barrier();
+    }
+    uint offset = sums[tid] - sum;
+    for (uint i = begin; i < end; i++) {
+        uint count = hist[i];
+        hist[i] = offset;
+        offset += count;
+    }
+}
@@ -0,0 +1,93 @@
+/*
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+*/
+
+/*
+opengl compute shader.
+radix sort, step 3: move the pairs of every block to their output
+positions. the order of equal digits is kept (stable), which the
+least significant digit first radix sort needs. the pairs are moved 256
+at a time, the rank of a pair among those of its digit is counted from a
+256 bit mask of the threads of every digit.
+*/
+
+#version 430 core
+
+#define ITEMS 16  // a block is 256 * ITEMS pairs, the same as radix_hist
+
+layout(local_size_x = 256, local_size_y = 1, local_size_z = 1) in;
+
+uniform int num;
+uniform int shift;
+uniform int num_blocks;
+uniform int last_pass;  // write the sorted indices for drawing
+
+layout(std430, binding = 1) buffer index_buffer {
+    uint index[];
+};
+
+layout(std430, binding = 4) buffer pair_in_buffer {
+    uvec2 pairs_in[];
+};
+
+layout(std430, binding = 5) buffer pair_out_buffer {
+    uvec2 pairs_out[];
+};
+
+layout(std430, binding = 6) buffer hist_buffer {
+    uint hist[];
+};
+
+shared uint offsets[256];  // next output position of every digit
+// the threads of every digit in a round, 256 bits per digit
+shared uint masks[256 * 8];
+
+// the number of the threads of digit below thread tid in the round
+uint rank_of(uint digit, uint tid) {
+    uint row = digit * 8u;
+    uint word = tid >> 5u;
+    uint below = masks[row + word] & ((1u << (tid & 31u)) - 1u);
+    uint rank = uint(bitCount(below));
+    for (uint w = 0u; w < word; w++)
+        rank += uint(bitCount(masks[row + w]));
+    return rank;
+}
+
+void main() {
+    uint tid = gl_LocalInvocationID.x;
+    uint block = gl_WorkGroupID.x;
+    offsets[tid] = hist[tid * uint(num_blocks) + block];
+    for (uint w = 0u; w < 8u; w++)
+        masks[tid * 8u + w] = 0u;
+    barrier();
+    uint start = block * 256u * ITEMS;
+    for (uint k = 0u; k < ITEMS; k++) {
+        uint i = start + k * 256u + tid;
+        uvec2 pair = uvec2(0u);
+        bool valid = i < uint(num);
+        uint digit = 0u;
+        if (valid) {
+            pair = pairs_in[i];
+            digit = (pair.x >> shift) & 0xFFu;
+            atomicOr(masks[digit * 8u + (tid >> 5u)], 1u << (tid & 31u));
+        }
+        barrier();
+        // the rank among the pairs of the same digit in this round
+        if (valid) {
+            uint pos = offsets[digit] + rank_of(digit, tid);
+            pairs_out[pos] = pair;
+            if (last_pass != 0)
+                index[pos] = pair.y;
+        }
+        barrier();
+        // move the digit tid on by its count, clear it for the next round
+        uint count = 0u;
+        for (uint w = 0u; w < 8u; w++) {
+            count += uint(bitCount(masks[tid * 8u + w]));
+            masks[tid * 8u + w] = 0u;
+        }
+        offsets[tid] += count;
+        barrier();
+    }
+}
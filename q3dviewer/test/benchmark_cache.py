@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+this script compares opening a cloud file with and without the cloud cache.
+usage: python3 benchmark_cache.py [--path file.las] [--num 10000000]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from q3dviewer.utils.cloud_io import load_cloud, make_cloud, save_ply
+from q3dviewer.utils.cloud_cache import CloudCache
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', help='the cloud file to open')
+    parser.add_argument('--num', type=int, default=10000000,
+                        help='number of points of the generated file')
+    args = parser.parse_args()
+    tmp = tempfile.mkdtemp()
+    path = args.path
+    if path is None:
+        path = os.path.join(tmp, 'benchmark.ply')
+        rng = np.random.default_rng(0)
+        cloud = make_cloud(
+            rng.random((args.num, 3), np.float32) * 100,
+            rng.integers(0, 1 << 32, args.num, dtype=np.uint32))
+        save_ply(cloud, path)
+        del cloud
+    cache = CloudCache(os.path.join(tmp, 'cache'))
+
+    t0 = time.perf_counter()
+    cloud = load_cloud(path)
+    print(f"no cache     {time.perf_counter() - t0:7.3f} s")
+    del cloud
+    t0 = time.perf_counter()
+    cloud, _ = cache.load(path, load_cloud)
+    print(f"first open   {time.perf_counter() - t0:7.3f} s")
+    del cloud
+    t0 = time.perf_counter()
+    cloud, _ = cache.load(path, load_cloud)
+    # touch every page, as the viewer does when it copies the points
+    cloud['xyz'].sum(axis=0, dtype=np.float64)
+    print(f"second open  {time.perf_counter() - t0:7.3f} s  "
+          f"({cloud.shape[0]} points)")
+    del cloud
+    cache.clear()
+
+
+if __name__ == '__main__':
+    main()
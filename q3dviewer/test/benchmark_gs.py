@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+this script measures loading a 3D gaussian splatting ply file.
+usage: python3 benchmark_gs.py [--path scene.ply] [--num 5000000]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from q3dviewer.utils.cloud_io import PlyWriter, load_gs_ply
+
+
+def make_gs_ply(path, num, rest_dim=45, chunk_points=1 << 18):
+    names = ['x', 'y', 'z', 'nx', 'ny', 'nz'] + \
+        [f'f_dc_{i}' for i in range(3)] + \
+        [f'f_rest_{i}' for i in range(rest_dim)] + ['opacity'] + \
+        [f'scale_{i}' for i in range(3)] + [f'rot_{i}' for i in range(4)]
+    dtype = np.dtype([(name, '<f4') for name in names])
+    rng = np.random.default_rng(0)
+    with PlyWriter(path, dtype, num) as writer:
+        for start in range(0, num, chunk_points):
+            n = min(chunk_points, num - start)
+            rows = rng.standard_normal((n, len(names)), np.float32)
+            writer.write(rows.view(dtype).reshape(-1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', help='the gaussian splatting ply file')
+    parser.add_argument('--num', type=int, default=5000000,
+                        help='number of gaussians of the generated file')
+    args = parser.parse_args()
+    path = args.path
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'benchmark_gs.ply')
+        make_gs_ply(path, args.num)
+    size = os.path.getsize(path)
+    t0 = time.perf_counter()
+    gs = load_gs_ply(path)
+    elapsed = time.perf_counter() - t0
+    print(f"{gs.shape[0]} gaussians in {elapsed:.3f} s, "
+          f"{size / elapsed / (1 << 20):.0f} MB/s")
+    if args.path is None:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+this script compares the load throughput and the peak memory of the
+native pcd reader with the former pypcd4 path.
+usage: python3 benchmark_pcd.py [--path file.pcd] [--num 10000000]
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+
+def load_pypcd4(file):
+    # the former load_pcd
+    from pypcd4 import PointCloud
+    pc = PointCloud.from_path(file).pc_data
+    rgb = np.zeros([pc.shape[0]], dtype=np.uint32)
+    intensity = np.zeros([pc.shape[0]], dtype=np.uint32)
+    if 'intensity' in pc.dtype.names:
+        intensity = pc['intensity'].astype(np.uint32)
+        max_initensity = np.max(intensity)
+        if max_initensity > 255:
+            intensity = (intensity / max_initensity * 255).astype(np.uint32)
+    if 'rgb' in pc.dtype.names:
+        rgb = pc['rgb'].astype(np.uint32)
+    irgb = (intensity << 24) | rgb
+    xyz = np.stack([pc['x'], pc['y'], pc['z']], axis=1)
+    dtype = [('xyz', '<f4', (3,)), ('irgb', '<u4')]
+    return np.rec.fromarrays([xyz, irgb], dtype=dtype)
+
+
+def run(method, path):
+    # run in its own process, so the peak memory is of this method only
+    from q3dviewer.utils.cloud_io import load_pcd
+    func = load_pcd if method == 'native' else load_pypcd4
+    t0 = time.perf_counter()
+    cloud = func(path)
+    dt = time.perf_counter() - t0
+    # ru_maxrss is in KB on linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{method:8s} {dt:7.2f} s  "
+          f"{os.path.getsize(path) / dt / 1e6:8.1f} MB/s  "
+          f"peak rss {rss:8.1f} MB  ({cloud.shape[0]} points)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', help='the pcd file to load')
+    parser.add_argument('--num', type=int, default=10000000,
+                        help='number of points of the generated file')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        run(args.run, args.path)
+        return
+
+    path = args.path
+    if path is None:
+        from q3dviewer.utils.cloud_io import make_cloud, save_pcd
+        path = os.path.join(tempfile.mkdtemp(), 'benchmark.pcd')
+        rng = np.random.default_rng(0)
+        cloud = make_cloud(
+            rng.random((args.num, 3), np.float32) * 100,
+            rng.integers(0, 1 << 32, args.num, dtype=np.uint32))
+        save_pcd(cloud, path)
+        del cloud
+    print(f"{path}: {os.path.getsize(path) / 1e6:.1f} MB")
+    for method in ['native', 'pypcd4']:
+        subprocess.run([sys.executable, __file__, '--run', method,
+                        '--path', path])
+    if args.path is None:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+
+if __name__ == '__main__':
+    main()
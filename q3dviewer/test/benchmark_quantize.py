@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+this script measures the size per point of the compact storage
+(points, chunk table and chunk index) and the encoding time, on a dense
+scan and on sparse clouds where most cells hold a few points.
+"""
+
+import time
+import numpy as np
+from q3dviewer.utils.quantize import quantize_points, dequantize_points, \
+    chunk_blocks
+
+
+def make_cloud(xyz):
+    cloud = np.zeros(xyz.shape[0], [('xyz', '<f4', (3,)), ('irgb', '<u4')])
+    cloud['xyz'] = xyz
+    cloud['irgb'] = np.arange(xyz.shape[0], dtype=np.uint32)
+    return cloud
+
+
+def bench(name, cloud, error, max_bytes=None):
+    t0 = time.perf_counter()
+    packed, table, starts = quantize_points(cloud, error)
+    dt = time.perf_counter() - t0
+    index = chunk_blocks(starts, packed.shape[0])
+    size = packed.nbytes + table.nbytes + starts.nbytes + index.nbytes
+    per_point = size / cloud.shape[0]
+    # the former layout: every cell padded to 256 point chunks
+    counts = np.diff(np.append(starts, packed.shape[0]))
+    chunks = -(-counts // 256)
+    padded = (chunks.sum() * (256 * packed.itemsize + 16)) / cloud.shape[0]
+    decoded = dequantize_points(packed, table, starts)
+    order = np.argsort(decoded['irgb'])
+    err = np.abs(decoded['xyz'][order] - cloud['xyz']).max()
+    print(f"{name:24s} {per_point:6.2f} bytes/point  {table.shape[0]:8d} "
+          f"chunks  max error {err:.6f}  {dt * 1000:8.1f} ms  "
+          f"(padded chunks: {padded:.2f} bytes/point)")
+    if max_bytes is not None:
+        assert per_point <= max_bytes, \
+            f"{name}: {per_point:.2f} bytes/point > {max_bytes}"
+
+
+def main():
+    rng = np.random.default_rng(0)
+    error = 0.001
+    n = 1000000
+    dense = rng.uniform(0, 100, (n, 3))
+    # 2% outliers scattered over 10 km, each alone in its cell
+    outliers = rng.uniform(-5000, 5000, (n // 50, 3))
+    # a few points in every cell (131 m at 1 mm), like a sparse aerial scan
+    sparse = rng.uniform(-23000, 23000, (n, 3))
+    sparse[:, 2] = rng.uniform(0, 50, n)
+    bench('dense', make_cloud(dense), error, 10.1)
+    bench('dense + 2% outliers', make_cloud(np.concatenate(
+        [dense, outliers])), error, 11.)
+    bench('sparse (~8 points/cell)', make_cloud(sparse), error, 13.)
+    bench('outliers only', make_cloud(outliers), error)
+
+
+if __name__ == '__main__':
+    main()
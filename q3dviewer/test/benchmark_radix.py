@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+this script runs the radix sort of the gaussians on the gpu, checks the
+sorted order against np.argsort of the same keys, and compares its time
+with the bitonic sort and the cpu argsort.
+usage: python3 benchmark_radix.py [--num 1000000] [--key_bits 24]
+"""
+
+import argparse
+import time
+import numpy as np
+from OpenGL.GL import *
+from q3dviewer.Qt.QtGui import QOpenGLContext, QOffscreenSurface, \
+    QSurfaceFormat
+from q3dviewer.Qt.QtWidgets import QApplication
+from q3dviewer.custom_items.gaussian_item import GaussianItem
+
+
+class OffscreenWidget:
+    """
+    The parts of the glwidget a GaussianItem uses, without a window.
+    """
+    def __init__(self, width=1280, height=720):
+        self.width = width
+        self.height = height
+
+    def current_width(self):
+        return self.width
+
+    def current_height(self):
+        return self.height
+
+    def get_projection_matrix(self, fov=45., near=0.1, far=10000.):
+        f = 1. / np.tan(np.radians(fov) / 2)
+        aspect = self.width / self.height
+        return np.array([[f / aspect, 0, 0, 0],
+                         [0, f, 0, 0],
+                         [0, 0, (far + near) / (near - far),
+                          2 * far * near / (near - far)],
+                         [0, 0, -1, 0]], np.float32)
+
+
+def make_context():
+    """
+    A current opengl 4.3 context on an offscreen surface.
+    """
+    app = QApplication.instance() or QApplication([])
+    fmt = QSurfaceFormat()
+    fmt.setVersion(4, 3)
+    fmt.setProfile(QSurfaceFormat.CoreProfile)
+    surface = QOffscreenSurface()
+    surface.setFormat(fmt)
+    surface.create()
+    context = QOpenGLContext()
+    context.setFormat(fmt)
+    if not context.create() or not context.makeCurrent(surface):
+        raise RuntimeError("Cannot create an OpenGL 4.3 context.")
+    return app, surface, context
+
+
+def make_gs(num, ties=0.):
+    """
+    Random gaussians in a 1 km box, a ratio ties of them share the
+    position of another one (equal keys).
+    """
+    rng = np.random.default_rng(0)
+    gs = np.zeros((num, 3 + 4 + 3 + 1 + 3), np.float32)
+    gs[:, 0:3] = rng.uniform(-500, 500, (num, 3))
+    dup = rng.random(num) < ties
+    gs[dup, 0:3] = gs[rng.integers(0, num, dup.sum()), 0:3]
+    gs[:, 3] = 1.
+    gs[:, 7:10] = 0.05
+    gs[:, 10] = 1.
+    return gs
+
+
+def look_at(yaw, distance=1500.):
+    """
+    The view matrix of a camera on a circle around the box.
+    """
+    eye = np.array([np.cos(yaw), np.sin(yaw), 0.3]) * distance
+    z = eye / np.linalg.norm(eye)
+    x = np.cross([0., 0., 1.], z)
+    x /= np.linalg.norm(x)
+    y = np.cross(z, x)
+    view = np.eye(4)
+    view[:3, :3] = np.stack([x, y, z])
+    view[:3, 3] = -view[:3, :3] @ eye
+    return view
+
+
+def read_buffer(ssbo, dtype, count):
+    glBindBuffer(GL_SHADER_STORAGE_BUFFER, ssbo)
+    data = glGetBufferSubData(GL_SHADER_STORAGE_BUFFER, 0,
+                              count * np.dtype(dtype).itemsize)
+    glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
+    return np.frombuffer(data, dtype, count).copy()
+
+
+def timed(sort):
+    glFinish()
+    t0 = time.perf_counter()
+    sort()
+    glFinish()
+    return time.perf_counter() - t0
+
+
+def check_radix(item, view_matrix):
+    """
+    Sort for view_matrix by radix_sort, and check the sorted (key, index)
+    pairs and the index buffer against np.argsort of the gpu keys.
+    Return (ok, seconds).
+    """
+    num = item.gs_data.shape[0]
+    item.view_matrix = view_matrix
+    item.preprocessGS()
+    elapsed = timed(item.radix_sort)
+    passes = len(range(0, item.key_bits, 8))
+    pairs = read_buffer(item.ssbo_pairs[1 - (passes - 1) % 2],
+                        np.uint32, 2 * num).reshape(-1, 2)
+    index = read_buffer(item.ssbo_gi, np.uint32, num)
+    order = pairs[:, 1]
+    if not np.array_equal(np.sort(order), np.arange(num)):
+        print("the sorted indices are not a permutation")
+        return False, elapsed
+    keys = np.empty(num, np.uint32)
+    keys[order] = pairs[:, 0]
+    # the keys made on the cpu from the gpu depths, the same up to the
+    # float32 rounding (a few keys of 24 bits)
+    depth = read_buffer(item.ssbo_dp, np.float32, num)
+    corners = item.gs_corners @ view_matrix[2, :3] + view_matrix[2, 3]
+    key_max = (1 << item.key_bits) - 1
+    depth_min = np.float32(corners.min())
+    scale = np.float32(key_max / max(float(corners.max()) - depth_min,
+                                     1e-6))
+    expect = np.clip((depth - depth_min) * scale, 0, key_max)
+    if np.abs(expect.astype(np.int64) - keys).max() > 4:
+        print("the keys do not match the depths")
+        return False, elapsed
+    ref = np.argsort(keys, kind='stable')
+    ok = np.array_equal(order, ref) and np.array_equal(index, ref)
+    if not ok:
+        print(f"{np.count_nonzero(index != ref)} indices differ "
+              f"from np.argsort")
+    return ok, elapsed
+
+
+def run(num, key_bits, ties, views=4):
+    widget = OffscreenWidget()
+    item = GaussianItem(sort_method='radix')
+    item.key_bits = key_bits
+    item.set_glwidget(widget)
+    item.initialize()
+    item.set_data(gs_data=make_gs(num, ties))
+    item.updateGS()
+    radix, bitonic, cpu = [], [], []
+    for yaw in np.linspace(0, 2 * np.pi, views, endpoint=False):
+        view = look_at(yaw)
+        ok, elapsed = check_radix(item, view)
+        assert ok, f"radix sort of {num} gaussians differs at yaw {yaw:.2f}"
+        radix.append(elapsed)
+        bitonic.append(timed(item.openg_sort))
+        depth = item.gs_data[:, :3] @ view[2, :3].astype(np.float32)
+        t0 = time.perf_counter()
+        np.argsort(depth)
+        cpu.append(time.perf_counter() - t0)
+    print(f"{num:9d} gaussians, {key_bits} bit keys, {ties:.0%} ties: "
+          f"radix {np.median(radix) * 1000:8.1f} ms  "
+          f"bitonic {np.median(bitonic) * 1000:8.1f} ms  "
+          f"cpu argsort {np.median(cpu) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num', type=int, default=1000000,
+                        help='number of gaussians')
+    parser.add_argument('--key_bits', type=int, default=24,
+                        choices=[8, 16, 24])
+    args = parser.parse_args()
+    # keep the context alive while the sorts run
+    context = make_context()
+    print(glGetString(GL_RENDERER).decode())
+    # small sizes check the partial blocks, ties check the stability
+    for num in [1, 255, 4097, args.num]:
+        run(num, args.key_bits, 0.)
+    run(args.num, args.key_bits, 0.3)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+this script saves the cloud of a CloudIOItem while another thread keeps
+appending points to it, and reports the longest wait of the appends.
+usage: python3 benchmark_save.py [--num 20000000] [--ext .ply]
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+from q3dviewer.utils.cloud_io import make_cloud
+from q3dviewer.custom_items.cloud_io_item import CloudIOItem, \
+    CloudSnapshot, SAVE_FUNCS
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num', type=int, default=20000000,
+                        help='number of points of the saved cloud')
+    parser.add_argument('--ext', default='.ply', choices=list(SAVE_FUNCS))
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    cloud = make_cloud(rng.random((args.num, 3), np.float32) * 100,
+                       rng.integers(0, 1 << 32, args.num, dtype=np.uint32))
+    item = CloudIOItem(size=1, alpha=1)
+    item.set_data(cloud)
+    scan = cloud[:10000]
+    waits = []
+    stop = threading.Event()
+
+    def ingest():
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            item.set_data(scan, append=True)
+            waits.append(time.perf_counter() - t0)
+            time.sleep(0.01)
+
+    feeder = threading.Thread(target=ingest)
+    feeder.start()
+    path = os.path.join(tempfile.mkdtemp(), 'benchmark' + args.ext)
+    t0 = time.perf_counter()
+    SAVE_FUNCS[args.ext](CloudSnapshot(item), path)
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    feeder.join()
+    print(f"saved {args.num} points in {elapsed:.3f} s")
+    print(f"{len(waits)} appends while saving, "
+          f"longest {max(waits) * 1000:.1f} ms")
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+this script builds a tile directory and measures the build time and the
+time to open it, which should not depend on the number of points.
+usage: python3 benchmark_tiles.py [--path file.las ...] [--num 20000000]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from q3dviewer.utils.cloud_io import make_cloud, save_ply
+from q3dviewer.utils.tiles import build_tiles, open_tiles
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', nargs='+', help='the cloud files')
+    parser.add_argument('--num', type=int, default=20000000,
+                        help='number of points of the generated files')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    tmp = tempfile.mkdtemp()
+    paths = args.path
+    if paths is None:
+        # 4 files of terrain like points
+        rng = np.random.default_rng(0)
+        paths = []
+        for i in range(4):
+            n = args.num // 4
+            xyz = rng.random((n, 3), np.float32) * [1000, 1000, 1]
+            xyz[:, 0] += i * 1000
+            xyz[:, 2] += np.sin(xyz[:, 0] / 50) * 10
+            cloud = make_cloud(xyz, rng.integers(0, 1 << 32, n,
+                                                 dtype=np.uint32))
+            paths.append(os.path.join(tmp, f'part{i}.ply'))
+            save_ply(cloud, paths[-1])
+            del cloud, xyz
+    out = os.path.join(tmp, 'tiles')
+    t0 = time.perf_counter()
+    build_tiles(paths, out, workers=args.workers)
+    print(f"build  {time.perf_counter() - t0:8.2f} s")
+    t0 = time.perf_counter()
+    meta, nodes, points = open_tiles(out)
+    print(f"open   {time.perf_counter() - t0:8.4f} s  "
+          f"({meta['num']} points, {nodes.shape[0]} nodes)")
+    del points
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+import time
+from q3dviewer.utils.tiles import build_tiles
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="convert cloud files into a tile directory, "
+                    "which cloud_viewer opens without loading all points")
+    parser.add_argument("paths", nargs='+',
+                        help="the cloud files (pcd, ply, las/laz, e57)")
+    parser.add_argument("-o", "--output", required=True,
+                        help="the tile directory to write")
+    parser.add_argument("--node_capacity", type=int, default=20000,
+                        help="max number of points of an octree node")
+    parser.add_argument("--tile_points", type=int, default=2000000,
+                        help="max number of points of a tile built in "
+                             "one process")
+    parser.add_argument("--fields", nargs='+', default=None,
+                        help="the attribute fields to keep with the points, "
+                             "e.g. classification gps_time")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes, all cores by default")
+    args = parser.parse_args()
+    t0 = time.time()
+    build_tiles(args.paths, args.output, node_capacity=args.node_capacity,
+                tile_points=args.tile_points, workers=args.workers,
+                fields=args.fields)
+    print("Build %s in %.1f s" % (args.output, time.time() - t0))
+
+
+if __name__ == '__main__':
+    main()
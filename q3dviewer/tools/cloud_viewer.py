@@ -5,8 +5,16 @@ Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
 Distributed under MIT license. See LICENSE for more information.
 """
 
+import multiprocessing
+import os
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import q3dviewer as q3d
+from q3dviewer.utils.cloud_io import load_cloud, load_e57_scan, \
+    e57_scans, e57_intensity_scale
+from q3dviewer.utils.cloud_cache import CloudCache, load_cached
+from q3dviewer.utils.tiles import is_tile_dir
 from q3dviewer.Qt.QtWidgets import QVBoxLayout, QProgressBar, QDialog, QLabel
 from q3dviewer.Qt.QtCore import QThread, Signal
 
@@ -15,7 +23,8 @@ class ProgressDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Loading Cloud File")
-        self.setModal(True)
+        # not modal, the loaded clouds can be viewed during the loading
+        self.setModal(False)
         self.progress_bar = QProgressBar(self)
         self.file_label = QLabel(self)
         layout = QVBoxLayout()
@@ -37,25 +46,116 @@ class ProgressDialog(QDialog):
 
 
 class FileLoaderThread(QThread):
-    progress = Signal(int)
+    """
+    Load the files in a pool of processes, each cloud is appended to the
+    viewer's cloud item as soon as it is decoded, so the cloud is shown
+    while the other files are still loading. With a cache, the cached
+    files are mapped from the disk and the others are added to it.
+    """
+    progress = Signal(int)  # percent of the bytes loaded
+    loaded = Signal(object, str)  # center and color mode of the first cloud
     finished = Signal()
 
-    def __init__(self, viewer, files):
+    def __init__(self, viewer, files, workers=None, cache=None, fields=None):
         super().__init__()
         self.viewer = viewer
         self.files = files
+        self.cache = cache
+        self.fields = fields
+        self.workers = workers if workers else os.cpu_count() or 1
+        self.first = True
+        self.done_bytes = 0
+        self.total_bytes = 0
 
     def run(self):
-        cloud_item = self.viewer['cloud']
-        for i, url in enumerate(self.files):
-            file_path = url.toLocalFile()
-            self.viewer.progress_dialog.set_file_name(file_path)
-            cloud = cloud_item.load(file_path, append=(i > 0))
-            center = np.nanmean(cloud['xyz'].astype(np.float64), axis=0)
-            self.viewer.glwidget.set_cam_position(center=center)
-            self.progress.emit(int((i + 1) / len(self.files) * 100))
+        self.first = True
+        self.done_bytes = 0
+        sizes = {}
+        for file in self.files:
+            sizes[file] = os.path.getsize(file) if os.path.isfile(file) else 0
+        self.total_bytes = max(sum(sizes.values()), 1)
+        tasks = []
+        for file in self.files:
+            # cached files are mapped here, only the others are decoded
+            cached = self.cache.lookup(file, self.fields) \
+                if self.cache else None
+            if cached is not None:
+                self.add_cloud(*cached, sizes[file])
+            else:
+                tasks += self.load_tasks(file)
+        # the scans loaded of every file, cached when all are loaded
+        parts = {file: [] for file, _, num in tasks if num > 1}
+        workers = min(self.workers, len(tasks))
+        pool = None
+        if workers > 1:
+            # spawn, as forking a process with running qt threads is unsafe
+            context = multiprocessing.get_context('spawn')
+            pool = ProcessPoolExecutor(workers, mp_context=context)
+            futures = {pool.submit(load_cached, file, loader,
+                                   self.cache if num == 1 else None,
+                                   self.fields):
+                       (file, loader, num) for file, loader, num in tasks}
+            results = ((futures[f], f.result) for f in as_completed(futures))
+        else:
+            results = (((file, loader, num),
+                        partial(load_cached, file, loader,
+                                self.cache if num == 1 else None,
+                                self.fields))
+                       for file, loader, num in tasks)
+        try:
+            for (file, loader, num), result in results:
+                try:
+                    cloud, meta = result()
+                except Exception as e:
+                    print(f"Failed to load {file}: {e}")
+                    cloud, meta = None, None
+                    parts.pop(file, None)
+                self.add_cloud(cloud, meta, sizes[file] / num)
+                if file in parts and cloud is not None:
+                    parts[file].append(cloud)
+                    if len(parts[file]) == num and self.cache is not None:
+                        self.cache.store(file, parts.pop(file),
+                                         self.fields)
+        finally:
+            if pool is not None:
+                pool.shutdown()
         self.finished.emit()
 
+    def load_tasks(self, file):
+        """
+        The tasks (file, loader, number of tasks of the file) to load a
+        file: one per scan of an e57 file with several scans, so each scan
+        is shown as soon as it is decoded, otherwise one for the file.
+        """
+        if os.path.splitext(file)[1].lower() == '.e57':
+            try:
+                scans = e57_scans(file)
+            except Exception as e:
+                print(f"Failed to load {file}: {e}")
+                return []
+            if len(scans) > 1:
+                scale = e57_intensity_scale(scans)
+                return [(file, partial(load_e57_scan, scan=i,
+                                       intensity_scale=scale), len(scans))
+                        for i in range(len(scans))]
+        return [(file, load_cloud, 1)]
+
+    def add_cloud(self, cloud, meta, size):
+        if cloud is not None and cloud.shape[0] > 0:
+            cloud_item = self.viewer['cloud']
+            # set_data only writes the cpu buffer, safe from this thread
+            cloud_item.set_data(data=cloud, append=not self.first)
+            if self.first:
+                if meta is not None and 'center' in meta:
+                    center = np.array(meta['center'])
+                else:
+                    center = np.nanmean(
+                        cloud['xyz'].astype(np.float64), axis=0)
+                self.loaded.emit(center, cloud_item.auto_color_mode(cloud))
+                self.first = False
+        self.done_bytes += size
+        self.progress.emit(int(self.done_bytes * 100 / self.total_bytes))
+
 
 class CloudViewer(q3d.Viewer):
     def __init__(self, **kwargs):
@@ -72,18 +172,29 @@ class CloudViewer(q3d.Viewer):
         """
         Overwrite the drop event to open the cloud file.
         """
+        files = [url.toLocalFile() for url in event.mimeData().urls()]
+        if is_tile_dir(files[0]):
+            self.open_tile_dir(files[0])
+            return
         self.progress_dialog = ProgressDialog(self)
+        self.progress_dialog.set_file_name(
+            files[0] if len(files) == 1 else f"{len(files)} files")
         self.progress_dialog.show()
-        files = event.mimeData().urls()
-        self.progress_thread = FileLoaderThread(self, files)
-        self['cloud'].load(files[0].toLocalFile(), append=False)
+        self.progress_thread = FileLoaderThread(
+            self, files, cache=getattr(self['cloud'], 'cache', None),
+            fields=getattr(self['cloud'], 'fields', None))
         self.progress_thread.progress.connect(self.file_loading_progress)
+        self.progress_thread.loaded.connect(self.file_loaded)
         self.progress_thread.finished.connect(self.file_loading_finished)
         self.progress_thread.start()
 
     def file_loading_progress(self, value):
         self.progress_dialog.set_value(value)
 
+    def file_loaded(self, center, color_mode):
+        self['cloud'].set_color_mode(color_mode)
+        self.glwidget.set_cam_position(center=center)
+
     def file_loading_finished(self):
         self.progress_dialog.close()
 
@@ -93,25 +204,69 @@ class CloudViewer(q3d.Viewer):
             print("Can't find clouditem.")
             return
         cloud = cloud_item.load(file, append=append)
+        if cloud is None:
+            return
         center = np.nanmean(cloud['xyz'].astype(np.float64), axis=0)
         self.glwidget.set_cam_position(center=center)
 
+    def open_tile_dir(self, path):
+        """
+        Open a tile directory built by cloud_tiler, the nodes are read
+        from the disk while the view moves.
+        """
+        tiles_item = self['tiles']
+        try:
+            meta = tiles_item.load(path)
+        except (OSError, ValueError) as e:
+            print(f"Cannot open {path}: {e}")
+            return
+        tiles_item.set_color_mode(
+            q3d.CloudIOItem.auto_color_mode(tiles_item.tile_points[:1]))
+        center = np.array(meta['lo']) + meta['size'] / 2
+        self.glwidget.set_cam_position(center=center)
+
 
 def main():
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("--path", help="the cloud file path")
+    parser.add_argument("--path", help="the cloud file path, or a tile directory")
+    parser.add_argument("--octree", action="store_true",
+                        help="draw large clouds with a LOD octree")
+    parser.add_argument("--point_budget", type=int, default=5000000,
+                        help="max number of points drawn in octree mode")
+    parser.add_argument("--quantize_error", type=float, default=None,
+                        help="store the points with int16 positions, "
+                             "max position error (m)")
+    parser.add_argument("--fields", nargs='+', default=None,
+                        help="the attribute fields to load with the points, "
+                             "e.g. classification gps_time intensity")
+    parser.add_argument("--cache_size", type=float, default=0.,
+                        help="size limit (GB) of the cache of the loaded "
+                             "clouds, 0 (default) disables the cache")
+    parser.add_argument("--cache_dir", default=None,
+                        help="directory of the cache of the loaded clouds")
     args = parser.parse_args()
     app = q3d.QApplication(['Cloud Viewer'])
     viewer = CloudViewer(name='Cloud Viewer')
-    cloud_item = q3d.CloudIOItem(size=1, alpha=0.1)
+    cache = None
+    if args.cache_size > 0:
+        cache = CloudCache(args.cache_dir, int(args.cache_size * (1 << 30)))
+    cloud_item = q3d.CloudIOItem(size=1, alpha=0.1, octree=args.octree,
+                                 point_budget=args.point_budget,
+                                 quantize_error=args.quantize_error,
+                                 cache=cache, fields=args.fields)
+    tiles_item = q3d.TiledCloudItem(size=1, alpha=0.1,
+                                    point_budget=args.point_budget)
     axis_item = q3d.AxisItem(size=0.5, width=5)
     grid_item = q3d.GridItem(size=1000, spacing=20)
 
     viewer.add_items(
-        {'cloud': cloud_item, 'grid': grid_item, 'axis': axis_item})
+        {'cloud': cloud_item, 'tiles': tiles_item, 'grid': grid_item,
+         'axis': axis_item})
 
-    if args.path:
+    if args.path and is_tile_dir(args.path):
+        viewer.open_tile_dir(args.path)
+    elif args.path:
         pcd_fn = args.path
         viewer.open_cloud_file(pcd_fn)
 
@@ -386,18 +386,24 @@ class CMMViewer(q3d.Viewer):
         """
         Overwrite the drop event to open the cloud file.
         """
+        files = [url.toLocalFile() for url in event.mimeData().urls()]
         self.progress_dialog = ProgressDialog(self)
+        self.progress_dialog.set_file_name(
+            files[0] if len(files) == 1 else f"{len(files)} files")
         self.progress_dialog.show()
-        files = event.mimeData().urls()
         self.progress_thread = FileLoaderThread(self, files)
-        self['cloud'].load(files[0].toLocalFile(), append=False)
         self.progress_thread.progress.connect(self.file_loading_progress)
+        self.progress_thread.loaded.connect(self.file_loaded)
         self.progress_thread.finished.connect(self.file_loading_finished)
         self.progress_thread.start()
 
     def file_loading_progress(self, value):
         self.progress_dialog.set_value(value)
 
+    def file_loaded(self, center, color_mode):
+        self['cloud'].set_color_mode(color_mode)
+        self.glwidget.set_cam_position(center=center)
+
     def file_loading_finished(self):
         self.progress_dialog.close()
 
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+import os
+import time
+from q3dviewer.utils.cloud_io import load_gs, save_compact_gs
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="convert a gaussian file (ply or npy) into the compact "
+                    "format (.cgs), which gaussian_viewer loads faster")
+    parser.add_argument("path", help="the gaussian file (ply or npy)")
+    parser.add_argument("-o", "--output",
+                        help="the .cgs file to write, next to path by default")
+    args = parser.parse_args()
+    output = args.output
+    if output is None:
+        output = os.path.splitext(args.path)[0] + ".cgs"
+    t0 = time.time()
+    gs = load_gs(args.path)
+    errors = save_compact_gs(output, gs)
+    print("Write %s in %.1f s, %.1f times smaller" % (
+        output, time.time() - t0, gs.nbytes / os.path.getsize(output)))
+    print("Max quantization error:")
+    for name, error in errors.items():
+        print("  %-10s %g" % (name, error))
+
+
+if __name__ == '__main__':
+    main()
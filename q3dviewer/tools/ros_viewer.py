@@ -11,14 +11,16 @@ import rospy
 from nav_msgs.msg import Odometry
 from sensor_msgs.msg import PointCloud2
 import numpy as np
-import random
+import argparse
 from sensor_msgs.msg import Image
 from q3dviewer.utils.convert_ros_msg import convert_pointcloud2_msg, convert_odometry_msg, convert_image_msg
+from q3dviewer.utils.decimate import Decimator, DECIMATE_MODES
 
 viewer = None
-point_num_per_scan = None
+decimator = None
 color_mode = None
 auto_set_color_mode = True
+map_stamped = False  # all points of the map have stamps
 
 def odom_cb(data):
     global viewer
@@ -28,17 +30,25 @@ def odom_cb(data):
 
 def scan_cb(data):
     global viewer
-    global point_num_per_scan
+    global decimator
     global auto_set_color_mode
-    cloud, fields, _ = convert_pointcloud2_msg(data)
-    if (cloud.shape[0] > point_num_per_scan):
-        idx = random.sample(range(cloud.shape[0]), point_num_per_scan)
-        cloud = cloud[idx]
+    global map_stamped
+    cloud, fields, stamp = convert_pointcloud2_msg(data)
+    cloud = decimator(cloud)
     if 'rgb' in fields and auto_set_color_mode:
         print("Set color mode to RGB")
         viewer['map'].set_color_mode('RGB')
         auto_set_color_mode = False
-    viewer['map'].set_data(data=cloud, append=True)
+    # the stamps let the map hide the points older than its decay window,
+    # they add a field to every point, so only when the decay is on.
+    # the points added while it was off can't fade, so the map is started
+    # again when the decay is switched on.
+    if viewer['map'].decay_window > 0:
+        viewer['map'].set_data(data=cloud, append=map_stamped, stamp=stamp)
+        map_stamped = True
+    else:
+        viewer['map'].set_data(data=cloud, append=True)
+        map_stamped = False
     viewer['scan'].set_data(data=cloud)
 
 
@@ -50,10 +60,26 @@ def image_cb(data):
 def main():
     rospy.init_node('ros_viewer', anonymous=True)
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--decimate', choices=DECIMATE_MODES,
+                        default=rospy.get_param("decimate_mode", 'random'),
+                        help='how to reduce the points of each scan')
+    parser.add_argument('--decimate_voxel', type=float,
+                        default=rospy.get_param("decimate_voxel", 0.1),
+                        help='voxel size of the voxel decimation')
+    args, _ = parser.parse_known_args(rospy.myargv()[1:])
+
     global viewer
-    global point_num_per_scan
-    point_num_per_scan = 10000
-    map_item = q3d.CloudIOItem(size=1, alpha=0.1, color_mode='I')
+    global decimator
+    # keep one point per voxel in the map, 0 to keep all points
+    voxel_size = rospy.get_param("voxel_size", 0.)
+    voxel_mode = rospy.get_param("voxel_mode", 'first')
+    # show only the points of the last decay_window seconds, 0 to keep all
+    decay_window = rospy.get_param("decay_window", 0.)
+    map_item = q3d.CloudIOItem(size=1, alpha=0.1, color_mode='I',
+                               voxel_size=voxel_size if voxel_size > 0 else None,
+                               voxel_mode=voxel_mode,
+                               decay_window=decay_window)
     scan_item = q3d.CloudItem(
         size=2, alpha=1, color_mode='FLAT', color='#ffffff')
     odom_item = q3d.AxisItem(size=0.5, width=5)
@@ -68,7 +94,9 @@ def main():
                      'img': img_item})
 
     point_num_per_scan = rospy.get_param("scan_num", 100000)
-    print("point_num_per_scan: %d" % point_num_per_scan)
+    print("point_num_per_scan: %d (%s)" % (point_num_per_scan, args.decimate))
+    decimator = Decimator(args.decimate, point_num_per_scan,
+                          voxel_size=args.decimate_voxel)
     rospy.Subscriber(
         "/cloud_registered", PointCloud2, scan_cb,
         queue_size=1, buff_size=2**24)
@@ -1,2 +1,2 @@
 from q3dviewer.utils.helpers import rainbow, text_to_rgba
-from q3dviewer.utils.gl_helper import set_uniform
\ No newline at end of file
+from q3dviewer.utils.gl_helper import set_uniform, resize_buffer
@@ -0,0 +1,187 @@
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+An on-disk cache of converted clouds. The packed cloud of a source file
+is stored as a .npy file, so a second open is a memory map of it instead
+of a full parse of the LAS/E57/... file. The entries are keyed by the
+source path, size, mtime and the kept attribute fields, and the least recently used entries are
+removed when the cache exceeds its size limit.
+
+<key>.npy   the packed cloud (xyz/irgb and the extra fields)
+<key>.json  source, number of points, bounds, center and fields
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+from q3dviewer.utils.cloud_io import conform, union_dtype
+
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "q3dviewer", "clouds")
+
+
+class CloudCache:
+    """
+    A LRU cache of packed clouds, limited to max_bytes on disk.
+    """
+    def __init__(self, directory=None, max_bytes=8 << 30):
+        self.directory = directory if directory else DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+
+    def key(self, path, fields=None):
+        """
+        The key of a source file loaded with the attribute fields, changes
+        when the file is modified.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        src = f"{path}|{st.st_size}|{st.st_mtime_ns}"
+        if fields:
+            src += "|" + ",".join(sorted(fields))
+        return hashlib.sha1(src.encode()).hexdigest()[:24]
+
+    def entry(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".npy", base + ".json"
+
+    def lookup(self, path, fields=None):
+        """
+        The memory mapped cloud and its meta data, None if not cached.
+        """
+        try:
+            npy, meta_file = self.entry(self.key(path, fields))
+            with open(meta_file) as f:
+                meta = json.load(f)
+            cloud = np.load(npy, mmap_mode='r')
+            if cloud.shape[0] != meta['num']:
+                return None
+            # mark as recently used
+            os.utime(meta_file)
+        except (OSError, ValueError, KeyError):
+            return None
+        return cloud, meta
+
+    def store(self, path, cloud, fields=None):
+        """
+        Write the cloud (or a list of clouds, i.e. the scans of the file)
+        loaded with the attribute fields to the cache, return its meta data.
+        """
+        clouds = cloud if isinstance(cloud, list) else [cloud]
+        dtype = union_dtype(clouds)
+        num = sum(c.shape[0] for c in clouds)
+        meta = {'source': os.path.abspath(path),
+                'num': int(num),
+                'fields': list(dtype.names)}
+        if num > 0:
+            lo = np.full(3, np.inf)
+            hi = np.full(3, -np.inf)
+            total = np.zeros(3)
+            finite = np.zeros(3)
+            for c in clouds:
+                for i in range(3):
+                    # column by column, much faster than axis=0 on
+                    # strided xyz
+                    col = c['xyz'][:, i]
+                    lo[i] = np.fmin(lo[i], np.fmin.reduce(col, initial=np.inf))
+                    hi[i] = np.fmax(hi[i], np.fmax.reduce(col, initial=-np.inf))
+                    total[i] += np.nansum(col, dtype=np.float64)
+                    finite[i] += np.count_nonzero(np.isfinite(col))
+            meta['min'] = lo.tolist()
+            meta['max'] = hi.tolist()
+            meta['center'] = (total / np.maximum(finite, 1)).tolist()
+        if num * dtype.itemsize > self.max_bytes:
+            return meta
+        try:
+            key = self.key(path, fields)
+            os.makedirs(self.directory, exist_ok=True)
+            npy, meta_file = self.entry(key)
+            # write to temporary files then rename, so a concurrent reader
+            # never sees a partial entry; the json is written last.
+            tmp = f"{npy}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                np.lib.format.write_array_header_1_0(
+                    f, {'descr': np.lib.format.dtype_to_descr(dtype),
+                        'fortran_order': False, 'shape': (num,)})
+                for c in clouds:
+                    conform(c, dtype).tofile(f)
+            os.replace(tmp, npy)
+            tmp = f"{meta_file}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp, meta_file)
+        except OSError as e:
+            print(f"[Cloud Cache] Cannot write the cache: {e}")
+            return meta
+        self.evict(keep=key)
+        return meta
+
+    def load(self, path, loader, fields=None):
+        """
+        The cloud of path and its meta data, from the cache if possible,
+        otherwise loaded by loader(path, fields=fields) and stored to the
+        cache.
+        """
+        cached = self.lookup(path, fields)
+        if cached is not None:
+            return cached
+        cloud = loader(path, fields=fields)
+        return cloud, self.store(path, cloud, fields)
+
+    def entries(self):
+        """
+        All (last used time, bytes, key) of the cache, oldest first.
+        """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            npy, meta_file = self.entry(key)
+            try:
+                used = os.stat(meta_file).st_mtime
+                size = os.path.getsize(npy) + os.path.getsize(meta_file)
+            except OSError:
+                continue
+            entries.append((used, size, key))
+        entries.sort()
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache fits
+        max_bytes, the entry keep is never removed.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for file in self.entry(key)[::-1]:
+                try:
+                    os.remove(file)
+                except OSError:
+                    pass
+            total -= size
+
+    def clear(self):
+        max_bytes, self.max_bytes = self.max_bytes, 0
+        self.evict()
+        self.max_bytes = max_bytes
+
+
+def load_cached(path, loader, cache=None, fields=None):
+    """
+    (cloud, meta) of path, meta is None if there is no cache.
+    """
+    if cache is None:
+        return loader(path, fields=fields), None
+    return cache.load(path, loader, fields)
@@ -3,185 +3,1072 @@ Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
 Distributed under MIT license. See LICENSE for more information.
 """
 
+import itertools
+import json
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
 
 
-def save_ply(cloud, save_path):
-    import meshio
-    xyz = cloud['xyz']
-    i = (cloud['irgb'] & 0xFF000000) >> 24
-    rgb = cloud['irgb'] & 0x00FFFFFF
-    mesh = meshio.Mesh(points=xyz, cells=[], point_data={
-                       "rgb": rgb, "intensity": i})
-    mesh.write(save_path, file_format="ply")
-
-
-def load_ply(file):
-    import meshio
-    mesh = meshio.read(file)
-    xyz = mesh.points
-    rgb = np.zeros([xyz.shape[0]], dtype=np.uint32)
-    intensity = np.zeros([xyz.shape[0]], dtype=np.uint32)
-    if "intensity" in mesh.point_data:
-        intensity = mesh.point_data["intensity"]
-    if "rgb" in mesh.point_data:
-        rgb = mesh.point_data["rgb"]
-    irgb = (intensity << 24) | rgb
-    dtype = [('xyz', '<f4', (3,)), ('irgb', '<u4')]
-    cloud = np.rec.fromarrays([xyz, irgb], dtype=dtype)
+# the las dimensions which can be kept as attribute fields, see the
+# fields argument of the loaders
+LAS_FIELDS = ['classification', 'return_number', 'number_of_returns',
+              'gps_time', 'point_source_id', 'user_data', 'scan_angle_rank',
+              'scan_angle']
+
+
+def make_cloud(xyz, irgb, fields=None):
+    """
+    Pack xyz, irgb and the attribute fields (dict of name: values,
+    stored as float32) into a cloud array.
+    """
+    fields = {name: v for name, v in (fields or {}).items()
+              if name not in ('xyz', 'irgb') and not name.startswith('_')}
+    dtype = [('xyz', '<f4', (3,)), ('irgb', '<u4')] + \
+        [(name, '<f4') for name in fields]
+    cloud = np.empty(xyz.shape[0], dtype)
+    cloud['xyz'] = xyz
+    cloud['irgb'] = irgb
+    for name, values in fields.items():
+        cloud[name] = values
     return cloud
 
 
-def save_pcd(cloud, save_path):
-    from pypcd4 import PointCloud, MetaData
-    fields = ('x', 'y', 'z', 'intensity', 'rgb')
-    metadata = MetaData.model_validate(
-        {
-            "fields": fields,
-            "size": [4, 4, 4, 4, 4],
-            "type": ['F', 'F', 'F', 'U', 'U'],
-            "count": [1, 1, 1, 1, 1],
-            "width": cloud.shape[0],
-            "points": cloud.shape[0],
-        })
-    i = (cloud['irgb'] & 0xFF000000) >> 24
-    rgb = cloud['irgb'] & 0x00FFFFFF
-
-    # check no rgb value
-    if np.max(rgb) == 0:
-        fields = ('x', 'y', 'z', 'intensity')
-        metadata = MetaData.model_validate(
-            {
-                "fields": fields,
-                "size": [4, 4, 4, 4],
-                "type": ['F', 'F', 'F', 'U'],
-                "count": [1, 1, 1, 1],
-                "width": cloud.shape[0],
-                "points": cloud.shape[0],
-            })
-
-        dtype = [('xyz', '<f4', (3,)), ('intensity', '<u4')]
-        tmp = np.rec.fromarrays([cloud['xyz'], i], dtype=dtype)
-        PointCloud(metadata, tmp).save(save_path)
-    else:
-        fields = ('x', 'y', 'z', 'intensity', 'rgb')
-        metadata = MetaData.model_validate(
-        {
-            "fields": fields,
-            "size": [4, 4, 4, 4, 4],
-            "type": ['F', 'F', 'F', 'U', 'U'],
-            "count": [1, 1, 1, 1, 1],
-            "width": cloud.shape[0],
-            "points": cloud.shape[0],
-        })
-        dtype = [('xyz', '<f4', (3,)), ('intensity', '<u4'), ('rgb', '<u4')]
-        tmp = np.rec.fromarrays([cloud['xyz'], i, rgb], dtype=dtype)
-
-    PointCloud(metadata, tmp).save(save_path)
-
-
-def load_pcd(file):
-    from pypcd4 import PointCloud
-    dtype = [('xyz', '<f4', (3,)), ('irgb', '<u4')]
-    pc = PointCloud.from_path(file).pc_data
-    rgb = np.zeros([pc.shape[0]], dtype=np.uint32)
-    intensity = np.zeros([pc.shape[0]], dtype=np.uint32)
-    if 'intensity' in pc.dtype.names:
-        intensity = pc['intensity'].astype(np.uint32)
-        max_initensity = np.max(intensity)
-        # normalize the intensity to 0-255
-        if max_initensity > 255:
-            intensity = (intensity / max_initensity * 255).astype(np.uint32)
-    if 'rgb' in pc.dtype.names:
-        rgb = pc['rgb'].astype(np.uint32)
-    irgb = (intensity << 24) | rgb
-    xyz = np.stack([pc['x'], pc['y'], pc['z']], axis=1)
-    cloud = np.rec.fromarrays([xyz, irgb], dtype=dtype)
+def pack_chunk(x, y, z, rgb=None, intensity=None, scale=1., fields=None,
+               raw_intensity=False):
+    """
+    Pack the columns of a chunk into a cloud: rgb is 0xRRGGBB, intensity
+    is multiplied by scale and clipped to 0-255. Intensity other than
+    8 bits is also kept as the 'intensity' field if raw_intensity.
+    """
+    fields = dict(fields or {})
+    irgb = np.zeros(x.shape[0], np.uint32)
+    if rgb is not None:
+        irgb |= rgb.astype(np.uint32) & 0x00FFFFFF
+    if intensity is not None:
+        if intensity.dtype == np.uint8:
+            i = intensity.astype(np.uint32)
+        else:
+            if raw_intensity:
+                fields['intensity'] = intensity
+            i = np.nan_to_num(intensity * np.float32(scale))
+            i = np.clip(i, 0, 255).astype(np.uint32)
+        irgb |= i << 24
+    return make_cloud(np.stack([x, y, z], axis=1), irgb, fields)
+
+
+def auto_intensity_scale(intensity):
+    """
+    The scale from the intensity to 0-255: wide ranges are divided by their
+    max, float ranges of 0-1 are multiplied by 255.
+    """
+    if intensity is None:
+        return 1.
+    peak = float(np.nanmax(intensity)) if intensity.size else 0.
+    if not np.isfinite(peak):
+        return 1.
+    if peak > 255:
+        return 255. / peak
+    if intensity.dtype.kind == 'f' and 0 < peak <= 1:
+        return 255.
+    return 1.
+
+
+def las_intensity_scale(intensity):
+    """
+    The scale from the las intensity to 0-255: 16 bits intensity (any
+    over 255) is divided by 255, the rest is kept.
+    """
+    if intensity is None or intensity.size == 0:
+        return 1.
+    return 1. / 255. if float(np.nanmax(intensity)) > 255 else 1.
+
+
+def with_intensity(fields):
+    """
+    fields with the raw 'intensity' field, which collect_chunks needs.
+    """
+    fields = list(fields or ())
+    return fields if 'intensity' in fields else fields + ['intensity']
+
+
+def collect_chunks(chunks, num, normalize=True, fields=None,
+                   intensity_scale=auto_intensity_scale):
+    """
+    Gather the cloud chunks into one array of num points. The chunks are
+    packed with an intensity scale of 1 and the raw 'intensity' field
+    (see with_intensity), the intensity of irgb is normalized by the
+    intensity_scale of all points at the end, unless normalize is False.
+    The raw 'intensity' field is then dropped, unless it is in fields.
+    """
+    cloud = None
+    raw = None
+    loc = 0
+    for chunk in chunks:
+        if cloud is None:
+            names = [name for name in chunk.dtype.names
+                     if name != 'intensity' or 'intensity' in (fields or ())]
+            cloud = np.empty(num, [(name, chunk.dtype.fields[name][0])
+                                   for name in names])
+            if 'intensity' in chunk.dtype.names and normalize:
+                raw = cloud['intensity'] if 'intensity' in names \
+                    else np.empty(num, np.float32)
+        for name in cloud.dtype.names:
+            cloud[name][loc:loc + chunk.shape[0]] = chunk[name]
+        if raw is not None and 'intensity' not in cloud.dtype.names:
+            raw[loc:loc + chunk.shape[0]] = chunk['intensity']
+        loc += chunk.shape[0]
+    if cloud is None:
+        return np.empty(0, [('xyz', '<f4', (3,)), ('irgb', '<u4')])
+    if loc != num:
+        raise ValueError(f"Expected {num} points, got {loc}.")
+    if raw is not None:
+        scale = intensity_scale(raw)
+        if scale != 1.:
+            step = 1 << 20
+            for start in range(0, num, step):
+                out = cloud['irgb'][start:start + step]
+                i = np.nan_to_num(raw[start:start + step] * np.float32(scale))
+                i = np.clip(i, 0, 255).astype(np.uint32)
+                out[:] = (out & 0x00FFFFFF) | (i << 24)
     return cloud
 
 
-def save_e57(cloud, save_path):
-    from pye57 import E57
+def conform(cloud, dtype):
+    """
+    Convert a cloud to dtype, missing fields are filled with nan.
+    """
+    if cloud.dtype == dtype:
+        return cloud
+    out = np.empty(cloud.shape[0], dtype)
+    for name in dtype.names:
+        if name in cloud.dtype.names:
+            out[name] = cloud[name]
+        elif name == 'irgb':
+            out[name] = 0
+        else:
+            out[name] = np.nan
+    return out
+
+
+def concat_clouds(clouds):
+    """
+    Concatenate clouds, the result has the fields of all of them.
+    """
+    if not clouds:
+        return np.empty(0, [('xyz', '<f4', (3,)), ('irgb', '<u4')])
+    if len(clouds) == 1:
+        return clouds[0]
+    dtype = union_dtype(clouds)
+    return np.concatenate([conform(cloud, dtype) for cloud in clouds])
+
+
+def union_dtype(clouds):
+    """
+    The dtype with the fields of all clouds.
+    """
+    fields = {}
+    for cloud in clouds:
+        for name in cloud.dtype.names:
+            fields.setdefault(name, cloud.dtype.fields[name][0])
+    return np.dtype(list(fields.items()))
+
+
+# ply property types
+PLY_TYPES = {'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+             'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+             'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+             'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8'}
+PLY_NAMES = {'i1': 'char', 'u1': 'uchar', 'i2': 'short', 'u2': 'ushort',
+             'i4': 'int', 'u4': 'uint', 'f4': 'float', 'f8': 'double'}
+PLY_ENDIAN = {'ascii': '<', 'binary_little_endian': '<',
+              'binary_big_endian': '>'}
+
+
+def read_ply_header(file):
+    """
+    Parse the header of a ply file. Return (format, elements, offset of
+    the body), elements is a list of (name, count, properties), a property
+    is (name, type) or (name, count type, item type) for a list.
+    """
+    fmt = None
+    elements = []
+    with open(file, 'rb') as f:
+        if f.readline().strip() != b'ply':
+            raise ValueError(f"{file} is not a ply file.")
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"{file} has no end_header.")
+            words = line.decode('ascii', 'replace').split()
+            if not words or words[0] in ('comment', 'obj_info'):
+                continue
+            try:
+                if words[0] == 'format':
+                    fmt = words[1]
+                elif words[0] == 'element':
+                    elements.append((words[1], int(words[2]), []))
+                elif words[0] == 'property' and words[1] == 'list':
+                    elements[-1][2].append(
+                        (words[4], PLY_TYPES[words[2]], PLY_TYPES[words[3]]))
+                elif words[0] == 'property':
+                    elements[-1][2].append((words[2], PLY_TYPES[words[1]]))
+                elif words[0] == 'end_header':
+                    break
+            except (KeyError, IndexError, ValueError):
+                raise ValueError(f"Invalid ply header line: {line!r}")
+        offset = f.tell()
+    if fmt not in PLY_ENDIAN:
+        raise ValueError(f"Unsupported ply format: {fmt}")
+    return fmt, elements, offset
+
+
+def ply_element_dtype(properties, endian='<'):
+    if any(len(p) != 2 for p in properties):
+        raise ValueError("List properties are not supported.")
+    return np.dtype([(name, endian + t) for name, t in properties])
+
+
+def read_ply_element(file, name='vertex', chunk_lines=1 << 20):
+    """
+    Read an element of a ply file as a structured array (one field per
+    property). Binary bodies are memory mapped, so only the fields used
+    are read from the disk; ascii bodies are parsed chunk by chunk.
+    """
+    fmt, elements, offset = read_ply_header(file)
+    skip_lines = 0
+    for el_name, count, properties in elements:
+        if el_name == name:
+            break
+        if fmt == 'ascii':
+            skip_lines += count
+        else:
+            offset += count * ply_element_dtype(
+                properties, PLY_ENDIAN[fmt]).itemsize
+    else:
+        raise ValueError(f"{file} has no {name} element.")
+    dtype = ply_element_dtype(properties, PLY_ENDIAN[fmt])
+    if count == 0:
+        return np.empty(0, dtype)
+    if fmt != 'ascii':
+        return np.memmap(file, dtype, 'r', offset, (count,))
+
+    out = np.empty(count, dtype)
+    with open(file, 'rb') as f:
+        f.seek(offset)
+        for _ in range(skip_lines):
+            f.readline()
+        loc = 0
+        while loc < count:
+            lines = list(itertools.islice(f, min(chunk_lines, count - loc)))
+            if not lines:
+                raise ValueError(f"{file} has less {name} than its header.")
+            values = np.loadtxt(lines, dtype=np.float64, ndmin=2)
+            for i, prop in enumerate(dtype.names):
+                out[prop][loc:loc + values.shape[0]] = values[:, i]
+            loc += values.shape[0]
+    return out
+
+
+class PlyWriter:
+    """
+    Write a binary little endian ply file chunk by chunk, dtype is the
+    structured dtype of the vertices (scalar fields only), count is the
+    number of vertices written in total.
+    """
+    def __init__(self, path, dtype, count):
+        dtype = np.dtype(dtype)
+        header = ['ply', 'format binary_little_endian 1.0',
+                  f'element vertex {count}']
+        for name in dtype.names:
+            t = dtype[name]
+            if t.shape != () or t.str[1:] not in PLY_NAMES:
+                raise ValueError(f"Unsupported ply property type: {name} {t}")
+            header.append(f'property {PLY_NAMES[t.str[1:]]} {name}')
+        self.dtype = np.dtype([(name, '<' + dtype[name].str[1:])
+                               for name in dtype.names])
+        self.count = count
+        self.written = 0
+        header.append('end_header\n')
+        self.file = open(path, 'wb')
+        self.file.write('\n'.join(header).encode('ascii'))
+
+    def write(self, vertices):
+        if vertices.dtype != self.dtype:
+            raise ValueError(f"Expected {self.dtype}, got {vertices.dtype}")
+        if self.written + vertices.shape[0] > self.count:
+            raise ValueError("More vertices than the header count.")
+        self.file.write(np.ascontiguousarray(vertices).data)
+        self.written += vertices.shape[0]
+
+    def close(self):
+        self.file.close()
+        if self.written != self.count:
+            raise ValueError(f"{self.written} vertices are written, "
+                             f"but the header says {self.count}.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+
+def cloud_chunks(cloud, chunk_points=1 << 20):
+    """
+    Yield a cloud chunk by chunk. cloud is a cloud array, or an object with
+    shape, dtype and iter_chunks(chunk_points), e.g. the snapshot of a
+    CloudItem being saved.
+    """
+    if isinstance(cloud, np.ndarray):
+        for start in range(0, cloud.shape[0], chunk_points):
+            yield cloud[start:start + chunk_points]
+    else:
+        yield from cloud.iter_chunks(chunk_points)
+
+
+def save_ply(cloud, save_path, chunk_points=1 << 20, progress=None):
+    """
+    Write the cloud chunk by chunk, progress(written, total) is called after
+    every chunk and may raise to stop the save.
+    """
+    fields = [name for name in cloud.dtype.names
+              if name not in ('xyz', 'irgb') and cloud.dtype[name].shape == ()]
+    dtype = [('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+             ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    if 'intensity' not in fields:
+        dtype.append(('intensity', 'u1'))
+    dtype += [(name, '<f4') for name in fields]
+    with PlyWriter(save_path, dtype, cloud.shape[0]) as writer:
+        for chunk in cloud_chunks(cloud, chunk_points):
+            vertices = np.empty(chunk.shape[0], writer.dtype)
+            for i, c in enumerate('xyz'):
+                vertices[c] = chunk['xyz'][:, i]
+            irgb = chunk['irgb']
+            vertices['red'] = (irgb >> 16) & 0xFF
+            vertices['green'] = (irgb >> 8) & 0xFF
+            vertices['blue'] = irgb & 0xFF
+            if 'intensity' not in fields:
+                vertices['intensity'] = irgb >> 24
+            for name in fields:
+                vertices[name] = chunk[name]
+            writer.write(vertices)
+            if progress is not None:
+                progress(writer.written, writer.count)
+
+
+def load_ply(file, chunk_points=1 << 20, fields=None):
+    num = read_ply_element_count(file)
+    return collect_chunks(
+        iter_ply_chunks(file, chunk_points, intensity_scale=1.,
+                        fields=with_intensity(fields)), num, fields=fields)
+
+
+def read_ply_element_count(file, name='vertex'):
+    _, elements, _ = read_ply_header(file)
+    for el_name, count, _ in elements:
+        if el_name == name:
+            return count
+    raise ValueError(f"{file} has no {name} element.")
+
+
+def iter_ply_chunks(file, chunk_points=1 << 20, intensity_scale=None,
+                    fields=None):
+    """
+    Yield the vertices of a ply file as cloud chunks, see iter_cloud_chunks.
+    """
+    vertex = read_ply_element(file, 'vertex', chunk_points)
+    names = vertex.dtype.names
+    rgb_names = ('rgb', 'red', 'green', 'blue')
+    field_names = [name for name in names if name in (fields or ())
+                   and name not in ('x', 'y', 'z', 'intensity') + rgb_names]
+    for start in range(0, vertex.shape[0], chunk_points):
+        v = vertex[start:start + chunk_points]
+        rgb = None
+        if 'rgb' in names:
+            rgb = v['rgb'].astype(np.uint32)
+        elif all(c in names for c in ('red', 'green', 'blue')):
+            rgb = np.zeros(v.shape[0], np.uint32)
+            for c, shift in (('red', 16), ('green', 8), ('blue', 0)):
+                channel = v[c].astype(np.uint32)
+                if v.dtype[c].itemsize > 1:
+                    channel >>= 8  # 16 bits colors
+                rgb |= (channel & 0xFF) << shift
+        intensity = v['intensity'] if 'intensity' in names else None
+        if intensity_scale is None:
+            intensity_scale = auto_intensity_scale(intensity)
+        yield pack_chunk(v['x'], v['y'], v['z'], rgb, intensity,
+                         intensity_scale,
+                         {name: v[name] for name in field_names},
+                         'intensity' in (fields or ()))
+
+
+# pcd (type, size) to numpy type
+PCD_TYPES = {('F', 4): 'f4', ('F', 8): 'f8',
+             ('U', 1): 'u1', ('U', 2): 'u2', ('U', 4): 'u4', ('U', 8): 'u8',
+             ('I', 1): 'i1', ('I', 2): 'i2', ('I', 4): 'i4', ('I', 8): 'i8'}
+
+
+def read_pcd_header(file):
+    """
+    Parse the header of a pcd file. Return (header, offset of the body),
+    header is a dict of lower case keys (i.e. 'fields', 'data') to
+    the list of their words.
+    """
+    header = {}
+    with open(file, 'rb') as f:
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"{file} is not a pcd file (no DATA line).")
+            words = line.decode('ascii', 'replace').split()
+            if not words or words[0].startswith('#'):
+                continue
+            header[words[0].lower()] = words[1:]
+            if words[0].upper() == 'DATA':
+                break
+        offset = f.tell()
+    for key in ('fields', 'size', 'type'):
+        if key not in header:
+            raise ValueError(f"{file} has no {key.upper()} line.")
+    return header, offset
+
+
+def pcd_dtype(header):
+    """
+    The structured dtype of a point, fields with COUNT > 1 are subarrays,
+    the padding fields '_' are renamed to '_0', '_1', ...
+    """
+    num = len(header['fields'])
+    counts = header.get('count', ['1'] * num)
+    dtype = []
+    for i, (name, size, t, count) in enumerate(zip(
+            header['fields'], header['size'], header['type'], counts)):
+        key = (t.upper(), int(size))
+        if key not in PCD_TYPES:
+            raise ValueError(f"Unsupported pcd field type: {name} {t}{size}")
+        if name == '_':
+            name = f'_{i}'
+        if int(count) == 1:
+            dtype.append((name, '<' + PCD_TYPES[key]))
+        else:
+            dtype.append((name, '<' + PCD_TYPES[key], (int(count),)))
+    return np.dtype(dtype)
+
+
+def pcd_points(header):
+    if 'points' in header:
+        return int(header['points'][0])
+    return int(header['width'][0]) * int(header.get('height', ['1'])[0])
+
+
+def lzf_decompress(data, size):
+    """
+    Decode an LZF block of size bytes after decoding, with python-lzf
+    when it is installed.
+    """
+    try:
+        import lzf
+        out = lzf.decompress(bytes(data), size)
+        if out is None:
+            raise ValueError("Invalid lzf data.")
+        return out
+    except ImportError:
+        pass
+    src = memoryview(data)
+    out = bytearray(size)
+    i = o = 0
+    while i < len(src):
+        ctrl = src[i]
+        i += 1
+        if ctrl < 32:
+            # literal run
+            length = ctrl + 1
+            out[o:o + length] = src[i:i + length]
+            i += length
+        else:
+            # back reference, may overlap with the output
+            length = ctrl >> 5
+            if length == 7:
+                length += src[i]
+                i += 1
+            ref = o - ((ctrl & 0x1f) << 8) - src[i] - 1
+            i += 1
+            length += 2
+            if ref < 0:
+                raise ValueError("Invalid lzf data.")
+            if ref + length <= o:
+                out[o:o + length] = out[ref:ref + length]
+            else:
+                for k in range(length):
+                    out[o + k] = out[ref + k]
+        o += length
+    if o != size:
+        raise ValueError("Invalid lzf data.")
+    return out
+
+
+def iter_pcd_points(file, chunk_points=1 << 20):
+    """
+    Yield the points of a pcd file in chunks of the pcd_dtype. Binary
+    bodies are memory mapped, ascii bodies are parsed chunk by chunk,
+    binary_compressed bodies are decompressed once and gathered from
+    their field by field layout chunk by chunk.
+    """
+    header, offset = read_pcd_header(file)
+    dtype = pcd_dtype(header)
+    num = pcd_points(header)
+    fmt = header['data'][0].lower()
+    if num == 0:
+        return
+    if fmt == 'binary':
+        points = np.memmap(file, dtype, 'r', offset, (num,))
+        for start in range(0, num, chunk_points):
+            yield points[start:start + chunk_points]
+    elif fmt == 'ascii':
+        with open(file, 'rb') as f:
+            f.seek(offset)
+            loc = 0
+            while loc < num:
+                lines = list(itertools.islice(f, min(chunk_points, num - loc)))
+                if not lines:
+                    raise ValueError(f"{file} has less points than its header.")
+                values = np.loadtxt(lines, dtype=np.float64, ndmin=2)
+                chunk = np.empty(values.shape[0], dtype)
+                col = 0
+                for name in dtype.names:
+                    width = max(int(np.prod(dtype[name].shape)), 1)
+                    column = values[:, col:col + width]
+                    chunk[name] = column.reshape(chunk[name].shape)
+                    col += width
+                loc += values.shape[0]
+                yield chunk
+    elif fmt == 'binary_compressed':
+        with open(file, 'rb') as f:
+            f.seek(offset)
+            compressed_size, size = np.frombuffer(f.read(8), '<u4')
+            raw = lzf_decompress(f.read(int(compressed_size)), int(size))
+        # the fields are stored one after another: all x, then all y, ...
+        columns = {}
+        loc = 0
+        for name in dtype.names:
+            t = dtype[name]
+            columns[name] = np.frombuffer(
+                raw, t.base, num * max(int(np.prod(t.shape)), 1),
+                loc).reshape((num,) + t.shape)
+            loc += num * t.itemsize
+        for start in range(0, num, chunk_points):
+            end = min(start + chunk_points, num)
+            chunk = np.empty(end - start, dtype)
+            for name in dtype.names:
+                chunk[name] = columns[name][start:end]
+            yield chunk
+    else:
+        raise ValueError(f"Unsupported pcd data format: {fmt}")
+
+
+def save_pcd(cloud, save_path, chunk_points=1 << 20, progress=None):
+    """
+    Write the cloud as a binary pcd file chunk by chunk, see save_ply.
+    """
+    fields = [name for name in cloud.dtype.names
+              if name not in ('xyz', 'irgb') and cloud.dtype[name].shape == ()]
+    dtype = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+    if 'intensity' not in fields:
+        dtype.append(('intensity', 'u1'))
+    # skip the rgb field when there is no color
+    has_rgb = any(np.any(chunk['irgb'] & 0x00FFFFFF)
+                  for chunk in cloud_chunks(cloud, chunk_points))
+    if has_rgb:
+        dtype.append(('rgb', '<u4'))
+    dtype = np.dtype(dtype + [(name, '<f4') for name in fields])
+    num = cloud.shape[0]
+    header = ['# .PCD v0.7 - Point Cloud Data file format',
+              'VERSION 0.7',
+              'FIELDS ' + ' '.join(dtype.names),
+              'SIZE ' + ' '.join(str(dtype[n].itemsize) for n in dtype.names),
+              'TYPE ' + ' '.join(dtype[n].kind.upper() for n in dtype.names),
+              'COUNT ' + ' '.join('1' for _ in dtype.names),
+              f'WIDTH {num}', 'HEIGHT 1', 'VIEWPOINT 0 0 0 1 0 0 0',
+              f'POINTS {num}', 'DATA binary\n']
+    with open(save_path, 'wb') as f:
+        f.write('\n'.join(header).encode('ascii'))
+        written = 0
+        for chunk in cloud_chunks(cloud, chunk_points):
+            points = np.empty(chunk.shape[0], dtype)
+            for i, c in enumerate('xyz'):
+                points[c] = chunk['xyz'][:, i]
+            if 'intensity' not in fields:
+                points['intensity'] = chunk['irgb'] >> 24
+            if has_rgb:
+                points['rgb'] = chunk['irgb'] & 0x00FFFFFF
+            for name in fields:
+                points[name] = chunk[name]
+            f.write(points.data)
+            written += points.shape[0]
+            if progress is not None:
+                progress(written, num)
+        if written != num:
+            raise ValueError(f"{written} points are written, "
+                             f"but the header says {num}.")
+
+
+def load_pcd(file, chunk_points=1 << 20, fields=None):
+    header, _ = read_pcd_header(file)
+    return collect_chunks(
+        iter_pcd_chunks(file, chunk_points, intensity_scale=1.,
+                        fields=with_intensity(fields)),
+        pcd_points(header), fields=fields)
+
+
+def iter_pcd_chunks(file, chunk_points=1 << 20, intensity_scale=None,
+                    fields=None):
+    """
+    Yield the points of a pcd file as cloud chunks, see iter_cloud_chunks.
+    """
+    header, _ = read_pcd_header(file)
+    dtype = pcd_dtype(header)
+    names = dtype.names
+    field_names = [name for name in names if name in (fields or ())
+                   and name not in ('x', 'y', 'z', 'intensity', 'rgb', 'rgba')
+                   and not name.startswith('_') and dtype[name].shape == ()]
+    rgb_name = 'rgb' if 'rgb' in names else 'rgba' if 'rgba' in names else None
+    for chunk in iter_pcd_points(file, chunk_points):
+        rgb = None
+        if rgb_name is not None:
+            rgb = chunk[rgb_name]
+            if rgb.dtype.itemsize == 4:
+                rgb = rgb.view(np.uint32)  # packed in a float or an uint
+        intensity = chunk['intensity'] if 'intensity' in names else None
+        if intensity_scale is None:
+            intensity_scale = auto_intensity_scale(intensity)
+        yield pack_chunk(chunk['x'], chunk['y'], chunk['z'], rgb, intensity,
+                         intensity_scale,
+                         {name: chunk[name] for name in field_names},
+                         'intensity' in (fields or ()))
+
+
+def save_e57(cloud, save_path, chunk_points=1 << 20, progress=None):
+    """
+    Write the cloud as one scan chunk by chunk, see save_ply.
+    """
+    from pye57 import E57, libe57
     e57 = E57(save_path, mode='w')
-    x = cloud['xyz'][:, 0]
-    y = cloud['xyz'][:, 1]
-    z = cloud['xyz'][:, 2]
-    i = (cloud['irgb'] & 0xFF000000) >> 24
-    r = (cloud['irgb'] & 0x00FF0000) >> 16
-    g = (cloud['irgb'] & 0x0000FF00) >> 8
-    b = (cloud['irgb'] & 0x000000ff)
-    data = {"cartesianX": x, "cartesianY": y, "cartesianZ": z,
-            "intensity": i,
-            "colorRed": r, "colorGreen": g, "colorBlue": b}
-    e57.write_scan_raw(data)
-    e57.close()
-
-
-def load_e57(file_path):
+    try:
+        image = e57.image_file
+        scan = libe57.StructureNode(image)
+        scan.set("guid", libe57.StringNode(image, "{%s}" % uuid.uuid4()))
+        scan.set("name", libe57.StringNode(image, "Scan 0"))
+        limits = libe57.StructureNode(image)
+        limits.set("intensityMinimum", libe57.FloatNode(image, 0.))
+        limits.set("intensityMaximum", libe57.FloatNode(image, 255.))
+        scan.set("intensityLimits", limits)
+        limits = libe57.StructureNode(image)
+        for c in ("colorRed", "colorGreen", "colorBlue"):
+            limits.set(c + "Minimum", libe57.IntegerNode(image, 0))
+            limits.set(c + "Maximum", libe57.IntegerNode(image, 255))
+        scan.set("colorLimits", limits)
+        # the bounds are not known before the points are written, the
+        # coordinates are stored as plain floats.
+        prototype = libe57.StructureNode(image)
+        names = ["cartesianX", "cartesianY", "cartesianZ", "intensity"]
+        for name in names:
+            prototype.set(name, libe57.FloatNode(image, 0., libe57.E57_SINGLE))
+        for c in ("colorRed", "colorGreen", "colorBlue"):
+            prototype.set(c, libe57.IntegerNode(image, 0, 0, 255))
+        names += ["colorRed", "colorGreen", "colorBlue"]
+        points = libe57.CompressedVectorNode(
+            image, prototype, libe57.VectorNode(image, True))
+        scan.set("points", points)
+        e57.data3d.append(scan)
+        arrays, buffers = e57.make_buffers(names, chunk_points)
+        writer = points.writer(buffers)
+        lo = np.full(3, np.inf)
+        hi = np.full(3, -np.inf)
+        written = 0
+        for chunk in cloud_chunks(cloud, chunk_points):
+            n = chunk.shape[0]
+            for i, name in enumerate(names[:3]):
+                col = chunk['xyz'][:, i]
+                arrays[name][:n] = col
+                if n > 0:
+                    lo[i] = min(lo[i], col.min())
+                    hi[i] = max(hi[i], col.max())
+            irgb = chunk['irgb']
+            arrays["intensity"][:n] = irgb >> 24
+            arrays["colorRed"][:n] = (irgb >> 16) & 0xFF
+            arrays["colorGreen"][:n] = (irgb >> 8) & 0xFF
+            arrays["colorBlue"][:n] = irgb & 0xFF
+            writer.write(n)
+            written += n
+            if progress is not None:
+                progress(written, cloud.shape[0])
+        writer.close()
+        if written > 0:
+            bounds = libe57.StructureNode(image)
+            for i, c in enumerate('xyz'):
+                bounds.set(c + "Minimum", libe57.FloatNode(image, lo[i]))
+                bounds.set(c + "Maximum", libe57.FloatNode(image, hi[i]))
+            scan.set("cartesianBounds", bounds)
+    finally:
+        e57.close()
+
+
+def load_e57(file_path, scans=None, workers=None, fields=None):
+    """
+    Load the scans (indices, all by default) of an e57 file, each moved
+    by its pose, decoded in a pool of workers processes. 'intensity' is
+    the only attribute field of fields an e57 file can keep.
+    """
+    clouds = dict(iter_e57_scans(file_path, scans, workers, fields=fields))
+    return concat_clouds([clouds[i] for i in sorted(clouds)])
+
+
+def e57_scans(file):
+    """
+    The headers of the scans of an e57 file, a dict per scan of 'points',
+    'fields', 'pose' ((rotation, translation), None without pose),
+    'intensity_max' and 'bounds' (None if not in the header).
+    """
     from pye57 import E57
-    e57 = E57(file_path, mode="r")
-    scans = e57.read_scan(0, ignore_missing_fields=True,
-                          intensity=True, colors=True)
-    x = scans["cartesianX"]
-    y = scans["cartesianY"]
-    z = scans["cartesianZ"]
-    rgb = np.zeros([x.shape[0]], dtype=np.uint32)
-    intensity = np.zeros([x.shape[0]], dtype=np.uint32)
-    if "intensity" in scans:
-        intensity = scans["intensity"].astype(np.uint32)
-    if all([x in scans for x in ["colorRed", "colorGreen", "colorBlue"]]):
-        r = scans["colorRed"].astype(np.uint32)
-        g = scans["colorGreen"].astype(np.uint32)
-        b = scans["colorBlue"].astype(np.uint32)
-        rgb = (r << 16) | (g << 8) | b
-    irgb = (intensity << 24) | rgb
-    dtype = [('xyz', '<f4', (3,)), ('irgb', '<u4')]
-    cloud = np.rec.fromarrays(
-        [np.stack([x, y, z], axis=1), irgb],
-        dtype=dtype)
-    e57.close()
-    return cloud
+    e57 = E57(file, mode='r')
+    try:
+        scans = []
+        for i in range(e57.scan_count):
+            header = e57.get_header(i)
+            scan = {'points': header.point_count,
+                    'fields': list(header.point_fields),
+                    'pose': None, 'intensity_max': None, 'bounds': None}
+            if header.has_pose():
+                scan['pose'] = (header.rotation_matrix, header.translation)
+            try:
+                scan['intensity_max'] = \
+                    header['intensityLimits']['intensityMaximum'].value()
+            except Exception:
+                pass  # the limits are optional
+            try:
+                b = header.cartesianBounds
+                scan['bounds'] = (
+                    np.array([b['xMinimum'].value(), b['yMinimum'].value(),
+                              b['zMinimum'].value()]),
+                    np.array([b['xMaximum'].value(), b['yMaximum'].value(),
+                              b['zMaximum'].value()]))
+            except Exception:
+                pass  # the bounds are optional
+            scans.append(scan)
+        return scans
+    finally:
+        e57.close()
+
+
+def e57_intensity_scale(scans):
+    """
+    The intensity scale of the scans (see e57_scans) from their intensity
+    limits, None if a scan has no limits.
+    """
+    peaks = []
+    for scan in scans:
+        if 'intensity' not in scan['fields']:
+            continue
+        if scan['intensity_max'] is None:
+            return None
+        peaks.append(scan['intensity_max'])
+    if not peaks:
+        return 1.
+    return auto_intensity_scale(np.array(peaks, np.float32))
+
+
+def load_e57_scan(file, scan, intensity_scale=None, chunk_points=1 << 20,
+                  fields=None):
+    """
+    Load one scan of an e57 file, moved by its pose (fields, see load_e57).
+    """
+    num = e57_scans(file)[scan]['points']
+    if intensity_scale is None:
+        return collect_chunks(iter_e57_chunks(
+            file, chunk_points, 1., scan, with_intensity(fields)), num,
+            fields=fields)
+    return collect_chunks(iter_e57_chunks(
+        file, chunk_points, intensity_scale, scan, fields), num,
+        normalize=False, fields=fields)
+
+
+def iter_e57_scans(file, scans=None, workers=None, intensity_scale=None,
+                   fields=None):
+    """
+    Yield (index, cloud) of the scans of an e57 file as soon as they are
+    decoded, in a pool of workers processes (one process per scan).
+    The intensity of all scans is scaled by the same intensity_scale,
+    by default decided from the intensity limits of the scans.
+    """
+    headers = e57_scans(file)
+    if scans is None:
+        scans = range(len(headers))
+    scans = list(scans)
+    for scan in scans:
+        if not 0 <= scan < len(headers):
+            raise ValueError(f"{file} has no scan {scan}, "
+                             f"it has {len(headers)} scans.")
+    if intensity_scale is None:
+        intensity_scale = e57_intensity_scale([headers[i] for i in scans])
+    if workers is None:
+        # a worker of another pool loads the scans by itself
+        workers = 1 if multiprocessing.parent_process() is not None \
+            else os.cpu_count() or 1
+    workers = min(workers, len(scans))
+    if workers <= 1:
+        for scan in scans:
+            yield scan, load_e57_scan(file, scan, intensity_scale,
+                                      fields=fields)
+        return
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        futures = {pool.submit(load_e57_scan, file, scan, intensity_scale,
+                               fields=fields): scan for scan in scans}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def transform_xyz(x, y, z, rotation, translation):
+    """
+    Apply a rigid pose (3x3 rotation, translation) to the columns x, y, z,
+    the points are rotated in float64 and returned as an Nx3 array.
+    """
+    xyz = np.stack([x, y, z], axis=1).astype(np.float64)
+    xyz = xyz @ np.asarray(rotation, np.float64).T
+    xyz += np.asarray(translation, np.float64)
+    return xyz
 
 
-def load_las(file):
+def load_las(file, chunk_points=1 << 20, fields=None):
     import laspy
     with laspy.open(file) as f:
-        las = f.read()
-        xyz = np.vstack((las.x, las.y, las.z)).transpose()
-        dimensions = list(las.point_format.dimension_names)
-        rgb = np.zeros([las.x.shape[0]], dtype=np.uint32)
-        intensity = np.zeros([las.x.shape[0]], dtype=np.uint32)
-        if 'intensity' in dimensions:
-            intensity = las.intensity.astype(np.uint32)
-        if 'red' in dimensions and 'green' in dimensions and 'blue' in dimensions:
-            red = las.red.astype(np.uint32)
-            green = las.green.astype(np.uint32)
-            blue = las.blue.astype(np.uint32)
-            if np.max([red, green, blue]) > 255:
-                red = (red / 255).astype(np.uint32)
-                green = (green / 255).astype(np.uint32)
-                blue = (blue / 255).astype(np.uint32)
-            rgb = (red << 16) | (green << 8) | blue
-        if np.max(intensity) > 255:
-            intensity = (intensity / 255).astype(np.uint32)
-            intensity = np.clip(intensity, 0, 255)
-        color = (intensity << 24) | rgb
-        dtype = [('xyz', '<f4', (3,)), ('irgb', '<u4')]
-        cloud = np.rec.fromarrays([xyz, color], dtype=dtype)
-    return cloud
+        num = f.header.point_count
+    return collect_chunks(
+        iter_las_chunks(file, chunk_points, intensity_scale=1.,
+                        fields=with_intensity(fields)), num, fields=fields,
+        intensity_scale=las_intensity_scale)
+
 
-def save_las(cloud, save_path):
+def iter_las_chunks(file, chunk_points=1 << 20, intensity_scale=None,
+                    fields=None):
+    """
+    Yield the points of a las file as cloud chunks, see iter_cloud_chunks.
+    Colors over 255 in the first chunk are taken as 16 bits. The gps_time
+    field is stored as the seconds from the earliest time of the first
+    chunk, as float32 can't hold the absolute time (about 1e9 s).
+    """
+    import laspy
+    with laspy.open(file) as f:
+        dimensions = list(f.header.point_format.dimension_names)
+        field_names = [name for name in LAS_FIELDS
+                       if name in (fields or ()) and name in dimensions]
+        has_rgb = all(c in dimensions for c in ('red', 'green', 'blue'))
+        wide_rgb = None
+        time_origin = None
+        for points in f.chunk_iterator(chunk_points):
+            rgb = None
+            if has_rgb:
+                channels = [np.asarray(points[c])
+                            for c in ('red', 'green', 'blue')]
+                if wide_rgb is None:
+                    wide_rgb = max(int(c.max()) if c.size else 0
+                                   for c in channels) > 255
+                rgb = np.zeros(len(points), np.uint32)
+                for c, shift in zip(channels, (16, 8, 0)):
+                    c = c.astype(np.uint32)
+                    if wide_rgb:
+                        c >>= 8
+                    rgb |= (c & 0xFF) << shift
+            intensity = np.asarray(points['intensity']) \
+                if 'intensity' in dimensions else None
+            if intensity_scale is None:
+                intensity_scale = las_intensity_scale(intensity)
+            chunk_fields = {name: np.asarray(points[name])
+                            for name in field_names}
+            if 'gps_time' in chunk_fields:
+                gps_time = chunk_fields['gps_time']
+                if time_origin is None:
+                    time_origin = float(np.min(gps_time)) \
+                        if gps_time.size else 0.
+                chunk_fields['gps_time'] = gps_time - time_origin
+            yield pack_chunk(np.asarray(points.x), np.asarray(points.y),
+                             np.asarray(points.z), rgb, intensity,
+                             intensity_scale, chunk_fields,
+                             'intensity' in (fields or ()))
+
+
+def save_las(cloud, save_path, chunk_points=1 << 20, progress=None):
+    """
+    Write the cloud chunk by chunk, see save_ply. The colors and the
+    intensity are stored as 16 bits.
+    """
     import laspy
     header = laspy.LasHeader(point_format=3, version="1.2")
-    las = laspy.LasData(header)
-    las.x = cloud['xyz'][:, 0]
-    las.y = cloud['xyz'][:, 1]
-    las.z = cloud['xyz'][:, 2]
-    las.red = ((cloud['irgb'] >> 16) & 0xFF) * 255
-    las.green = ((cloud['irgb'] >> 8) & 0xFF) * 255
-    las.blue = (cloud['irgb'] & 0xFF)
-    las.intensity = (cloud['irgb'] >> 24) * 255
-    las.write(save_path)
+    written = 0
+    with laspy.open(save_path, mode='w', header=header) as writer:
+        for chunk in cloud_chunks(cloud, chunk_points):
+            las = laspy.ScaleAwarePointRecord.zeros(chunk.shape[0],
+                                                    header=header)
+            las.x = chunk['xyz'][:, 0]
+            las.y = chunk['xyz'][:, 1]
+            las.z = chunk['xyz'][:, 2]
+            irgb = chunk['irgb']
+            las.red = ((irgb >> 16) & 0xFF) * 257
+            las.green = ((irgb >> 8) & 0xFF) * 257
+            las.blue = (irgb & 0xFF) * 257
+            las.intensity = (irgb >> 24) * 257
+            writer.write_points(las)
+            written += chunk.shape[0]
+            if progress is not None:
+                progress(written, cloud.shape[0])
+
+
+def iter_e57_chunks(file, chunk_points=1 << 20, intensity_scale=None,
+                    scan=0, fields=None):
+    """
+    Yield the points of a scan of an e57 file as cloud chunks, moved by
+    the pose of the scan, see iter_cloud_chunks ('intensity' is the only
+    attribute field of fields).
+    """
+    from pye57 import E57, libe57
+    e57 = E57(file, mode='r')
+    try:
+        header = e57.get_header(scan)
+        names = header.point_fields
+        pose = None
+        if header.has_pose():
+            pose = (header.rotation_matrix, header.translation)
+        columns = {}
+        buffers = []
+        for name in names:
+            if name in ('cartesianX', 'cartesianY', 'cartesianZ',
+                        'intensity', 'colorRed', 'colorGreen', 'colorBlue'):
+                columns[name], buffer = e57.make_buffer(name, chunk_points)
+                buffers.append(buffer)
+        vector = libe57.VectorSourceDestBuffer()
+        for buffer in buffers:
+            vector.append(buffer)
+        reader = header.points.reader(vector)
+        try:
+            while True:
+                n = reader.read()
+                if n == 0:
+                    break
+                data = {name: c[:n] for name, c in columns.items()}
+                rgb = None
+                if all(c in data for c in
+                       ('colorRed', 'colorGreen', 'colorBlue')):
+                    rgb = (data['colorRed'].astype(np.uint32) << 16) | \
+                        (data['colorGreen'].astype(np.uint32) << 8) | \
+                        data['colorBlue'].astype(np.uint32)
+                intensity = data.get('intensity')
+                if intensity_scale is None:
+                    intensity_scale = auto_intensity_scale(intensity)
+                x, y, z = (data['cartesianX'], data['cartesianY'],
+                           data['cartesianZ'])
+                if pose is not None:
+                    xyz = transform_xyz(x, y, z, *pose)
+                    x, y, z = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+                # the buffers are reused by the next read, pack copies them
+                yield pack_chunk(x, y, z, rgb, intensity, intensity_scale,
+                                 raw_intensity='intensity' in (fields or ()))
+        finally:
+            reader.close()
+    finally:
+        e57.close()
+
+
+def load_cloud(path, fields=None):
+    """
+    Load a pcd, ply, e57 or las/laz file by its extension. fields are the
+    names of the attribute fields to keep if the file has them (see
+    LAS_FIELDS), by default only xyz and irgb.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.pcd':
+        return load_pcd(path, fields=fields)
+    if ext == '.ply':
+        return load_ply(path, fields=fields)
+    if ext == '.e57':
+        return load_e57(path, fields=fields)
+    if ext in ('.las', '.laz'):
+        return load_las(path, fields=fields)
+    raise ValueError(f"Unsupported cloud file type: {path}")
+
+
+def iter_cloud_chunks(path, chunk_points=1 << 20, intensity_scale=None,
+                      fields=None):
+    """
+    Yield the points of a pcd, ply, las/laz or e57 file as cloud chunks of
+    at most chunk_points points (xyz, irgb and the attribute fields in
+    fields, see load_cloud), so a file larger than the memory can be
+    viewed or converted.
+    The intensity is scaled to 0-255 by intensity_scale, or by a scale
+    decided from the first chunk when it is None.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.pcd':
+        return iter_pcd_chunks(path, chunk_points, intensity_scale, fields)
+    if ext == '.ply':
+        return iter_ply_chunks(path, chunk_points, intensity_scale, fields)
+    if ext in ('.las', '.laz'):
+        return iter_las_chunks(path, chunk_points, intensity_scale, fields)
+    if ext == '.e57':
+        # all scans, with the same intensity scale
+        headers = e57_scans(path)
+        if intensity_scale is None:
+            intensity_scale = e57_intensity_scale(headers)
+        return itertools.chain.from_iterable(
+            iter_e57_chunks(path, chunk_points, intensity_scale, scan, fields)
+            for scan in range(len(headers)))
+    raise ValueError(f"Unsupported cloud file type: {path}")
+
+
+def probe(path):
+    """
+    Read only the header of a cloud file. Return a dict of 'points'
+    (number of points), 'fields' (names in the file) and 'bounds'
+    ((min xyz, max xyz), None if the header has no bounds), and 'scans'
+    (number of scans) for e57 files.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.pcd':
+        header, _ = read_pcd_header(path)
+        return {'points': pcd_points(header),
+                'fields': list(header['fields']), 'bounds': None}
+    if ext == '.ply':
+        _, elements, _ = read_ply_header(path)
+        for name, count, properties in elements:
+            if name == 'vertex':
+                return {'points': count,
+                        'fields': [p[0] for p in properties], 'bounds': None}
+        raise ValueError(f"{path} has no vertex element.")
+    if ext in ('.las', '.laz'):
+        import laspy
+        with laspy.open(path) as f:
+            header = f.header
+            return {'points': header.point_count,
+                    'fields': list(header.point_format.dimension_names),
+                    'bounds': (np.asarray(header.mins),
+                               np.asarray(header.maxs))}
+    if ext == '.e57':
+        scans = e57_scans(path)
+        fields = []
+        for scan in scans:
+            fields += [f for f in scan['fields'] if f not in fields]
+        bounds = None
+        if len(scans) == 1 and scans[0]['pose'] is None:
+            bounds = scans[0]['bounds']
+        return {'points': sum(scan['points'] for scan in scans),
+                'fields': fields, 'bounds': bounds, 'scans': len(scans)}
+    raise ValueError(f"Unsupported cloud file type: {path}")
 
 
 def gsdata_type(sh_dim):
@@ -238,49 +1125,74 @@ def matrix_to_quaternion_wxyz(matrices):
     return np.array([w, x, y, z]).T
 
 
-def load_gs_ply(path, T=None):
-    import meshio
-    mesh = meshio.read(path)
-    vertices = mesh.points
-    pws = vertices[:, :3]
-
-    alphas = mesh.point_data['opacity']
-    alphas = 1 / (1 + np.exp(-alphas))
-
-    scales = np.vstack((mesh.point_data['scale_0'],
-                        mesh.point_data['scale_1'],
-                        mesh.point_data['scale_2'])).T
-
-    rots = np.vstack((mesh.point_data['rot_0'],
-                      mesh.point_data['rot_1'],
-                      mesh.point_data['rot_2'],
-                      mesh.point_data['rot_3'])).T
-    rots /= np.linalg.norm(rots, axis=1)[:, np.newaxis]
-
-    sh_dim = len(mesh.point_data) - 11
-    shs = np.zeros([pws.shape[0], sh_dim])
-    shs[:, 0] = mesh.point_data['f_dc_0']
-    shs[:, 1] = mesh.point_data['f_dc_1']
-    shs[:, 2] = mesh.point_data['f_dc_2']
-
-    sh_rest_dim = sh_dim - 3
-    if sh_rest_dim > 0:
-        for i in range(sh_rest_dim):
-            name = f"f_rest_{i}"
-            shs[:, 3 + i] = mesh.point_data[name]
-        shs[:, 3:] = shs[:, 3:].reshape(-1, 3, sh_rest_dim // 3).transpose([0, 2, 1]).reshape(-1, sh_rest_dim)
+def gs_ply_columns(names):
+    """
+    The ply properties of the gaussian fields (see gsdata_type), in the
+    order of the float32 columns of the output.
+    """
+    rest = [name for name in names if name.startswith('f_rest_')]
+    k = len(rest) // 3
+    # f_rest is stored channel by channel, the shader wants it coefficient
+    # by coefficient: a transpose of the (channel, coefficient) indices.
+    rest = np.arange(3 * k).reshape(3, k).T.reshape(-1)
+    return ['x', 'y', 'z'] + [f'rot_{i}' for i in range(4)] + \
+        [f'scale_{i}' for i in range(3)] + ['opacity'] + \
+        [f'f_dc_{i}' for i in range(3)] + [f'f_rest_{i}' for i in rest]
 
-    pws = pws.astype(np.float32)
-    rots = rots.astype(np.float32)
-    scales = np.exp(scales).astype(np.float32)
-    alphas = alphas.astype(np.float32)
-    shs = shs.astype(np.float32)
-
-    dtypes = gsdata_type(sh_dim)
-
-    gs = np.rec.fromarrays(
-        [pws, rots, scales, alphas, shs], dtype=dtypes)
 
+def load_gs_ply(path, T=None, chunk_points=1 << 18):
+    """
+    Load a 3D gaussian splatting ply file. The body is read chunk by chunk:
+    one gather of the float32 columns per chunk, then the activations are
+    applied in place in float32, so only a chunk is allocated besides the
+    output. T is an optional rotation (3x3) or rigid transform (4x4)
+    applied to the positions and the rotations, see rotate_gaussian.
+    """
+    vertex = read_ply_element(path, 'vertex')
+    names = vertex.dtype.names
+    columns = gs_ply_columns(names)
+    missing = [name for name in columns if name not in names]
+    if missing:
+        raise ValueError(f"{path} is not a gaussian splatting ply, "
+                         f"it has no {', '.join(missing)}.")
+    index = np.array([names.index(name) for name in columns])
+    gs = np.empty(vertex.shape[0], gsdata_type(len(columns) - 11))
+    out = gs.view(np.float32).reshape(gs.shape[0], -1)
+    # the rows can be viewed as float32 when all properties are float32
+    plain = all(vertex.dtype[name] == np.dtype('<f4') for name in names)
+    if T is not None:
+        T = np.asarray(T, np.float64)
+        if T.shape not in ((3, 3), (4, 4)):
+            raise ValueError(f"T must be 3x3 or 4x4, not {T.shape}.")
+        R = T[:3, :3].astype(np.float32)
+        a, b, c, d = matrix_to_quaternion_wxyz(T[np.newaxis, :3, :3])[0]
+        # the quaternion of R times the rotation of a gaussian (wxyz)
+        Lq = np.array([[a, -b, -c, -d],
+                       [b, a, -d, c],
+                       [c, d, a, -b],
+                       [d, -c, b, a]], np.float32)
+    for start in range(0, vertex.shape[0], chunk_points):
+        chunk = vertex[start:start + chunk_points]
+        if plain:
+            rows = np.asarray(chunk).view(np.float32).reshape(
+                chunk.shape[0], -1)
+        else:
+            rows = structured_to_unstructured(chunk, np.float32)
+        dst = out[start:start + chunk.shape[0]]
+        np.take(rows, index, axis=1, out=dst, mode='clip')
+        rot = dst[:, 3:7]
+        rot /= np.sqrt(np.einsum('ij,ij->i', rot, rot))[:, np.newaxis]
+        np.exp(dst[:, 7:10], out=dst[:, 7:10])
+        alpha = dst[:, 10]
+        np.negative(alpha, out=alpha)
+        np.exp(alpha, out=alpha)
+        alpha += 1
+        np.reciprocal(alpha, out=alpha)
+        if T is not None:
+            dst[:, 0:3] = dst[:, 0:3] @ R.T
+            if T.shape == (4, 4):
+                dst[:, 0:3] += T[:3, 3].astype(np.float32)
+            dst[:, 3:7] = rot @ Lq.T
     return gs
 
 
@@ -306,6 +1218,8 @@ def rotate_gaussian(T, gs):
 def load_gs(fn):
     if fn.endswith('.ply'):
         return load_gs_ply(fn)
+    elif fn.endswith('.cgs'):
+        return load_compact_gs(fn)
     elif fn.endswith('.npy'):
         return np.load(fn)
     else:
@@ -314,9 +1228,56 @@ def load_gs(fn):
 
 
 def save_gs(fn, gs):
+    if fn.endswith('.cgs'):
+        return save_compact_gs(fn, gs)
     np.save(fn, gs)
 
 
+def save_compact_gs(fn, gs, chunk_size=256):
+    """
+    Save the gaussians in the compact format (see utils.gs_quantize), the
+    gaussians are reordered. Return the max error of each field added by
+    the quantization, it is also stored in the file.
+    The file is a json header line, then the raw arrays it lists.
+    """
+    from q3dviewer.utils.gs_quantize import gs_order, quantize_gs, \
+        dequantize_gs, gs_errors
+    gs = gs[gs_order(gs)]
+    packed, table, ranges = quantize_gs(gs, chunk_size)
+    errors = gs_errors(gs, dequantize_gs(packed, table, ranges, chunk_size))
+    arrays = dict(packed, table=table, scale_range=ranges['scale'],
+                  alpha_range=ranges['alpha'], rest_range=ranges['rest'])
+    meta = {'version': 1, 'num': int(gs.shape[0]),
+            'chunk_size': chunk_size, 'errors': errors,
+            'arrays': [[name, a.dtype.str, list(a.shape)]
+                       for name, a in arrays.items()]}
+    with open(fn, 'wb') as f:
+        f.write(json.dumps(meta).encode('ascii') + b'\n')
+        for a in arrays.values():
+            np.ascontiguousarray(a).tofile(f)
+    return errors
+
+
+def load_compact_gs(fn):
+    from q3dviewer.utils.gs_quantize import dequantize_gs
+    with open(fn, 'rb') as f:
+        try:
+            meta = json.loads(f.readline())
+        except ValueError:
+            raise ValueError(f"{fn} is not a compact gaussian file.")
+        arrays = {}
+        for name, dtype, shape in meta['arrays']:
+            count = int(np.prod(shape))
+            a = np.fromfile(f, dtype, count)
+            if a.shape[0] != count:
+                raise ValueError(f"{fn} is truncated.")
+            arrays[name] = a.reshape(shape)
+    ranges = {'scale': arrays['scale_range'], 'alpha': arrays['alpha_range'],
+              'rest': arrays['rest_range']}
+    return dequantize_gs(arrays, arrays['table'], ranges,
+                         meta['chunk_size'])
+
+
 def get_example_gs():
     gs_data = np.array([[0.,  0.,  0.,  # xyz
                          1.,  0.,  0., 0.,  # rot
@@ -0,0 +1,97 @@
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+Colormaps shared by the shaders and the cpu.
+
+Every colormap is a lookup table of LUT_SIZE rgb colors (uint8). The shader
+samples it as a 1D texture with texelFetch, the cpu gathers the same table
+with numpy, both compute the table index with the same float32 operations,
+so they give the same colors.
+"""
+
+import numpy as np
+from OpenGL.GL import *
+
+
+LUT_SIZE = 256
+COLORMAPS = ['rainbow', 'turbo', 'viridis', 'plasma', 'inferno',
+             'magma', 'jet', 'gray']
+_luts = {}
+
+
+def _rainbow_lut():
+    # the same as the former getRainbowColor, low values are red
+    values = 1.0 - (np.arange(LUT_SIZE) + 0.5) / LUT_SIZE
+    h = values * 5.0 + 1.0
+    i = np.floor(h).astype(int)
+    f = h - i
+    f = np.where(i % 2 == 0, 1 - f, f)
+    n = 1 - f
+    zero, one = np.zeros(LUT_SIZE), np.ones(LUT_SIZE)
+    r = np.select([i <= 1, i == 2, i == 3, i == 4], [n, zero, zero, n], one)
+    g = np.select([i <= 1, i == 2, i == 3, i == 4], [zero, n, one, one], n)
+    b = np.select([i <= 1, i == 2, i == 3, i == 4], [one, one, n, zero], zero)
+    return np.stack([r, g, b], axis=1)
+
+
+def get_lut(name='rainbow'):
+    """
+    Return the lookup table (LUT_SIZE x 3, uint8) of the colormap.
+    """
+    if name not in COLORMAPS:
+        raise ValueError(f"Invalid colormap: {name}, "
+                         f"please use one of {COLORMAPS}")
+    if name not in _luts:
+        if name == 'rainbow':
+            lut = _rainbow_lut()
+        else:
+            from matplotlib import colormaps
+            t = (np.arange(LUT_SIZE) + 0.5) / LUT_SIZE
+            lut = colormaps[name](t)[:, :3]
+        _luts[name] = np.round(lut * 255).astype(np.uint8)
+    return _luts[name]
+
+
+def lut_scale(vmin, vmax):
+    """
+    The factor from (value - vmin) to the table index, as float32.
+    """
+    return np.float32(LUT_SIZE) / np.float32(max(vmax - vmin, 1e-6))
+
+
+def lut_index(scalars, vmin=0, vmax=255):
+    """
+    The table index of each scalar, the same as getColormapColor in
+    cloud_vert.glsl.
+    """
+    v = np.asarray(scalars).astype(np.float32)
+    i = np.floor((v - np.float32(vmin)) * lut_scale(vmin, vmax))
+    return np.clip(i, 0, LUT_SIZE - 1).astype(np.int64)
+
+
+def apply_colormap(scalars, vmin=0, vmax=255, name='rainbow'):
+    """
+    Map scalars to rgb colors (N x 3, uint8).
+    """
+    return get_lut(name)[lut_index(scalars, vmin, vmax)]
+
+
+def create_lut_texture(name='rainbow', texture=None):
+    """
+    Upload the colormap to a 1D texture (GL_RGB8), the texture is created
+    if it is None. Return the texture.
+    """
+    if texture is None:
+        texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_1D, texture)
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+    glTexImage1D(GL_TEXTURE_1D, 0, GL_RGB8, LUT_SIZE, 0,
+                 GL_RGB, GL_UNSIGNED_BYTE, get_lut(name))
+    glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_1D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+    glBindTexture(GL_TEXTURE_1D, 0)
+    return texture
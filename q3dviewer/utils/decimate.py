@@ -0,0 +1,127 @@
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+Vectorized decimation of incoming scans, used to bound the number of
+points per scan before they are added to the viewer.
+
+random: a uniform random subset.
+voxel: one point per voxel, then a random subset if there are still
+       too many points.
+range: the points are split into bins by their distance from the sensor,
+       every bin keeps about the same number of points, so far (sparse)
+       points are kept while near (dense) points are thinned.
+"""
+
+import numpy as np
+from q3dviewer.utils.voxel_hash import voxel_keys
+
+
+DECIMATE_MODES = ['none', 'random', 'voxel', 'range']
+
+
+def random_indices(n, num, rng=None):
+    """
+    num sorted indices chosen uniformly from range(n) without replacement.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    if n <= num:
+        return np.arange(n)
+    idx = rng.choice(n, num, replace=False, shuffle=False)
+    idx.sort()
+    return idx
+
+
+def random_decimate(cloud, num, rng=None):
+    """
+    Keep a uniform random subset of at most num points.
+    """
+    if cloud.shape[0] <= num:
+        return cloud
+    return cloud[random_indices(cloud.shape[0], num, rng)]
+
+
+def voxel_decimate(cloud, num, voxel_size, rng=None):
+    """
+    Keep one point of every voxel, then at most num of them.
+    """
+    keys = voxel_keys(cloud['xyz'], voxel_size)
+    order = np.argsort(keys)
+    keys = keys[order]
+    first = np.ones(keys.shape[0], dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    idx = order[first]
+    if idx.shape[0] > num:
+        idx = idx[random_indices(idx.shape[0], num, rng)]
+    idx.sort()
+    return cloud[idx]
+
+
+def range_quota(counts, num):
+    """
+    The number of points to keep in each bin: the same quota q for every
+    bin, bins with less than q points are kept fully, sum is about num.
+    """
+    sorted_counts = np.sort(counts)
+    # total kept when the quota is the count of the k-th smallest bin
+    kept = np.cumsum(sorted_counts) + \
+        sorted_counts * np.arange(counts.shape[0] - 1, -1, -1)
+    k = np.searchsorted(kept, num)
+    if k >= counts.shape[0]:
+        return counts.copy()
+    below = sorted_counts[:k].sum()
+    q = (num - below) / (counts.shape[0] - k)
+    return np.minimum(counts, q)
+
+
+def range_decimate(cloud, num, bins=32, rng=None):
+    """
+    Keep about num points, stratified by the distance from the origin
+    (log spaced bins).
+    """
+    n = cloud.shape[0]
+    if n <= num:
+        return cloud
+    if rng is None:
+        rng = np.random.default_rng()
+    xyz = cloud['xyz']
+    dist = np.sqrt(np.einsum('ij,ij->i', xyz, xyz))
+    logd = np.log1p(dist)
+    lo, hi = logd.min(), logd.max()
+    b = ((logd - lo) * (bins / max(hi - lo, 1e-6))).astype(np.int64)
+    np.minimum(b, bins - 1, out=b)
+    counts = np.bincount(b, minlength=bins)
+    prob = range_quota(counts, num) / np.maximum(counts, 1)
+    keep = rng.random(n, dtype=np.float32) < prob[b]
+    return cloud[keep]
+
+
+class Decimator:
+    """
+    A decimation stage, call it with a cloud to get at most about num
+    points with the chosen mode.
+    """
+    def __init__(self, mode='random', num=100000, voxel_size=0.1, bins=32,
+                 seed=None):
+        if mode not in DECIMATE_MODES:
+            raise ValueError(f"Invalid decimate mode: {mode}, "
+                             f"please use one of {DECIMATE_MODES}")
+        if voxel_size <= 0:
+            raise ValueError("voxel_size must be positive")
+        self.mode = mode
+        self.num = num
+        self.voxel_size = voxel_size
+        self.bins = bins
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self, cloud):
+        if self.mode == 'random':
+            return random_decimate(cloud, self.num, self.rng)
+        elif self.mode == 'voxel':
+            return voxel_decimate(cloud, self.num, self.voxel_size, self.rng)
+        elif self.mode == 'range':
+            return range_decimate(cloud, self.num, self.bins, self.rng)
+        return cloud
@@ -38,3 +38,20 @@ def set_uniform(shader, content, name):
     else:
         raise TypeError(
             f"Unsupported type for uniform '{name}': {type(content)}.")
+
+
+def resize_buffer(vbo, nbytes, copy_bytes=0, usage=GL_DYNAMIC_DRAW):
+    """
+    Create a buffer of nbytes holding a copy of the first copy_bytes of vbo.
+    The copy is done on the gpu, the caller deletes vbo when it is done.
+    """
+    new_vbo = glGenBuffers(1)
+    glBindBuffer(GL_COPY_WRITE_BUFFER, new_vbo)
+    glBufferData(GL_COPY_WRITE_BUFFER, nbytes, None, usage)
+    if vbo is not None and copy_bytes > 0:
+        glBindBuffer(GL_COPY_READ_BUFFER, vbo)
+        glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER,
+                            0, 0, copy_bytes)
+        glBindBuffer(GL_COPY_READ_BUFFER, 0)
+    glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+    return new_vbo
@@ -0,0 +1,158 @@
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+Compact storage of gaussians (see cloud_io.gsdata_type), about 65 bytes per
+gaussian with degree 3 SH instead of 236.
+
+The gaussians are sorted in morton order and cut into chunks of chunk_size,
+a chunk table gives the origin and the step (origin x, y, z, step) of each
+chunk, the positions are float16 offsets from the origin in steps.
+The rotations are int8, the log scales, the opacity and the SH rest
+coefficients are uint8 in the ranges stored with them, the SH DC terms
+(the base color) are float16. Every field is stored as its own planar
+array (one row per component), so the decoder works on contiguous rows
+and writes the output with one transpose per block.
+"""
+
+import numpy as np
+from q3dviewer.utils.cloud_io import gsdata_type
+from q3dviewer.utils.octree import cloud_bounds, morton_encode
+
+
+def gs_compact_fields(sh_dim):
+    """
+    (name, dtype, rows) of the planar arrays of the compact storage.
+    """
+    return [('pw', '<f2', 3), ('rot', 'i1', 4), ('scale', 'u1', 3),
+            ('alpha', 'u1', 1), ('dc', '<f2', 3), ('rest', 'u1', sh_dim - 3)]
+
+
+def _quantize(values, lo, hi):
+    """
+    values in [lo, hi] to uint8, lo and hi broadcast on the last axis.
+    """
+    step = (hi - lo) / 255
+    step = np.where(step > 0, step, 1).astype(np.float32)
+    q = (values - lo) / step
+    return np.clip(np.rint(q), 0, 255).astype(np.uint8), step
+
+
+def gs_order(gs):
+    """
+    The morton order of the gaussians, so that a chunk covers a small space.
+    """
+    lo, size = cloud_bounds(gs['pw'])
+    q = np.nan_to_num((gs['pw'] - lo) / size * ((1 << 21) - 1))
+    q = np.clip(q, 0, (1 << 21) - 1).astype(np.uint64)
+    return np.argsort(morton_encode(q), kind='stable')
+
+
+def quantize_gs(gs, chunk_size=256):
+    """
+    Encode gaussians of gsdata_type, sorted by gs_order. Return (packed,
+    table, ranges): packed is a dict of the arrays of gs_compact_fields,
+    table is a float32 array (chunks x 4), ranges is a dict of the float32
+    (lo, step) of 'scale' (log scale), 'alpha' and 'rest'.
+    """
+    num = gs.shape[0]
+    sh_dim = gs.dtype['sh'].shape[0]
+    packed = {name: np.empty((dim, num), dtype)
+              for name, dtype, dim in gs_compact_fields(sh_dim)}
+    table = np.zeros((-(-num // chunk_size), 4), np.float32)
+    if num == 0:
+        ranges = {name: np.zeros((2, dim), np.float32) for name, dim in
+                  (('scale', 3), ('alpha', 1), ('rest', sh_dim - 3))}
+        return packed, table, ranges
+
+    # positions: per chunk, a power of two step over the largest offset
+    pw = gs['pw'].astype(np.float64)
+    pad = table.shape[0] * chunk_size - num
+    padded = np.concatenate([pw, np.repeat(pw[-1:], pad, axis=0)])
+    padded = padded.reshape(-1, chunk_size, 3)
+    origin = (padded.min(axis=1) + padded.max(axis=1)) / 2
+    reach = np.abs(padded - origin[:, np.newaxis]).max(axis=(1, 2))
+    step = np.exp2(np.ceil(np.log2(np.maximum(reach, 1e-30))))
+    table[:, :3] = origin
+    table[:, 3] = step
+    chunk = np.arange(num) // chunk_size
+    packed['pw'][:] = ((pw - table[chunk, :3]) / table[chunk, 3:]).T
+
+    rot = gs['rot'] / np.linalg.norm(gs['rot'], axis=1)[:, np.newaxis]
+    packed['rot'][:] = np.rint(rot * 127).T
+
+    ranges = {}
+    log_scale = np.log(gs['scale'])
+    lo = log_scale.min(axis=0)
+    q, step = _quantize(log_scale, lo, log_scale.max(axis=0))
+    packed['scale'][:] = q.T
+    ranges['scale'] = np.stack([lo, step]).astype(np.float32)
+    packed['alpha'][0], step = _quantize(gs['alpha'], 0., 1.)
+    ranges['alpha'] = np.array([[0.], [step]], np.float32)
+    packed['dc'][:] = gs['sh'][:, :3].T
+    rest = gs['sh'][:, 3:]
+    if rest.shape[1] > 0:
+        lo = rest.min(axis=0)
+        q, step = _quantize(rest, lo, rest.max(axis=0))
+        packed['rest'][:] = q.T
+        ranges['rest'] = np.stack([lo, step]).astype(np.float32)
+    else:
+        ranges['rest'] = np.zeros((2, 0), np.float32)
+    return packed, table, ranges
+
+
+def dequantize_gs(packed, table, ranges, chunk_size=256, block=1 << 14):
+    """
+    Decode the gaussians encoded by quantize_gs in one vectorized pass.
+    A block is decoded into planar float32 rows, then transposed into the
+    output, so every operation runs over contiguous memory.
+    """
+    num = packed['pw'].shape[1]
+    sh_dim = packed['rest'].shape[0] + 3
+    gs = np.empty(num, gsdata_type(sh_dim))
+    out = gs.view(np.float32).reshape(num, 11 + sh_dim)
+    scale_lo, scale_step = (r[:, np.newaxis] for r in ranges['scale'])
+    alpha_lo, alpha_step = ranges['alpha'][:, 0]
+    rest_lo, rest_step = (r[:, np.newaxis] for r in ranges['rest'])
+    block = max(block // chunk_size, 1) * chunk_size
+    tmp = np.empty((11 + sh_dim, block), np.float32)
+    for start in range(0, num, block):
+        end = min(start + block, num)
+        rows = tmp[:, :end - start]
+        first = start // chunk_size
+        chunk = np.repeat(table[first:first + block // chunk_size].T,
+                          chunk_size, axis=1)[:, :end - start]
+        np.multiply(packed['pw'][:, start:end], chunk[3], out=rows[0:3])
+        rows[0:3] += chunk[:3]
+        rot = rows[3:7]
+        rot[:] = packed['rot'][:, start:end]
+        rot /= np.sqrt(np.einsum('ij,ij->j', rot, rot))
+        np.multiply(packed['scale'][:, start:end], scale_step, out=rows[7:10])
+        rows[7:10] += scale_lo
+        np.exp(rows[7:10], out=rows[7:10])
+        np.multiply(packed['alpha'][0, start:end], alpha_step, out=rows[10])
+        rows[10] += alpha_lo
+        rows[11:14] = packed['dc'][:, start:end]
+        np.multiply(packed['rest'][:, start:end], rest_step, out=rows[14:])
+        rows[14:] += rest_lo
+        out[start:end] = rows.T
+    return gs
+
+
+def gs_errors(gs, decoded):
+    """
+    The max absolute error of each field added by the quantization,
+    gs and decoded in the same order.
+    """
+    rot = gs['rot'] / np.linalg.norm(gs['rot'], axis=1)[:, np.newaxis]
+    errors = {
+        'pw': np.abs(decoded['pw'] - gs['pw']),
+        'rot': np.abs(decoded['rot'] - rot),
+        'log_scale': np.abs(np.log(decoded['scale']) - np.log(gs['scale'])),
+        'alpha': np.abs(decoded['alpha'] - gs['alpha']),
+        'sh_dc': np.abs(decoded['sh'][:, :3] - gs['sh'][:, :3]),
+        'sh_rest': np.abs(decoded['sh'][:, 3:] - gs['sh'][:, 3:])}
+    return {name: float(np.nanmax(e)) if e.size else 0.
+            for name, e in errors.items()}
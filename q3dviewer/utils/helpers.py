@@ -5,42 +5,16 @@ Distributed under MIT license. See LICENSE for more information.
 
 import numpy as np
 from OpenGL.GL import *
+from q3dviewer.utils.colormap import apply_colormap
 
 
 def rainbow(scalars, scalar_min=0, scalar_max=255):
-    range = scalar_max - scalar_min
-    values = 1.0 - (scalars - scalar_min) / range
-    # values = (scalars - scalar_min) / range  # using inverted color
-    colors = np.zeros([scalars.shape[0], 3], dtype=np.float32)
-    values = np.clip(values, 0, 1)
-
-    h = values * 5.0 + 1.0
-    i = np.floor(h).astype(int)
-    f = h - i
-    f[np.logical_not(i % 2)] = 1 - f[np.logical_not(i % 2)]
-    n = 1 - f
-
-    # idx = i <= 1
-    colors[i <= 1, 0] = n[i <= 1] * 255
-    colors[i <= 1, 1] = 0
-    colors[i <= 1, 2] = 255
-
-    colors[i == 2, 0] = 0
-    colors[i == 2, 1] = n[i == 2] * 255
-    colors[i == 2, 2] = 255
-
-    colors[i == 3, 0] = 0
-    colors[i == 3, 1] = 255
-    colors[i == 3, 2] = n[i == 3] * 255
-
-    colors[i == 4, 0] = n[i == 4] * 255
-    colors[i == 4, 1] = 255
-    colors[i == 4, 2] = 0
-
-    colors[i >= 5, 0] = 255
-    colors[i >= 5, 1] = n[i >= 5] * 255
-    colors[i >= 5, 2] = 0
-    return colors
+    """
+    Rainbow colors (N x 3, float32 in [0, 255]) of the scalars,
+    the same colors as the intensity mode of CloudItem.
+    """
+    return apply_colormap(scalars, scalar_min, scalar_max,
+                          'rainbow').astype(np.float32)
 
 
 def text_to_rgba(color_text, flat=False):
@@ -257,6 +257,23 @@ def makeRt(T):
     return R, t
 
 
+def point_distance(p1, p2):
+    return float(np.linalg.norm(np.asarray(p2) - np.asarray(p1)))
+
+
+def point_angle(p1, p2, p3):
+    """
+    Angle p1-p2-p3 at p2 in degrees.
+    """
+    v1 = np.asarray(p1) - np.asarray(p2)
+    v2 = np.asarray(p3) - np.asarray(p2)
+    norm = np.linalg.norm(v1) * np.linalg.norm(v2)
+    if norm < _epsilon_:
+        return 0.
+    cos = np.clip(np.dot(v1, v2) / norm, -1., 1.)
+    return float(np.degrees(np.arccos(cos)))
+
+
 # euler = np.array([1, 0.1, 0.1])
 # euler_angles = matrix_to_euler(euler_to_matrix(euler))
 # print("Euler Angles:", euler_angles)
@@ -0,0 +1,267 @@
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+Level-of-detail octree for point clouds.
+
+Every node owns a random subsample of the points inside its cell (at most
+node_capacity points); the remaining points are pushed down to the children.
+After build_octree the points are reordered so that each node is a
+contiguous range of the buffer, so a LOD cut of the tree can be drawn with
+a handful of glMultiDrawArrays ranges.
+"""
+
+import numpy as np
+
+
+node_type = [('level', '<i4'),
+             ('key', '<u8'),
+             ('start', '<i8'),
+             ('count', '<i8'),
+             ('parent', '<i8'),
+             ('center', '<f4', (3,)),
+             ('half', '<f4')]
+
+
+def _split_by_3(v):
+    # spread the lower 21 bits of v so that there are two zeros between bits
+    v = v.astype(np.uint64) & np.uint64(0x1fffff)
+    v = (v | (v << np.uint64(32))) & np.uint64(0x1f00000000ffff)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x1f0000ff0000ff)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x100f00f00f00f00f)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x10c30c30c30c30c3)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x1249249249249249)
+    return v
+
+
+def _compact_by_3(v):
+    v = v.astype(np.uint64) & np.uint64(0x1249249249249249)
+    v = (v | (v >> np.uint64(2))) & np.uint64(0x10c30c30c30c30c3)
+    v = (v | (v >> np.uint64(4))) & np.uint64(0x100f00f00f00f00f)
+    v = (v | (v >> np.uint64(8))) & np.uint64(0x1f0000ff0000ff)
+    v = (v | (v >> np.uint64(16))) & np.uint64(0x1f00000000ffff)
+    v = (v | (v >> np.uint64(32))) & np.uint64(0x1fffff)
+    return v
+
+
+def morton_encode(q):
+    """
+    Interleave integer grid coordinates (N x 3, < 2**21) into morton codes.
+    """
+    return _split_by_3(q[:, 0]) | \
+        (_split_by_3(q[:, 1]) << np.uint64(1)) | \
+        (_split_by_3(q[:, 2]) << np.uint64(2))
+
+
+def morton_decode(code):
+    return np.stack([_compact_by_3(code),
+                     _compact_by_3(code >> np.uint64(1)),
+                     _compact_by_3(code >> np.uint64(2))], axis=1)
+
+
+def cloud_bounds(xyz):
+    """
+    Return the origin and the edge length of the cube enclosing xyz.
+    """
+    finite = np.isfinite(xyz).all(axis=1)
+    if not np.any(finite):
+        return np.zeros(3), 1.
+    lo = xyz[finite].min(axis=0).astype(np.float64)
+    hi = xyz[finite].max(axis=0).astype(np.float64)
+    size = float(np.max(hi - lo))
+    # keep a small margin so that the max corner is still inside the cube
+    size = max(size * (1 + 1e-6), 1e-6)
+    return lo, size
+
+
+def build_octree(xyz, node_capacity=20000, max_depth=12, seed=0,
+                 bounds=None, depth=None):
+    """
+    Build a LOD octree over xyz.
+
+    Return (order, nodes): xyz[order] puts the points of every node into
+    the contiguous range [start, start + count), and nodes is sorted by
+    (level, key) so that parents always come before their children.
+    bounds: (origin, edge length) of the root cell, by default the cube
+      enclosing xyz.
+    depth: the deepest level of every point, a point stops there even if
+      its node is full.
+    """
+    max_depth = int(np.clip(max_depth, 1, 21))
+    num = xyz.shape[0]
+    if num == 0:
+        return np.empty(0, np.int64), np.empty(0, node_type)
+
+    lo, size = cloud_bounds(xyz) if bounds is None else bounds
+    res = 1 << max_depth
+    q = (xyz.astype(np.float64) - lo) * (res / size)
+    q = np.nan_to_num(q, nan=0., posinf=res - 1, neginf=0.)
+    q = np.clip(q, 0, res - 1).astype(np.uint64)
+    code = morton_encode(q)
+    del q
+
+    # random order inside every cell, so taking the first points of a cell
+    # is a uniform subsample of it.
+    perm = np.random.default_rng(seed).permutation(num)
+    code = code[perm]
+    if depth is not None:
+        depth = np.minimum(depth[perm], max_depth)
+
+    level = np.full(num, max_depth, dtype=np.int32)
+    remaining = np.arange(num)
+    for lv in range(max_depth):
+        if depth is not None:
+            stop = depth[remaining] == lv
+            level[remaining[stop]] = lv
+            remaining = remaining[~stop]
+        if remaining.size == 0:
+            break
+        keys = code[remaining] >> np.uint64(3 * (max_depth - lv))
+        o = np.argsort(keys, kind='stable')
+        sorted_keys = keys[o]
+        first = np.ones(o.shape[0], dtype=bool)
+        first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        idx = np.arange(o.shape[0])
+        rank = idx - np.maximum.accumulate(np.where(first, idx, 0))
+        take = rank < node_capacity
+        level[remaining[o[take]]] = lv
+        remaining = remaining[o[~take]]
+
+    node_key = code >> (np.uint64(3) * (max_depth - level).astype(np.uint64))
+    o = np.lexsort((node_key, level))
+    order = perm[o]
+    level = level[o]
+    node_key = node_key[o]
+    del code, perm, o
+
+    first = np.ones(num, dtype=bool)
+    first[1:] = (level[1:] != level[:-1]) | (node_key[1:] != node_key[:-1])
+    starts = np.flatnonzero(first)
+
+    nodes = np.empty(starts.shape[0], node_type)
+    nodes['level'] = level[starts]
+    nodes['key'] = node_key[starts]
+    nodes['start'] = starts
+    nodes['count'] = np.diff(np.append(starts, num))
+    set_node_cells(nodes, lo, size)
+    link_parents(nodes)
+    return order, nodes
+
+
+def set_node_cells(nodes, lo, size):
+    """
+    Set the center and the half size of the nodes, from their level and
+    key in the root cell (lo, size).
+    """
+    cell = size / (1 << nodes['level'].astype(np.int64))
+    nodes['center'] = lo + (morton_decode(nodes['key']) + 0.5) * cell[:, None]
+    nodes['half'] = cell / 2
+
+
+def link_parents(nodes):
+    """
+    Set the parent index of the nodes sorted by (level, key),
+    the parent of a node is the node at level - 1 with key >> 3.
+    """
+    nodes['parent'] = -1
+    if nodes.shape[0] == 0:
+        return
+    max_level = int(nodes['level'][-1])
+    lv_first = np.searchsorted(nodes['level'], np.arange(max_level + 2))
+    for lv in range(1, max_level + 1):
+        s, e = lv_first[lv], lv_first[lv + 1]
+        if s == e:
+            continue
+        ps, pe = lv_first[lv - 1], lv_first[lv]
+        parent_keys = nodes['key'][s:e] >> np.uint64(3)
+        nodes['parent'][s:e] = ps + np.searchsorted(
+            nodes['key'][ps:pe], parent_keys)
+
+
+def frustum_planes(view_matrix, projection_matrix):
+    """
+    Extract the 6 clip planes (a, b, c, d) in world frame,
+    a point p is inside when a*x + b*y + c*z + d >= 0 for all planes.
+    """
+    m = projection_matrix @ view_matrix
+    planes = np.stack([m[3] + m[0], m[3] - m[0],
+                       m[3] + m[1], m[3] - m[1],
+                       m[3] + m[2], m[3] - m[2]])
+    return planes
+
+
+def select_nodes(nodes, view_matrix, projection_matrix, width,
+                 point_budget, min_node_size=1.):
+    """
+    Choose a LOD cut of the octree for the current view.
+
+    Nodes outside of the view frustum are culled, the visible ones are
+    refined from the largest on screen to the smallest until the
+    point budget is reached. Nodes are not refined once they are smaller
+    than min_node_size pixels on screen.
+    Return the draw ranges (first, count) as int32 arrays.
+    """
+    if nodes.shape[0] == 0:
+        return np.empty(0, np.int32), np.empty(0, np.int32)
+    priority = node_priority(nodes, view_matrix, projection_matrix, width,
+                             min_node_size)
+    level = nodes['level']
+    order = np.lexsort((level, -priority))
+    order = order[priority[order] > -np.inf]
+    if order.shape[0] == 0:
+        return np.empty(0, np.int32), np.empty(0, np.int32)
+    total = np.cumsum(nodes['count'][order])
+    num = max(int(np.searchsorted(total, point_budget, side='right')), 1)
+    chosen = np.sort(nodes['start'][order[:num]])
+    counts = nodes['count'][np.searchsorted(nodes['start'], chosen)]
+
+    # merge ranges which are adjacent in the buffer
+    ends = chosen + counts
+    new_range = np.ones(chosen.shape[0], dtype=bool)
+    new_range[1:] = chosen[1:] != ends[:-1]
+    firsts = chosen[new_range]
+    last = np.append(np.flatnonzero(new_range)[1:] - 1, chosen.shape[0] - 1)
+    counts = ends[last] - firsts
+    return firsts.astype(np.int32), counts.astype(np.int32)
+
+
+def node_priority(nodes, view_matrix, projection_matrix, width,
+                  min_node_size=1.):
+    """
+    The projected size (pixels) of the nodes, -inf for the nodes which
+    are outside of the view frustum or whose parent is not refined.
+    Drawing the nodes from the highest priority down gives a LOD cut of
+    the tree for any number of nodes.
+    """
+    center = nodes['center'].astype(np.float64)
+    half = nodes['half'].astype(np.float64)
+
+    planes = frustum_planes(view_matrix, projection_matrix)
+    dist = center @ planes[:, :3].T + planes[:, 3]
+    reach = half[:, None] * np.abs(planes[:, :3]).sum(axis=1)
+    visible = np.all(dist >= -reach, axis=1)
+
+    # projected size of the bounding sphere in pixels
+    depth = -(center @ view_matrix[2, :3] + view_matrix[2, 3])
+    radius = half * np.sqrt(3)
+    focal = projection_matrix[0, 0] * width / 2
+    with np.errstate(divide='ignore'):
+        size_px = np.where(depth > radius,
+                           radius / np.maximum(depth, 1e-9) * focal, np.inf)
+    priority = np.where(visible, size_px, -np.inf)
+
+    # a child can never be more important than its parent, so that any
+    # prefix of the priority order is a valid cut of the tree.
+    level = nodes['level']
+    parent = nodes['parent']
+    lv_first = np.searchsorted(level, np.arange(level[-1] + 2))
+    for lv in range(1, level[-1] + 1):
+        s, e = lv_first[lv], lv_first[lv + 1]
+        if s == e:
+            continue
+        p = priority[parent[s:e]]
+        refine = p >= min_node_size
+        priority[s:e] = np.where(refine, np.minimum(priority[s:e], p), -np.inf)
+    return priority
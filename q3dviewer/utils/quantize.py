@@ -0,0 +1,133 @@
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+Compact point storage: positions are stored as int16 offsets from the
+origin of a spatial cell, 10 bytes per point instead of 16.
+
+The points of every cell are stored one after another as a chunk, a chunk
+table gives the origin and the step (origin x, y, z, step) of each chunk
+and the index of its first point. The chunks have the size of their cells,
+so a sparse cloud is not padded. To find the chunk of a point without a
+full search, chunk_blocks gives the chunk of every block_size-th point.
+"""
+
+import numpy as np
+from q3dviewer.utils.voxel_hash import voxel_keys
+
+
+compact_type = [('xyz', '<i2', (3,)), ('irgb', '<u2', (2,))]
+_QMAX = 32767
+
+
+def compact_dtype(fields=()):
+    """
+    compact_type with float32 fields, padded so that the fields are
+    4 bytes aligned.
+    """
+    if not fields:
+        return np.dtype(compact_type)
+    return np.dtype(compact_type + [('_pad', '<u2')] +
+                    [(name, '<f4') for name in fields])
+
+
+def cell_size(error):
+    """
+    Edge length of the cells, every point of a cell is within
+    +-32767 steps of the cell center.
+    """
+    return 2 * _QMAX * 2 * error
+
+
+def quantize_points(data, error):
+    """
+    Encode a cloud of [('xyz', '<f4', (3,)), ('irgb', '<u4')] with a
+    max error of error (per axis, in the unit of xyz).
+    Return (packed, table, starts): packed is an array of compact_type
+    grouped by cell, table is a float32 array (chunks x 4) and starts is
+    the index (uint32) of the first point of every chunk in packed.
+    Points with non finite coordinates are dropped.
+    The other scalar fields of data are kept as float32.
+    """
+    fields = [name for name in data.dtype.names
+              if name not in ('xyz', 'irgb') and data.dtype[name].shape == ()]
+    dtype = compact_dtype(fields)
+    xyz = data['xyz']
+    finite = np.isfinite(xyz).all(axis=1)
+    if not np.all(finite):
+        data = data[finite]
+        xyz = data['xyz']
+    num = data.shape[0]
+    if num == 0:
+        return np.empty(0, dtype), np.empty((0, 4), np.float32), \
+            np.empty(0, np.uint32)
+
+    step = 2. * error
+    size = cell_size(error)
+    # the keys and the origins from the same float64 positions, so a point
+    # near a cell border is not put in the cell of its neighbour
+    xyz = xyz.astype(np.float64)
+    keys = voxel_keys(xyz, size)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    first = np.ones(num, dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    starts = np.flatnonzero(first)
+    group = np.cumsum(first) - 1
+
+    sorted_xyz = xyz[order]
+    cell = np.floor(sorted_xyz[starts] / size)
+    origin = ((cell + 0.5) * size).astype(np.float32)
+    q = np.rint((sorted_xyz - origin[group]) / step)
+
+    packed = np.empty(num, dtype)
+    packed['xyz'] = np.clip(q, -_QMAX, _QMAX)
+    packed['irgb'] = np.ascontiguousarray(
+        data['irgb'][order]).view('<u2').reshape(-1, 2)
+    if fields:
+        packed['_pad'] = 0
+    for name in fields:
+        packed[name] = data[name][order]
+
+    table = np.empty((starts.shape[0], 4), np.float32)
+    table[:, :3] = origin
+    table[:, 3] = step
+    return packed, table, starts.astype(np.uint32)
+
+
+def chunk_blocks(starts, num, block_size=256, first=0):
+    """
+    The chunk of the points first * block_size, (first + 1) * block_size,
+    ... up to the last of the num points, plus the chunk of the last point,
+    so the chunk of a point i is found between the entries i // block_size
+    and i // block_size + 1.
+    """
+    blocks = -(-num // block_size)
+    index = np.arange(first, blocks + 1, dtype=np.int64) * block_size
+    index = np.minimum(index, max(num - 1, 0))
+    chunk = np.searchsorted(starts, index, side='right') - 1
+    return np.maximum(chunk, 0).astype(np.uint32)
+
+
+def dequantize_points(packed, table, starts, first=0):
+    """
+    Decode the points packed by quantize_points, packed are the points
+    [first, first + len(packed)) of the storage of table and starts.
+    """
+    end = first + packed.shape[0]
+    c0 = max(int(np.searchsorted(starts, first, side='right')) - 1, 0)
+    c1 = int(np.searchsorted(starts, end, side='left'))
+    edges = np.clip(np.append(starts[c0:c1], end), first, end)
+    chunk = np.repeat(np.arange(c0, c1), np.diff(edges))
+    fields = [name for name in packed.dtype.names
+              if name not in ('xyz', 'irgb', '_pad')]
+    out = np.empty(packed.shape[0], [('xyz', '<f4', (3,)), ('irgb', '<u4')] +
+                   [(name, '<f4') for name in fields])
+    out['xyz'] = table[chunk, :3] + \
+        packed['xyz'].astype(np.float32) * table[chunk, 3:]
+    out['irgb'] = np.ascontiguousarray(packed['irgb']).view('<u4').reshape(-1)
+    for name in fields:
+        out[name] = packed[name]
+    return out
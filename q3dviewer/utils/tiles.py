@@ -0,0 +1,361 @@
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+Out-of-core tiled octree of a point cloud, for clouds larger than the
+memory. A tile directory holds:
+
+meta.json   bounds of the root cell, number of points, node capacity and
+            the ranges of the attribute fields
+nodes.npy   the octree nodes (octree.node_type) sorted by (level, key)
+points.npy  the points, every node is a contiguous range of it
+
+It is built with bounded memory:
+1. the source files are streamed in chunks and their points are split
+   into tiles (cells of the root cell), in a pool of processes, one task
+   per file. Tiles with more than tile_points points are split again.
+2. the LOD octree of every tile is built in the pool.
+3. the root points of the tiles (a random subsample of each tile) build
+   the levels above the tiles.
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from q3dviewer.utils.cloud_io import iter_cloud_chunks, probe, conform
+from q3dviewer.utils.octree import node_type, build_octree, morton_encode, \
+    morton_decode, set_node_cells, link_parents
+
+
+TILE_VERSION = 1
+
+
+def is_tile_dir(path):
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def open_tiles(path):
+    """
+    Return (meta, nodes, points) of a tile directory, the points are
+    memory mapped, so only the header and the nodes are read.
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta.get('version') != TILE_VERSION:
+        raise ValueError(f"Unsupported tile version: {meta.get('version')}")
+    nodes = np.load(os.path.join(path, 'nodes.npy'))
+    points = np.load(os.path.join(path, 'points.npy'), mmap_mode='r')
+    return meta, nodes, points
+
+
+def cell_keys(xyz, lo, size, depth):
+    """
+    The morton keys of the cells at depth containing xyz.
+    """
+    res = 1 << depth
+    q = (xyz.astype(np.float64) - lo) * (res / size)
+    q = np.clip(q, 0, res - 1).astype(np.uint64)
+    return morton_encode(q)
+
+
+def source_bounds(paths, chunk_points):
+    """
+    (min xyz, max xyz, number of points) of the source files, from the
+    headers when they have bounds, otherwise by reading the points.
+    """
+    lo = np.full(3, np.inf)
+    hi = np.full(3, -np.inf)
+    num = 0
+    for path in paths:
+        info = probe(path)
+        num += info['points']
+        if info['bounds'] is not None:
+            lo = np.minimum(lo, info['bounds'][0])
+            hi = np.maximum(hi, info['bounds'][1])
+            continue
+        for chunk in iter_cloud_chunks(path, chunk_points, 1.):
+            xyz = chunk['xyz']
+            xyz = xyz[np.isfinite(xyz).all(axis=1)]
+            if xyz.shape[0] > 0:
+                lo = np.minimum(lo, xyz.min(axis=0))
+                hi = np.maximum(hi, xyz.max(axis=0))
+    return lo, hi, num
+
+
+def field_ranges(chunk, ranges):
+    """
+    Update ranges {name: [min, max]} with the attribute fields of chunk.
+    """
+    for name in chunk.dtype.names:
+        if name in ('xyz', 'irgb') or chunk.dtype[name].shape != ():
+            continue
+        values = chunk[name]
+        values = values[np.isfinite(values)]
+        if values.shape[0] == 0:
+            continue
+        lo, hi = float(values.min()), float(values.max())
+        if name in ranges:
+            lo, hi = min(lo, ranges[name][0]), max(hi, ranges[name][1])
+        ranges[name] = [lo, hi]
+
+
+def tile_file(tmp, depth, key, part):
+    return os.path.join(tmp, f"{depth}_{key}_{part}.bin")
+
+
+def write_parts(chunk, tmp, lo, size, depth, part, counts):
+    """
+    Append the points of chunk to the files of their tiles at depth.
+    """
+    keys = cell_keys(chunk['xyz'], lo, size, depth)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    chunk = chunk[order]
+    starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+    ends = np.append(starts[1:], keys.shape[0])
+    for s, e in zip(starts, ends):
+        key = int(keys[s])
+        with open(tile_file(tmp, depth, key, part), 'ab') as f:
+            chunk[s:e].tofile(f)
+        counts[key] = counts.get(key, 0) + int(e - s)
+
+
+def partition_file(path, part, tmp, lo, size, depth, dtype, chunk_points,
+                   fields=None):
+    """
+    Split the points of one source file into tiles at depth, run in the
+    pool. Return the number of points of every tile and the field ranges.
+    """
+    dtype = np.dtype(dtype)
+    counts = {}
+    ranges = {}
+    for chunk in iter_cloud_chunks(path, chunk_points, fields=fields):
+        chunk = conform(chunk, dtype)
+        chunk = chunk[np.isfinite(chunk['xyz']).all(axis=1)]
+        if chunk.shape[0] == 0:
+            continue
+        field_ranges(chunk, ranges)
+        write_parts(chunk, tmp, lo, size, depth, part, counts)
+    return counts, ranges
+
+
+def tile_parts(tmp, depth, key, parts):
+    """
+    The files of a tile, a split tile may have no points of some parts.
+    """
+    files = [tile_file(tmp, depth, key, p) for p in parts]
+    return [f for f in files if os.path.exists(f)]
+
+
+def split_tile(tmp, depth, key, parts, dtype, lo, size, chunk_points):
+    """
+    Split a tile into its children at depth + 1, chunk by chunk.
+    Return the number of points of every child.
+    """
+    counts = {}
+    for part in parts:
+        file = tile_file(tmp, depth, key, part)
+        if not os.path.exists(file):
+            continue
+        data = np.memmap(file, dtype, mode='r')
+        for start in range(0, data.shape[0], chunk_points):
+            chunk = np.array(data[start:start + chunk_points])
+            write_parts(chunk, tmp, lo, size, depth + 1, part, counts)
+        del data
+        os.remove(file)
+    return counts
+
+
+def build_tile(tmp, depth, key, parts, dtype, lo, size, node_capacity,
+               max_depth, seed):
+    """
+    Build the octree of one tile, run in the pool. The points of the tile
+    are written back in node order without the root node. Return the
+    root points and the nodes (levels and keys in the tile).
+    """
+    dtype = np.dtype(dtype)
+    files = tile_parts(tmp, depth, key, parts)
+    data = np.concatenate([np.fromfile(f, dtype) for f in files])
+    for f in files:
+        os.remove(f)
+    cell = size / (1 << depth)
+    tile_lo = lo + morton_decode(np.array([key], np.uint64))[0] * cell
+    order, nodes = build_octree(data['xyz'], node_capacity, max_depth,
+                                seed, bounds=(tile_lo, cell))
+    data = data[order]
+    num_root = int(nodes['count'][0])
+    data[num_root:].tofile(tile_file(tmp, depth, key, 'sorted'))
+    nodes = nodes[1:]
+    nodes['start'] -= num_root
+    return data[:num_root], nodes
+
+
+def add_missing_parents(nodes):
+    """
+    Add empty nodes, so that every node of level > 0 has a parent.
+    Return the nodes sorted by (level, key).
+    """
+    added = []
+    max_level = int(nodes['level'].max()) if nodes.shape[0] > 0 else 0
+    for lv in range(max_level, 0, -1):
+        keys = nodes['key'][nodes['level'] == lv]
+        for extra in added:
+            keys = np.append(keys, extra['key'][extra['level'] == lv])
+        parents = np.unique(keys >> np.uint64(3))
+        known = nodes['key'][nodes['level'] == lv - 1]
+        missing = np.setdiff1d(parents, known)
+        if missing.shape[0] == 0:
+            continue
+        extra = np.zeros(missing.shape[0], node_type)
+        extra['level'] = lv - 1
+        extra['key'] = missing
+        added.append(extra)
+    nodes = np.concatenate([nodes] + added)
+    return nodes[np.lexsort((nodes['key'], nodes['level']))]
+
+
+def build_tiles(paths, out_dir, node_capacity=20000, tile_points=2000000,
+                max_depth=20, workers=None, chunk_points=1 << 20, seed=0,
+                fields=None):
+    """
+    Convert the cloud files (pcd, ply, las/laz, e57) into a tile directory,
+    with the attribute fields of fields (see load_cloud).
+    At most about workers * tile_points points are in the memory.
+    """
+    workers = workers if workers else os.cpu_count() or 1
+    max_depth = int(np.clip(max_depth, 1, 21))
+    lo, hi, num = source_bounds(paths, chunk_points)
+    if num == 0 or not np.all(np.isfinite(lo)):
+        raise ValueError("The cloud files have no points.")
+    size = max(float(np.max(hi - lo)) * (1 + 1e-6), 1e-6)
+    depth = 0
+    while depth < max_depth - 1 and num > tile_points * 8 ** depth:
+        depth += 1
+    dtype = next(iter_cloud_chunks(paths[0], 1, fields=fields)).dtype
+
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=out_dir)
+    context = multiprocessing.get_context('spawn')
+    try:
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            # 1. split the points into tiles
+            futures = [pool.submit(partition_file, path, part, tmp, lo, size,
+                                   depth, dtype.descr, chunk_points, fields)
+                       for part, path in enumerate(paths)]
+            tiles = {}  # (depth, key): [count, parts]
+            ranges = {}
+            for part, future in enumerate(futures):
+                counts, file_ranges = future.result()
+                for key, n in counts.items():
+                    tile = tiles.setdefault((depth, key), [0, []])
+                    tile[0] += n
+                    tile[1].append(part)
+                for name, (a, b) in file_ranges.items():
+                    if name in ranges:
+                        a, b = min(a, ranges[name][0]), max(b, ranges[name][1])
+                    ranges[name] = [a, b]
+            tiles = split_large_tiles(tiles, tmp, lo, size, dtype,
+                                      tile_points, max_depth, chunk_points)
+            print("[Tiles] %d points in %d tiles" % (
+                sum(t[0] for t in tiles.values()), len(tiles)))
+
+            # 2. build the octree of every tile
+            futures = {}
+            for (d, key), (_, parts) in tiles.items():
+                futures[(d, key)] = pool.submit(
+                    build_tile, tmp, d, key, parts, dtype.descr, lo, size,
+                    node_capacity, max_depth - d, seed + len(futures))
+            tile_nodes = {}
+            roots = []
+            root_depth = []
+            for (d, key), future in futures.items():
+                root, nodes = future.result()
+                tile_nodes[(d, key)] = nodes
+                roots.append(root)
+                root_depth.append(np.full(root.shape[0], d, np.int32))
+
+        # 3. the levels above the tiles, from the root points
+        roots = np.concatenate(roots)
+        root_depth = np.concatenate(root_depth)
+        top_depth = max(int(root_depth.max()), 1)
+        order, top = build_octree(roots['xyz'], node_capacity, top_depth,
+                                  seed, bounds=(lo, size), depth=root_depth)
+        roots = roots[order]
+        write_tiles(out_dir, tmp, roots, top, tile_nodes, dtype, lo, size,
+                    node_capacity, ranges, paths)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def split_large_tiles(tiles, tmp, lo, size, dtype, tile_points, max_depth,
+                      chunk_points):
+    """
+    Split the tiles with more than tile_points points until they fit,
+    i.e. the tiles of dense regions.
+    """
+    while True:
+        large = [(d, key) for (d, key), (n, _) in tiles.items()
+                 if n > tile_points and d < max_depth - 1]
+        if not large:
+            return tiles
+        for d, key in large:
+            _, parts = tiles.pop((d, key))
+            counts = split_tile(tmp, d, key, parts, dtype, lo, size,
+                                chunk_points)
+            for child, n in counts.items():
+                tiles[(d + 1, child)] = [n, parts]
+
+
+def write_tiles(out_dir, tmp, roots, top, tile_nodes, dtype, lo, size,
+                node_capacity, ranges, paths):
+    """
+    Write the top points and the sorted points of every tile to
+    points.npy, and their nodes to nodes.npy.
+    """
+    num = roots.shape[0] + sum(int(n['count'].sum())
+                               for n in tile_nodes.values())
+    points = np.lib.format.open_memmap(
+        os.path.join(out_dir, 'points.npy'), mode='w+', dtype=dtype,
+        shape=(num,))
+    points[:roots.shape[0]] = roots
+    loc = roots.shape[0]
+    all_nodes = [top]
+    for (d, key), nodes in tile_nodes.items():
+        file = tile_file(tmp, d, key, 'sorted')
+        data = np.memmap(file, dtype, mode='r') \
+            if os.path.getsize(file) > 0 else np.empty(0, dtype)
+        for start in range(0, data.shape[0], 1 << 20):
+            part = data[start:start + (1 << 20)]
+            points[loc + start:loc + start + part.shape[0]] = part
+        del data
+        os.remove(file)
+        # levels and keys in the tile to the global ones
+        shift = (3 * nodes['level']).astype(np.uint64)
+        nodes['key'] = (np.uint64(key) << shift) | nodes['key']
+        nodes['level'] += d
+        nodes['start'] += loc
+        loc += int(nodes['count'].sum())
+        all_nodes.append(nodes)
+    points.flush()
+    del points
+    nodes = add_missing_parents(np.concatenate(all_nodes))
+    set_node_cells(nodes, lo, size)
+    link_parents(nodes)
+    np.save(os.path.join(out_dir, 'nodes.npy'), nodes)
+    meta = {'version': TILE_VERSION,
+            'num': int(num),
+            'lo': [float(v) for v in lo],
+            'size': float(size),
+            'node_capacity': int(node_capacity),
+            'max_count': int(nodes['count'].max()),
+            'field_ranges': ranges,
+            'sources': [os.path.abspath(p) for p in paths]}
+    # written last, so a directory with meta.json is complete
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
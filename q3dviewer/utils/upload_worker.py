@@ -0,0 +1,105 @@
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+import queue
+import threading
+from OpenGL.GL import *
+from q3dviewer.utils.gl_helper import resize_buffer
+from q3dviewer.Qt.QtCore import QThread
+from q3dviewer.Qt.QtGui import QOpenGLContext, QOffscreenSurface
+from q3dviewer.Qt.QtWidgets import QApplication
+
+
+class UploadJob:
+    """
+    A buffer uploaded by the UploadWorker, the render thread polls ready()
+    and takes the vbo once the fence is signaled.
+    """
+    def __init__(self, data, top, start=0, src_vbo=None, copy_bytes=0):
+        self.data = data
+        self.top = top
+        self.start = start
+        self.src_vbo = src_vbo
+        self.copy_bytes = copy_bytes
+        self.capacity = data.shape[0]
+        self.capacity_bytes = data.nbytes
+        self.vbo = None
+        self.fence = None
+        self.done = threading.Event()
+
+    def ready(self):
+        """
+        Call it from the render thread.
+        """
+        if not self.done.is_set():
+            return False
+        status = glClientWaitSync(self.fence, 0, 0)
+        if status in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED):
+            glDeleteSync(self.fence)
+            self.fence = None
+            self.data = None
+            self.src_vbo = None
+            return True
+        return False
+
+
+class UploadWorker(QThread):
+    """
+    Upload large buffers in a background thread. The worker owns an OpenGL
+    context shared with the glwidget, so the created buffers can be used by
+    the render thread as soon as their fences are signaled.
+    """
+    def __init__(self, share_context):
+        super().__init__()
+        self.surface = QOffscreenSurface()
+        self.surface.setFormat(share_context.format())
+        self.surface.create()
+        self.context = QOpenGLContext()
+        self.context.setFormat(share_context.format())
+        self.context.setShareContext(share_context)
+        if not self.context.create():
+            raise RuntimeError("Cannot create the shared OpenGL context.")
+        self.context.moveToThread(self)
+        self.jobs = queue.Queue()
+        QApplication.instance().aboutToQuit.connect(self.stop)
+        self.start()
+
+    def upload(self, data, top, start=0, src_vbo=None, copy_bytes=0):
+        """
+        Create a new vbo with the size of data, and upload data[start:top]
+        to it. The first copy_bytes of src_vbo are copied on the gpu, the
+        render thread must not modify src_vbo until the job is ready.
+        """
+        job = UploadJob(data, top, start, src_vbo, copy_bytes)
+        self.jobs.put(job)
+        return job
+
+    def run(self):
+        self.context.makeCurrent(self.surface)
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            vbo = resize_buffer(job.src_vbo, job.capacity_bytes,
+                                job.copy_bytes)
+            if job.top > job.start:
+                data = job.data[job.start:job.top]
+                glBindBuffer(GL_ARRAY_BUFFER, vbo)
+                glBufferSubData(GL_ARRAY_BUFFER,
+                                job.start * job.data.itemsize,
+                                data.nbytes, data)
+                glBindBuffer(GL_ARRAY_BUFFER, 0)
+            job.fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+            # make sure the commands are submitted before the render
+            # thread waits for the fence.
+            glFlush()
+            job.vbo = vbo
+            job.done.set()
+        self.context.doneCurrent()
+
+    def stop(self):
+        if self.isRunning():
+            self.jobs.put(None)
+            self.wait()
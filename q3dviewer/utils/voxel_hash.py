@@ -0,0 +1,110 @@
+"""
+Copyright 2024 Panasonic Advanced Technology Development Co.,Ltd. (Liu Yang)
+Distributed under MIT license. See LICENSE for more information.
+"""
+
+"""
+Vectorized voxel hash table (open addressing with linear probing),
+all operations work on whole numpy arrays of keys at once.
+"""
+
+import numpy as np
+
+
+_EMPTY = np.int64(-1)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_AXIS_BITS = 21
+_AXIS_OFFSET = 1 << (_AXIS_BITS - 1)
+_AXIS_MASK = (1 << _AXIS_BITS) - 1
+
+
+def voxel_keys(xyz, voxel_size):
+    """
+    Pack the voxel index of each point into a single int64 key
+    (21 bits per axis, +-1M voxels around the origin).
+    """
+    v = np.floor(xyz / voxel_size).astype(np.int64) + _AXIS_OFFSET
+    v &= _AXIS_MASK
+    return (v[:, 0] << (2 * _AXIS_BITS)) | (v[:, 1] << _AXIS_BITS) | v[:, 2]
+
+
+class VoxelHash:
+    def __init__(self, voxel_size, capacity=1 << 16):
+        self.voxel_size = voxel_size
+        bits = max(int(np.ceil(np.log2(max(capacity, 2)))), 4)
+        self._alloc(bits)
+
+    def _alloc(self, bits):
+        self.bits = bits
+        self.mask = np.int64((1 << bits) - 1)
+        self.table_keys = np.full(1 << bits, _EMPTY, dtype=np.int64)
+        self.table_values = np.zeros(1 << bits, dtype=np.int64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        self._alloc(self.bits)
+
+    def keys(self, xyz):
+        return voxel_keys(xyz, self.voxel_size)
+
+    def _hash(self, keys):
+        h = keys.astype(np.uint64) * _GOLDEN
+        return (h >> np.uint64(64 - self.bits)).astype(np.int64)
+
+    def _find(self, keys):
+        """
+        Return the table position of each key, or of the empty slot
+        where the key would be inserted.
+        """
+        pos = self._hash(keys)
+        pending = np.arange(keys.shape[0])
+        while pending.shape[0] > 0:
+            found = self.table_keys[pos[pending]]
+            done = (found == keys[pending]) | (found == _EMPTY)
+            pending = pending[~done]
+            pos[pending] = (pos[pending] + 1) & self.mask
+        return pos
+
+    def lookup(self, keys):
+        """
+        Return the value of each key, -1 if the key is not in the table.
+        """
+        pos = self._find(keys)
+        return np.where(self.table_keys[pos] == keys,
+                        self.table_values[pos], -1)
+
+    def insert(self, keys, values):
+        """
+        Insert or overwrite keys, keys must be unique.
+        """
+        # keep the load factor under 0.5
+        if (self.size + keys.shape[0]) * 2 > self.table_keys.shape[0]:
+            self._grow(self.size + keys.shape[0])
+        pending = np.arange(keys.shape[0])
+        while pending.shape[0] > 0:
+            pos = self._find(keys[pending])
+            exist = self.table_keys[pos] == keys[pending]
+            self.table_values[pos[exist]] = values[pending[exist]]
+            pending, pos = pending[~exist], pos[~exist]
+            # several new keys may probe into the same empty slot,
+            # the first one wins and the others try again.
+            _, win = np.unique(pos, return_index=True)
+            self.table_keys[pos[win]] = keys[pending[win]]
+            self.table_values[pos[win]] = values[pending[win]]
+            self.size += win.shape[0]
+            lose = np.ones(pending.shape[0], dtype=bool)
+            lose[win] = False
+            pending = pending[lose]
+
+    def _grow(self, min_size):
+        used = self.table_keys != _EMPTY
+        keys = self.table_keys[used]
+        values = self.table_values[used]
+        bits = self.bits
+        while (1 << bits) < min_size * 2:
+            bits += 1
+        self._alloc(bits)
+        self.insert(keys, values)
@@ -22,7 +22,6 @@ setup(
         'numpy',
         'pyside6',
         'PyOpenGL',
-        'meshio',
         'pypcd4',
         'pye57',
         'laspy',
@@ -33,9 +32,11 @@ setup(
     entry_points={
         'console_scripts': [
             'cloud_viewer = q3dviewer.tools.cloud_viewer:main',
+            'cloud_tiler = q3dviewer.tools.cloud_tiler:main',
             'ros_viewer = q3dviewer.tools.ros_viewer:main',
             'mesh_viewer = q3dviewer.tools.mesh_viewer:main',
             'gaussian_viewer = q3dviewer.tools.gaussian_viewer:main',
+            'gaussian_compact = q3dviewer.tools.gaussian_compact:main',
             'lidar_cam_calib = q3dviewer.tools.lidar_cam_calib:main',
             'lidar_calib = q3dviewer.tools.lidar_calib:main',
             'film_maker = q3dviewer.tools.film_maker:main',